@@ -0,0 +1,205 @@
+import functools
+import hashlib
+import os
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+BED_EXTENSIONS = (".bed", ".bim", ".fam")
+
+# File digests remembered by path, size and modification time
+DIGEST_MEMO_SIZE = 4096
+
+@functools.lru_cache(maxsize=None)
+def plink_version(plink_path: str) -> str:
+    """
+    Returns the version banner of a PLINK executable, e.g. "PLINK v1.90b7.2 64-bit (11 Dec 2023)".
+    """
+    result = subprocess.run([plink_path, "--version"], check=True, text=True, capture_output=True)
+    return result.stdout.strip()
+
+class BedCache:
+    """
+    Persistent cache of PLINK binary filesets (.bed/.bim/.fam) converted from TPED/TFAM files.
+
+    Entries are keyed by the SHA-256 of the TPED and TFAM contents plus the PLINK version, so the same
+    genotypes are only converted once, whatever path or request they arrive from. The least recently
+    used entries are evicted once the cache grows beyond `max_bytes`, except those leased to a PLINK run.
+
+    Args:
+        root (Path): Folder holding the cached filesets.
+        max_bytes (int): Size budget of the cache in bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        # Key -> number of callers using the fileset, which eviction leaves alone
+        self._leases: dict[str, int] = {}
+        # (path, size, mtime) of a TPED -> content digest, to avoid re-hashing unchanged files; least recently
+        # used first
+        self._digests: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "BedCache":
+        """
+        Build a cache from PLINK_BED_CACHE_DIR (default: cache/bed) and PLINK_BED_CACHE_MAX_BYTES (default: 10 GiB)
+        """
+        return cls(
+            root=Path(os.getenv("PLINK_BED_CACHE_DIR", "cache/bed")),
+            max_bytes=int(os.getenv("PLINK_BED_CACHE_MAX_BYTES", str(10 * 1024 ** 3)))
+        )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries()),
+            "bytes": sum(size for _, size, _ in self._entries()),
+            "max_bytes": self.max_bytes
+        }
+
+    @contextmanager
+    def lease(self, tped_file: str, plink_path: str, convert: Callable[[str, str, str], None]) -> Iterator[str]:
+        """
+        Yields the prefix of the binary fileset of a TPED, converting it on a cache miss.
+
+        The fileset isn't evicted until the block exits, so PLINK can read it for as long as it needs.
+
+        Args:
+            tped_file (str): The path to the TPED file (without extension).
+            plink_path (str): The path to the PLINK executable.
+            convert (Callable): Called as convert(tped_file, output_file, plink_path) to produce the fileset.
+
+        Yields:
+            str: The cached fileset path (without extension).
+        """
+        key = self._key(tped_file, plink_path)
+        prefix = self.root / key
+
+        # Leased under the key lock, which eviction holds while it removes the entry
+        with self._key_lock(key):
+            if self._is_complete(prefix):
+                os.utime(f"{prefix}.bed")
+                with self._lock:
+                    self.hits += 1
+                    self._leases[key] = self._leases.get(key, 0) + 1
+            else:
+                with self._lock:
+                    self.misses += 1
+                temp_prefix = self.root / f".convert-{uuid.uuid4().hex}"
+                try:
+                    convert(tped_file, str(temp_prefix), plink_path)
+                    # .fam is moved last, so a fileset is complete once its .fam exists
+                    for ext in BED_EXTENSIONS:
+                        os.replace(f"{temp_prefix}{ext}", f"{prefix}{ext}")
+                finally:
+                    for leftover in self.root.glob(f"{temp_prefix.name}.*"):
+                        leftover.unlink(missing_ok=True)
+                with self._lock:
+                    self._leases[key] = self._leases.get(key, 0) + 1
+
+        try:
+            self._evict(keep=key)
+            yield str(prefix)
+        finally:
+            with self._lock:
+                self._leases[key] -= 1
+                if not self._leases[key]:
+                    del self._leases[key]
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def genotype_digest(self, tped_file: str) -> str:
+        """
+        Returns the SHA-256 identifying the contents of a TPED/TFAM pair (path without extension).
+
+        File digests are memoised by path, size and modification time, so unchanged files are hashed once.
+        """
+        sha256 = hashlib.sha256()
+        for ext in (".tped", ".tfam"):
+            sha256.update(self._digest(f"{tped_file}{ext}").encode())
+        return sha256.hexdigest()
+
+    def _key(self, tped_file: str, plink_path: str) -> str:
+        sha256 = hashlib.sha256()
+        for ext in (".tped", ".tfam"):
+            sha256.update(self._digest(f"{tped_file}{ext}").encode())
+        sha256.update(plink_version(plink_path).encode())
+        return sha256.hexdigest()
+
+    def _digest(self, path: str) -> str:
+        stat = os.stat(path)
+        memo_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(memo_key)
+            if digest is not None:
+                self._digests.move_to_end(memo_key)
+                return digest
+
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        with self._lock:
+            self._digests[memo_key] = digest
+            while len(self._digests) > DIGEST_MEMO_SIZE:
+                self._digests.popitem(last=False)
+        return digest
+
+    @staticmethod
+    def _is_complete(prefix: Path) -> bool:
+        return all(os.path.exists(f"{prefix}{ext}") for ext in BED_EXTENSIONS)
+
+    def _entries(self) -> list[tuple[str, int, float]]:
+        """
+        Lists the complete cache entries as (key, size in bytes, last use time).
+        """
+        entries = []
+        for bed in self.root.glob("*.bed"):
+            prefix = bed.with_suffix("")
+            if bed.name.startswith(".") or not self._is_complete(prefix):
+                continue
+            try:
+                size = sum(os.path.getsize(f"{prefix}{ext}") for ext in BED_EXTENSIONS)
+                entries.append((prefix.name, size, bed.stat().st_mtime))
+            except FileNotFoundError:
+                # Evicted concurrently
+                continue
+        return entries
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """
+        Removes the least recently used entries until the cache fits its size budget; leased entries are kept.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            with self._key_lock(key):
+                with self._lock:
+                    leased = key in self._leases
+                if leased:
+                    continue
+                for ext in BED_EXTENSIONS:
+                    Path(f"{self.root / key}{ext}").unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
@@ -0,0 +1,74 @@
+"""
+Benchmark of the PLINK report readers: plink_reports.read_genome against the former
+pandas.read_csv(sep="\\s+") + pl.from_pandas path, on a synthetic .genome file.
+
+Usage:
+    python benchmarks/plink_reports.py --pairs 2000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import polars as pl
+
+from plink_reports import read_genome
+
+GENOME_HEADER = ["FID1", "IID1", "FID2", "IID2", "RT", "EZ", "Z0", "Z1", "Z2", "PI_HAT", "PHE", "DST", "PPC", "RATIO"]
+
+def write_genome_file(path: Path, pairs: int, seed: int = 0) -> None:
+    """
+    Writes a .genome file with `pairs` rows, right-aligned like PLINK 1.9 output.
+    """
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        f.write(" ".join(f"{column:>8}" for column in GENOME_HEADER) + "\n")
+        for i in range(pairs):
+            z0, z1 = rng.random(), rng.random()
+            z0, z1 = z0 / (z0 + z1 + 1), z1 / (z0 + z1 + 1)
+            z2 = 1 - z0 - z1
+            f.write(
+                f"{289:>8} {100000 + i % 5000:>8} {289:>8} {200000 + i // 5000:>8} {'UN':>8} {'NA':>8} "
+                f"{z0:>8.4f} {z1:>8.4f} {z2:>8.4f} {z1 / 2 + z2:>8.4f} {-1:>8} {rng.random():>8.6f} "
+                f"{rng.random():>8.4f} {rng.random() * 20:>8.4f}\n"
+            )
+
+def _read_with_pandas(path: Path) -> pl.DataFrame:
+    import pandas as pd
+
+    return pl.from_pandas(pd.read_csv(path, sep="\\s+"))
+
+def _time(label: str, func, path: Path, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frame = func(path)
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<28} {best:8.3f}s  {frame.height / best:>14,.0f} rows/s  {frame.estimated_size('mb'):8.1f} MB")
+    return best
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=1_000_000, help="Number of rows in the .genome file")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per reader; the best time is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = Path(folder) / "benchmark.genome"
+        write_genome_file(path, args.pairs)
+        print(f"{path.name}: {args.pairs:,} pairs, {os.path.getsize(path) / 1024 ** 2:.1f} MB")
+
+        native = _time("plink_reports.read_genome", read_genome, path, args.repeat)
+        try:
+            baseline = _time("pandas + pl.from_pandas", _read_with_pandas, path, args.repeat)
+            print(f"speed-up: {baseline / native:.1f}x")
+        except ImportError:
+            print("pandas is not installed; skipping the baseline")
+
+if __name__ == "__main__":
+    main()
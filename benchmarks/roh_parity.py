@@ -0,0 +1,93 @@
+"""
+Parity check of the in-process ROH engine (roh_engine.native_roh) against PLINK --homozyg.
+
+Runs both on each TPED/TFAM pair and compares, per individual, the number of segments, the total
+ROH length and the overlap of the SNPs covered by segments. Exits with status 1 if any input is
+outside the tolerances. tests/test_roh_parity.py runs the same comparison under pytest against
+PLINK reports checked in as fixtures.
+
+Usage:
+    python benchmarks/roh_parity.py uploads/store/<digest>/289_105581 [more prefixes...] --plink plink/plink
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import polars as pl
+
+from plink_integration import plink_roh
+from roh_engine import native_roh
+
+def _covered(hom: pl.DataFrame) -> set[tuple[str, int, int]]:
+    """
+    (IID, CHR, position) of the segment ends, bucketed to 10 kb, to compare coverage without the SNP map.
+    """
+    covered = set()
+    for iid, chromosome, pos1, pos2 in hom.select(["IID", "CHR", "POS1", "POS2"]).iter_rows():
+        covered.update((str(iid), chromosome, bucket) for bucket in range(pos1 // 10_000, pos2 // 10_000 + 1))
+    return covered
+
+def parity(plink: list[pl.DataFrame], native: list[pl.DataFrame]) -> dict[str, float]:
+    """
+    Compares .hom/.hom.indiv frames of PLINK and of the native engine.
+
+    Returns:
+        dict[str, float]: The worst relative error of an individual's total ROH length ("worst_kb"), the
+            share of ROH coverage found by both engines ("overlap"), and the individuals whose number of
+            segments differs ("nseg_mismatches").
+    """
+    plink_hom, plink_indiv = plink
+    native_hom, native_indiv = native
+    joined = plink_indiv.select(["IID", "NSEG", "KB"]).join(
+        native_indiv.select(["IID", "NSEG", "KB"]), on="IID", suffix="_native"
+    )
+    kb_error = (
+        (pl.col("KB_native") - pl.col("KB")).abs() / pl.max_horizontal(pl.col("KB"), pl.lit(1.0))
+    )
+    plink_covered, native_covered = _covered(plink_hom), _covered(native_hom)
+    union = plink_covered | native_covered
+    return {
+        "worst_kb": joined.select(kb_error.max()).item() or 0.0,
+        "overlap": len(plink_covered & native_covered) / len(union) if union else 1.0,
+        "nseg_mismatches": joined.filter(pl.col("NSEG") != pl.col("NSEG_native")).height
+    }
+
+def compare(tfile: Path, plink_path: Path, kb_tolerance: float, overlap_tolerance: float) -> bool:
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        plink_hom, plink_indiv = plink_roh(tfile, Path(folder) / "roh", plink_path=plink_path)
+        plink_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    native_hom, native_indiv = native_roh(tfile)
+    native_time = time.perf_counter() - start
+
+    result = parity([plink_hom, plink_indiv], [native_hom, native_indiv])
+    ok = result["worst_kb"] <= kb_tolerance and result["overlap"] >= 1 - overlap_tolerance
+    print(f"{tfile}: {'OK' if ok else 'MISMATCH'}")
+    print(f"  segments  plink={plink_hom.height} native={native_hom.height}")
+    print(f"  worst relative total-KB error {result['worst_kb']:.4f}, coverage overlap {result['overlap']:.4f}")
+    print(f"  time      plink={plink_time:.3f}s native={native_time:.3f}s")
+    if not ok:
+        print(plink_indiv.join(native_indiv, on="IID", suffix="_native"))
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("tfiles", nargs="+", type=Path, help="TPED/TFAM paths without extension")
+    parser.add_argument("--plink", type=Path, default=Path("plink/plink"), help="PLINK executable")
+    parser.add_argument("--kb-tolerance", type=float, default=0.05,
+                        help="Maximum relative error of an individual's total ROH length")
+    parser.add_argument("--overlap-tolerance", type=float, default=0.05,
+                        help="Maximum share of ROH coverage found by only one of the engines")
+    args = parser.parse_args()
+
+    results = [compare(tfile, args.plink, args.kb_tolerance, args.overlap_tolerance) for tfile in args.tfiles]
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
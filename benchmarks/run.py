@@ -0,0 +1,215 @@
+"""
+Times each stage of the upload -> load -> analysis pipeline on synthetic genotypes (see synthetic.py)
+and saves the timings as JSON, so runs of different versions can be compared.
+
+Stages: upload save (UploadStore.put), unzip_file, process_zip (extracted and streamed), read_tped,
+iter_tped_chromosomes, map_bases, the native ROH/IBD engines, response serialization (JSON, NDJSON,
+Arrow) and, when enabled, the database loaders and the PLINK steps (--make-bed, --merge-list,
+--genome, --homozyg).
+
+Usage:
+    python benchmarks/run.py --snps 220000 --dogs 10 --output benchmark.json
+    python benchmarks/run.py --plink plink/plink --db --output new.json --compare benchmark.json
+
+--db loads one synthetic dog into the tables of the database configured by the PG* variables
+(use a local, disposable database). --compare exits with status 1 if any stage's median is more
+than --threshold slower than in the baseline file.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import polars as pl
+
+from benchmarks.synthetic import generate
+from genotypes import TPED_COLUMNS, iter_tped_chromosomes, map_bases, read_tped
+from ibd_engine import native_parentage
+from responses import iter_arrow, iter_json, iter_ndjson
+from roh_engine import native_roh
+from upload_store import UploadStore
+from zip_file_handler import unzip_file
+
+def time_stage(results: dict, name: str, func: Callable[[], Any], repeat: int,
+               rows: Optional[int] = None) -> Any:
+    """
+    Runs `func` `repeat` times, records its wall times under `name` and returns its last result.
+    """
+    runs = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        runs.append(time.perf_counter() - start)
+
+    median = statistics.median(runs)
+    results[name] = {"seconds": runs, "median": median, "min": min(runs)}
+    if rows is not None:
+        results[name].update(rows=rows, rows_per_second=rows / median if median > 0 else None)
+    print(f"{name:<28} median {median:9.4f}s  min {min(runs):9.4f}s"
+          + (f"  {rows / median:12,.0f} rows/s" if rows and median > 0 else ""))
+    return value
+
+def _metadata(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "polars": pl.__version__,
+        "numpy": np.__version__,
+        "params": {"snps": args.snps, "dogs": args.dogs, "missing": args.missing, "repeat": args.repeat,
+                   "seed": args.seed}
+    }
+
+def run(args: argparse.Namespace, folder: Path) -> dict:
+    results: dict[str, dict] = {}
+    manifest = generate(folder / "synthetic", dogs=args.dogs, snps=args.snps, missing=args.missing, trios=1,
+                        seed=args.seed)
+    trio = manifest["trios"][0]
+    archive = Path(manifest["dogs"][trio["offspring"]])
+    tfiles = {role: archive.with_name(trio[role]) for role in ("offspring", "sire", "dam")}
+
+    # Upload and unzip
+    def save_upload() -> None:
+        store = UploadStore(Path(tempfile.mkdtemp(dir=folder)))
+        with open(archive, "rb") as f:
+            store.put(f)
+    time_stage(results, "upload_save", save_upload, args.repeat)
+    time_stage(results, "unzip_file", lambda: unzip_file(archive, Path(tempfile.mkdtemp(dir=folder))), args.repeat)
+
+    # Parsing: process_zip imports the database driver, which is only needed from here on
+    import db_connection
+    # Extracted next to the other temporary files, not into the service's uploads/ folder
+    with tempfile.TemporaryDirectory(dir=folder) as extracted:
+        tped = time_stage(results, "process_zip",
+                          lambda: db_connection.process_zip(str(archive), output_folder=Path(extracted)),
+                          args.repeat, rows=args.snps)
+    time_stage(results, "process_zip_streamed", lambda: db_connection.process_zip(str(archive), extract=False),
+               args.repeat, rows=args.snps)
+    time_stage(results, "read_tped", lambda: read_tped(tfiles["offspring"].with_suffix(".tped")), args.repeat,
+               rows=args.snps)
+    time_stage(results, "iter_tped_chromosomes",
+               lambda: sum(1 for _ in iter_tped_chromosomes(tfiles["offspring"].with_suffix(".tped"))), args.repeat,
+               rows=args.snps)
+    # Alleles as read before they were decoded during the scan
+    raw = pl.read_csv(tfiles["offspring"].with_suffix(".tped"), separator="\t", has_header=False,
+                      new_columns=TPED_COLUMNS, infer_schema=False)
+    time_stage(results, "map_bases", lambda: map_bases(raw), args.repeat, rows=args.snps)
+
+    # Database loaders
+    if args.db:
+        time_stage(results, "db_tbl_loci", lambda: db_connection.add_to_tbl_loci(tped), 1, rows=args.snps)
+        time_stage(results, "db_tbl_alleles",
+                   lambda: db_connection.add_to_tbl_alleles(tped, args.db_dog, args.db_source), 1, rows=args.snps)
+        time_stage(results, "db_tbl_packed_genotypes",
+                   lambda: db_connection.add_to_tbl_packed_genotypes(tped, args.db_dog, args.db_source), 1,
+                   rows=args.snps)
+
+    # Analyses
+    roh = time_stage(results, "native_roh", lambda: native_roh(tfiles["offspring"]), args.repeat, rows=args.snps)
+    genome, _ = time_stage(
+        results, "native_parentage",
+        lambda: native_parentage(*(tfiles[role].with_suffix(".tped") for role in ("offspring", "sire", "dam"))),
+        args.repeat, rows=args.snps
+    )
+
+    if args.plink:
+        roh, genome = run_plink(results, args, folder, tfiles)
+
+    # Serialization of the response bodies
+    roh_body = {"roh_results": roh[0], "roh_indiv_results": roh[1]}
+    time_stage(results, "serialize_json_roh", lambda: "".join(iter_json(roh_body)), args.repeat)
+    time_stage(results, "serialize_json_genome", lambda: "".join(iter_json({"genome_results": genome})), args.repeat)
+    time_stage(results, "serialize_ndjson_genome", lambda: "".join(iter_ndjson({"genome_results": genome})),
+               args.repeat)
+    time_stage(results, "serialize_arrow_genome",
+               lambda: b"".join(iter_arrow(genome)), args.repeat)
+    return results
+
+def run_plink(results: dict, args: argparse.Namespace, folder: Path,
+              tfiles: dict[str, Path]) -> tuple[list[pl.DataFrame], pl.DataFrame]:
+    """
+    Times the PLINK steps of /snp_roh and /snp_parentage, without the binary fileset cache.
+    """
+    from plink_integration import (_plink_convert_tped_to_bim, _plink_genome, _plink_merge_bim_files,
+                                   plink_roh)
+    plink = str(args.plink)
+    out = folder / "plink"
+    out.mkdir(exist_ok=True)
+
+    for role, tfile in tfiles.items():
+        time_stage(results, f"plink_make_bed_{role}",
+                   lambda: _plink_convert_tped_to_bim(str(tfile), str(out / role), plink), args.repeat,
+                   rows=args.snps)
+    time_stage(results, "plink_merge",
+               lambda: _plink_merge_bim_files(str(out / "offspring"), [str(out / "sire"), str(out / "dam")],
+                                              str(out / "merged"), plink), args.repeat)
+    genome = time_stage(results, "plink_genome", lambda: _plink_genome(str(out / "merged"), out / "trio", plink),
+                        args.repeat)
+    roh = time_stage(results, "plink_homozyg", lambda: plink_roh(tfiles["offspring"], out / "roh", plink),
+                     args.repeat, rows=args.snps)
+    return roh, genome
+
+def compare(results: dict, baseline_path: Path, threshold: float) -> bool:
+    """
+    Prints each stage's median against a baseline run; returns False if any stage regressed.
+    """
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)["stages"]
+
+    ok = True
+    print(f"\n{'stage':<28} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, stage in results.items():
+        if name not in baseline:
+            print(f"{name:<28} {'-':>10} {stage['median']:10.4f}")
+            continue
+        ratio = stage["median"] / baseline[name]["median"] if baseline[name]["median"] > 0 else float("inf")
+        regressed = ratio > 1 + threshold
+        ok = ok and not regressed
+        print(f"{name:<28} {baseline[name]['median']:10.4f} {stage['median']:10.4f} {ratio:7.2f}"
+              + ("  REGRESSION" if regressed else ""))
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snps", type=int, default=220_000)
+    parser.add_argument("--dogs", type=int, default=4, help="founders in the synthetic cohort")
+    parser.add_argument("--missing", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--plink", type=Path, help="PLINK executable; PLINK stages are skipped without it")
+    parser.add_argument("--db", action="store_true", help="also time the database loaders")
+    parser.add_argument("--db-dog", type=int, default=-1, help="dog ID used for the database loaders")
+    parser.add_argument("--db-source", type=int, default=-1, help="source ID used for the database loaders")
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    parser.add_argument("--compare", type=Path, help="baseline JSON written by an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="tolerated slowdown against the baseline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        results = run(args, Path(folder))
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": _metadata(args), "stages": results}, f, indent=2)
+    print(f"Saved {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
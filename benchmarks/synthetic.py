@@ -0,0 +1,152 @@
+"""
+Synthetic dog genotypes for benchmarks: one single-sample TPED/TFAM pair per dog, zipped like the
+uploads /snp_upload expects, plus a manifest of the simulated trios.
+
+Founders are drawn under Hardy-Weinberg equilibrium from per-locus allele frequencies; each trio
+offspring inherits one allele from each of two founders. Optional runs of homozygosity copy one
+haplotype over the other on stretches of a chromosome, and missing calls are written as 0 0.
+
+Usage:
+    python benchmarks/synthetic.py out/synthetic --dogs 50 --snps 220000 --missing 0.01 --trios 5
+"""
+import argparse
+import json
+import sys
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import polars as pl
+
+from genotypes import DOG_AUTOSOMES
+
+_BASES = np.array(["0", "A", "C", "G", "T"])
+
+def simulate_loci(n_snps: int, rng: np.random.Generator) -> pl.DataFrame:
+    """
+    Loci spread over the 38 autosomes and X, with two distinct alleles and an allele frequency each.
+    """
+    chromosomes = np.sort(rng.integers(1, DOG_AUTOSOMES + 2, n_snps))
+    positions = np.zeros(n_snps, dtype=np.int64)
+    for chromosome in np.unique(chromosomes):
+        index = np.flatnonzero(chromosomes == chromosome)
+        # Distinct, increasing positions on a ~120 Mb chromosome
+        positions[index] = np.sort(rng.integers(1, 120_000_000, len(index))) + np.arange(len(index))
+
+    ref = rng.integers(1, 5, n_snps)
+    alt = (ref + rng.integers(1, 4, n_snps) - 1) % 4 + 1
+    return pl.DataFrame({
+        "chromossome": np.where(chromosomes > DOG_AUTOSOMES, "X", chromosomes.astype(str)),
+        "locusID": [f"synthetic_{i}" for i in range(n_snps)],
+        "geneticDistance": np.zeros(n_snps, dtype=np.int64),
+        "distance": positions,
+        "ref": ref.astype(np.uint8),
+        "alt": alt.astype(np.uint8),
+        "frequency": rng.beta(0.8, 0.8, n_snps)
+    })
+
+def simulate_haplotypes(loci: pl.DataFrame, n_dogs: int, rng: np.random.Generator,
+                        roh_segments: int = 0, roh_snps: int = 500) -> np.ndarray:
+    """
+    (dogs x 2 x SNPs) founder haplotypes of alternate-allele indicators, with `roh_segments` stretches
+    of `roh_snps` SNPs per dog where both haplotypes are identical.
+    """
+    frequency = loci["frequency"].to_numpy()
+    haplotypes = rng.random((n_dogs, 2, len(frequency))) < frequency
+    for dog in range(n_dogs):
+        for start in rng.integers(0, max(len(frequency) - roh_snps, 1), roh_segments):
+            haplotypes[dog, 1, start:start + roh_snps] = haplotypes[dog, 0, start:start + roh_snps]
+    return haplotypes
+
+def transmit(sire: np.ndarray, dam: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Offspring haplotypes: one randomly chosen allele per locus from each parent (no linkage).
+    """
+    snps = np.arange(sire.shape[1])
+    return np.stack([
+        sire[rng.integers(0, 2, len(snps)), snps],
+        dam[rng.integers(0, 2, len(snps)), snps]
+    ])
+
+def write_dog(folder: Path, name: str, loci: pl.DataFrame, haplotypes: np.ndarray, missing: float,
+              rng: np.random.Generator, sex: int = 0) -> Path:
+    """
+    Writes a dog's TPED/TFAM pair and the zip archive holding them; returns the archive path.
+    """
+    ref = loci["ref"].to_numpy()
+    alt = loci["alt"].to_numpy()
+    first = np.where(haplotypes[0], alt, ref)
+    second = np.where(haplotypes[1], alt, ref)
+    dropped = rng.random(len(ref)) < missing
+    first[dropped] = 0
+    second[dropped] = 0
+
+    tped = folder / f"{name}.tped"
+    tfam = folder / f"{name}.tfam"
+    loci.select(["chromossome", "locusID", "geneticDistance", "distance"]).with_columns(
+        pl.Series("firstAllele", _BASES[first]),
+        pl.Series("secondAllele", _BASES[second])
+    ).write_csv(tped, separator="\t", include_header=False)
+    with open(tfam, "w") as f:
+        f.write(f"{name} {name} 0 0 {sex} -9\n")
+
+    archive = folder / f"{name}.zip"
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        z.write(tped, tped.name)
+        z.write(tfam, tfam.name)
+    return archive
+
+def generate(folder: Path, dogs: int = 10, snps: int = 220_000, missing: float = 0.01, trios: int = 1,
+             roh_segments: int = 5, seed: int = 0) -> dict:
+    """
+    Writes `dogs` founders and `trios` offspring of random founder pairs into `folder`.
+
+    Returns:
+        dict: The manifest also written to folder/manifest.json: parameters, dog archives and trios.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    loci = simulate_loci(snps, rng)
+    founders = simulate_haplotypes(loci, dogs, rng, roh_segments=roh_segments)
+
+    manifest = {
+        "params": {"dogs": dogs, "snps": snps, "missing": missing, "trios": trios,
+                   "roh_segments": roh_segments, "seed": seed},
+        "dogs": {},
+        "trios": []
+    }
+    for dog in range(dogs):
+        name = f"dog{dog}"
+        manifest["dogs"][name] = str(write_dog(folder, name, loci, founders[dog], missing, rng, sex=1 + dog % 2))
+
+    for trio in range(trios):
+        sire, dam = rng.choice(dogs, 2, replace=False)
+        name = f"offspring{trio}"
+        manifest["dogs"][name] = str(write_dog(folder, name, loci, transmit(founders[sire], founders[dam], rng),
+                                               missing, rng))
+        manifest["trios"].append({"offspring": name, "sire": f"dog{sire}", "dam": f"dog{dam}"})
+
+    with open(folder / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--dogs", type=int, default=10, help="number of founders")
+    parser.add_argument("--snps", type=int, default=220_000)
+    parser.add_argument("--missing", type=float, default=0.01, help="share of missing calls per dog")
+    parser.add_argument("--trios", type=int, default=1, help="number of offspring of two founders")
+    parser.add_argument("--roh-segments", type=int, default=5, help="homozygous stretches per founder")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.folder, dogs=args.dogs, snps=args.snps, missing=args.missing, trios=args.trios,
+                        roh_segments=args.roh_segments, seed=args.seed)
+    print(f"Wrote {len(manifest['dogs'])} dogs and {len(manifest['trios'])} trios to {args.folder}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+import fcntl
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import polars as pl
+
+from genotype_packing import (CALLS_PER_BYTE, HET, HOM_ALT, HOM_REF, MISSING, LocusPanel, align_to_panel,
+                              build_panel, decode_calls, encode_calls, extend_panel)
+from genotypes import TFAM_COLUMNS, read_tfam, read_tped, tped_calls
+
+# SNP-major .bed header, the layout PLINK reads as it is: one row of packed calls per locus, a 2-bit slot
+# per dog. New loci are appended as rows; a new dog fills a spare slot of every row in place, and the rows
+# are only widened (a rewrite of the .bed) once the spare slots run out.
+BED_MAGIC = bytes([0x6C, 0x1B, 0x01])
+
+# Loci rewritten at a time when the .bed rows grow
+_BLOCK_LOCI = 16384
+
+# Spare slots are .fam rows of this FID (never a dog ID); PLINK reads them as dogs with no calls
+_SPARE_FID = "_spare"
+
+# Widened rows hold this many times the slots in use, so rewrites get rarer as the cohort grows
+_GROWTH = 1.5
+
+# PLINK .bed genotype codes, with the panel's alternate allele as A1 and reference allele as A2
+_TO_BED = np.array([0b01, 0b11, 0b10, 0b00], dtype=np.uint8)    # indexed by genotype_packing code
+_FROM_BED = np.array([HOM_ALT, MISSING, HET, HOM_REF], dtype=np.uint8)    # indexed by .bed code
+
+_BASES = np.array(["0", "A", "C", "G", "T"])
+
+_FAM_SCHEMA = {"FID": pl.String, "IID": pl.String, "PAT": pl.String, "MAT": pl.String, "SEX": pl.Int8,
+               "PHE": pl.Int32}
+
+def _unpack_rows(packed: np.ndarray, n_loci: int) -> np.ndarray:
+    """
+    Unpacks (rows x bytes) packed calls into (rows x n_loci) 2-bit codes.
+    """
+    shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+    return ((packed[:, :, None] >> shifts) & 0b11).reshape(len(packed), -1)[:, :n_loci]
+
+def _pack_rows(codes: np.ndarray) -> np.ndarray:
+    """
+    Packs (rows x n) 2-bit codes into (rows x bytes) packed calls, the first call in the lowest two bits.
+    """
+    padded = np.zeros((len(codes), -(-codes.shape[1] // CALLS_PER_BYTE) * CALLS_PER_BYTE), dtype=np.uint8)
+    padded[:, :codes.shape[1]] = codes
+    quads = padded.reshape(len(codes), -1, CALLS_PER_BYTE)
+    return quads[:, :, 0] | (quads[:, :, 1] << 2) | (quads[:, :, 2] << 4) | (quads[:, :, 3] << 6)
+
+class Cohort:
+    """
+    Standing PLINK binary fileset ({root}/cohort.bed/.bim/.fam) holding every ingested dog.
+
+    Dogs are identified by their dog ID (FID = IID). The .bed is SNP-major, so PLINK runs on it without
+    transposing the cohort first. The loci come from an append-only index ({root}/cohort.loci.parquet:
+    locusID, as in tbl_loci, with chromosome, position and alleles), and a dog bringing loci the cohort
+    hasn't seen yet appends their rows. Adding a dog sets its 2-bit slot in each row in place (a dog added
+    again overwrites its own slot). Rows keep spare slots at their end, listed in the .fam as samples with
+    FID _spare and no calls (PLINK runs on the cohort select dogs with --keep); the .bed is only rewritten
+    when they run out, widening the rows _GROWTH times, so most new dogs are written in place.
+
+    Writers hold an exclusive lock on {root}/cohort.lock and readers a shared one (see reading), so
+    processes sharing the directory, e.g. the API and ingest.py, never see a half-written fileset.
+
+    Args:
+        root (Path): Directory of the fileset.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "Cohort":
+        """
+        Build the cohort stored in COHORT_DIR (default: cohort)
+        """
+        return cls(Path(os.getenv("COHORT_DIR", "cohort")))
+
+    @property
+    def prefix(self) -> Path:
+        """PLINK --bfile prefix of the fileset."""
+        return self.root / "cohort"
+
+    @property
+    def _bed(self) -> Path:
+        return self.prefix.with_suffix(".bed")
+
+    @property
+    def _fam(self) -> Path:
+        return self.prefix.with_suffix(".fam")
+
+    @property
+    def _bim(self) -> Path:
+        return self.prefix.with_suffix(".bim")
+
+    @property
+    def _loci(self) -> Path:
+        return self.root / "cohort.loci.parquet"
+
+    @contextmanager
+    def _locked(self, shared: bool = False) -> Iterator[None]:
+        # flock locks belong to the open file, so threads of one process exclude each other as well
+        with open(self.root / "cohort.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """
+        Holds the fileset's shared lock, so no dog is written while e.g. PLINK reads it.
+        """
+        with self._locked(shared=True):
+            yield
+
+    def samples(self) -> pl.DataFrame:
+        """The cohort's dogs (.fam rows), in .bed slot order."""
+        return self._slots().filter(pl.col("FID") != _SPARE_FID)
+
+    def _slots(self) -> pl.DataFrame:
+        """All the .fam rows: the dogs, then the spare slots."""
+        if not self._fam.exists():
+            return pl.DataFrame(schema=_FAM_SCHEMA)
+        return read_tfam(self._fam).cast(_FAM_SCHEMA)
+
+    def loci(self) -> pl.DataFrame:
+        """The cohort's locus index, in .bim order."""
+        if not self._loci.exists():
+            return pl.DataFrame(schema={"locusID": pl.String, "chromosome": pl.Int8, "position": pl.Int64,
+                                        "ref": pl.UInt8, "alt": pl.UInt8})
+        return pl.read_parquet(self._loci)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "dogs": self.samples().height,
+            "loci": self.loci().height,
+            "bytes": self._bed.stat().st_size if self._bed.exists() else 0
+        }
+
+    def add(self, dog_id: int, tped_file: Path) -> int:
+        """
+        Appends a dog to the cohort, or replaces its row if it is already there.
+
+        Args:
+            dog_id (int): Dog ID, used as FID and IID.
+            tped_file (Path): The path to the dog's single-sample .tped file (the .tfam next to it, if any,
+                provides the sex).
+
+        Returns:
+            int: The dog's row in the cohort.
+        """
+        tped_file = Path(tped_file)
+        tfam_file = tped_file.with_suffix(".tfam")
+        sex = read_tfam(tfam_file)["SEX"][0] if tfam_file.exists() else None
+        return self.add_calls(dog_id, tped_calls(read_tped(tped_file)), sex)
+
+    def add_calls(self, dog_id: int, calls: dict[str, np.ndarray], sex: Optional[int] = None) -> int:
+        """
+        Appends a dog's calls (in the layout of genotypes.tped_calls) to the cohort, see add.
+        """
+        return self.add_many([(dog_id, calls, sex)])[0]
+
+    def add_many(self, dogs: list[tuple[int, dict[str, np.ndarray], Optional[int]]]) -> list[int]:
+        """
+        Appends dogs to the cohort, or replaces their rows, rewriting the .bed at most once for the batch.
+
+        Args:
+            dogs (list[tuple]): (dog ID, calls in the layout of genotypes.tped_calls, sex or None) of each dog;
+                the last calls of a dog listed twice win.
+
+        Returns:
+            list[int]: Each dog's row in the cohort (its line of the .fam).
+        """
+        if not dogs:
+            return []
+
+        with self._locked():
+            old_loci = self.loci()
+            slots = self._slots().height
+            samples = self.samples()
+            loci = old_loci
+            for _, calls, _ in dogs:
+                panel, loci = self._extend(loci, calls)
+
+            rows = {iid: index for index, iid in enumerate(samples["IID"].cast(pl.String).to_list())}
+            new_samples = []
+            indices = []
+            for dog_id, _, sex in dogs:
+                iid = str(dog_id)
+                if iid not in rows:
+                    rows[iid] = len(rows)
+                    new_samples.append([iid, iid, "0", "0", sex or 0, -9])
+                indices.append(rows[iid])
+
+            # Alleles are only filled in, so the dogs' codes against the final panel are the ones they'd get
+            # added one by one
+            codes = np.empty((len(dogs), loci.height), dtype=np.uint8)
+            for i, (_, calls, _) in enumerate(dogs):
+                first, second = align_to_panel(panel, calls["locus_id"], calls["first"], calls["second"])
+                codes[i] = _TO_BED[encode_calls(first, second, panel.ref, panel.alt)]
+
+            n_dogs, n_slots = len(rows), slots
+            if not self._bed.exists() or n_dogs > slots:
+                # Whole bytes of slots, at least _GROWTH times the old ones
+                n_slots = self._row_bytes(max(n_dogs, int(slots * _GROWTH))) * CALLS_PER_BYTE
+                self._rewrite(slots if self._bed.exists() else 0, old_loci.height, n_slots, indices, codes)
+            else:
+                self._update(slots, old_loci.height, indices, codes)
+            # Dogs typed on known loci and alleles leave the index as it is
+            if not loci.equals(old_loci):
+                self._write_loci(loci)
+            if new_samples or n_slots != slots:
+                spares = [[_SPARE_FID, f"_spare{i}", "0", "0", 0, -9] for i in range(n_slots - n_dogs)]
+                self._write_fam(pl.concat([
+                    samples,
+                    pl.DataFrame(new_samples + spares, schema=_FAM_SCHEMA, orient="row")
+                ]))
+            return indices
+
+    def codes(self, dog_ids: Optional[list[int]] = None) -> tuple[pl.DataFrame, np.ndarray]:
+        """
+        Reads dogs' calls as (dogs x loci) genotype_packing codes, in locus index order.
+
+        Args:
+            dog_ids (list[int]): Dogs to read (default: the whole cohort).
+
+        Returns:
+            tuple[pl.DataFrame, np.ndarray]: The dogs' .fam rows and their codes.
+        """
+        with self.code_blocks(dog_ids) as (samples, _, blocks):
+            return samples, np.concatenate([np.empty((samples.height, 0), dtype=np.uint8), *blocks], axis=1)
+
+    @contextmanager
+    def code_blocks(self, dog_ids: Optional[list[int]] = None,
+                    block_loci: int = 16384) -> Iterator[tuple[pl.DataFrame, pl.DataFrame, Iterator[np.ndarray]]]:
+        """
+        Reads dogs' calls as genotype_packing codes a block of loci at a time, without unpacking them all at once.
+
+        The fileset's shared lock is held until the context exits, so the blocks are read while no dog is
+        written.
+
+        Args:
+            dog_ids (list[int]): Dogs to read (default: the whole cohort).
+            block_loci (int): Loci per block.
+
+        Yields:
+            tuple[pl.DataFrame, pl.DataFrame, Iterator[np.ndarray]]: The dogs' .fam rows, the locus index, and
+                the (dogs x loci) code blocks in locus index order.
+        """
+        with self._locked(shared=True):
+            samples = self.samples().with_row_index("row")
+            loci = self.loci()
+            n_dogs = samples.height
+            rows = self._rows(self._slots().height, loci.height)
+            if dog_ids is not None:
+                samples = self._lookup(samples, dog_ids)
+            columns = None if dog_ids is None else samples["row"].to_numpy()
+            yield samples.select(TFAM_COLUMNS), loci, self._blocks(rows, n_dogs, columns, block_loci)
+
+    @staticmethod
+    def _blocks(rows: np.ndarray, n_dogs: int, columns: Optional[np.ndarray],
+                block_loci: int) -> Iterator[np.ndarray]:
+        """
+        Unpacks (loci x bytes) rows into (dogs x loci) genotype_packing code blocks: the first `n_dogs` slots,
+        or the slots at `columns`.
+        """
+        for start in range(0, len(rows), block_loci):
+            packed = np.asarray(rows[start:start + block_loci])
+            if columns is None:
+                codes = _unpack_rows(packed, n_dogs)
+            else:
+                shifts = (2 * (columns % CALLS_PER_BYTE)).astype(np.uint8)
+                codes = (packed[:, columns // CALLS_PER_BYTE] >> shifts) & 0b11
+            yield np.ascontiguousarray(_FROM_BED[codes.T])
+
+    def require(self, dog_ids: list[int]) -> None:
+        """
+        Raises KeyError unless all the dogs are in the cohort.
+        """
+        self._lookup(self.samples().with_row_index("row"), dog_ids)
+
+    @staticmethod
+    def _lookup(samples: pl.DataFrame, dog_ids: list[int]) -> pl.DataFrame:
+        wanted = pl.DataFrame({"IID": [str(dog_id) for dog_id in dog_ids]}, schema={"IID": pl.String})
+        samples = wanted.join(samples, on="IID", how="left")
+        missing = samples.filter(pl.col("row").is_null())["IID"].to_list()
+        if missing:
+            raise KeyError(f"Dogs not in the cohort: {missing}")
+        return samples
+
+    def calls(self, dog_ids: Optional[list[int]] = None) -> tuple[pl.DataFrame, dict[str, np.ndarray]]:
+        """
+        Reads dogs' calls in the layout of genotypes.tped_calls, with (dogs x loci) "first"/"second" allele codes.
+        """
+        samples, codes = self.codes(dog_ids)
+        # The index is append-only: its first loci are the ones the codes were read for
+        loci = self.loci().head(codes.shape[1])
+        ref = loci["ref"].to_numpy()
+        alt = loci["alt"].to_numpy()
+        first, second = decode_calls(codes, ref, alt)
+        return samples, {
+            "chromosome": loci["chromosome"].to_numpy(),
+            "position": loci["position"].to_numpy(),
+            "locus_id": loci["locusID"].to_numpy(),
+            "first": first,
+            "second": second
+        }
+
+    def keep_file(self, dog_ids: list[int], path: Path) -> Path:
+        """
+        Writes a PLINK --keep file selecting the given dogs.
+        """
+        with open(path, "w") as f:
+            for dog_id in dog_ids:
+                f.write(f"{dog_id} {dog_id}\n")
+        return path
+
+    @staticmethod
+    def _row_bytes(n_loci: int) -> int:
+        return -(-n_loci // CALLS_PER_BYTE)
+
+    def _rows(self, n_dogs: int, n_loci: int) -> np.ndarray:
+        """
+        The .bed as (loci x bytes) packed rows.
+        """
+        if n_dogs == 0 or n_loci == 0:
+            return np.zeros((n_loci, self._row_bytes(n_dogs)), dtype=np.uint8)
+        return np.memmap(self._bed, dtype=np.uint8, mode="r", offset=len(BED_MAGIC),
+                         shape=(n_loci, self._row_bytes(n_dogs)))
+
+    @staticmethod
+    def _extend(loci: pl.DataFrame, calls: dict[str, np.ndarray]) -> tuple[LocusPanel, pl.DataFrame]:
+        """
+        Adds a dog's unseen loci to the end of the index and fills in alleles it doesn't know yet.
+        """
+        if loci.height == 0:
+            panel = build_panel(calls["locus_id"], calls["first"], calls["second"])
+            chromosome, position = calls["chromosome"], calls["position"]
+        else:
+            panel = extend_panel(
+                LocusPanel(loci["locusID"].to_numpy().astype(object), loci["ref"].to_numpy(), loci["alt"].to_numpy()),
+                calls["locus_id"], calls["first"], calls["second"]
+            )
+            # Compared as fixed-width strings: isin on object arrays falls back to comparing every pair
+            new = ~np.isin(calls["locus_id"].astype(str), loci["locusID"].to_numpy().astype(str))
+            chromosome = np.concatenate([loci["chromosome"].to_numpy(), calls["chromosome"][new]])
+            position = np.concatenate([loci["position"].to_numpy(), calls["position"][new]])
+
+        return panel, pl.DataFrame({
+            "locusID": panel.locus_ids.astype(str),
+            "chromosome": chromosome,
+            "position": position,
+            "ref": panel.ref,
+            "alt": panel.alt
+        }, schema={"locusID": pl.String, "chromosome": pl.Int8, "position": pl.Int64, "ref": pl.UInt8,
+                   "alt": pl.UInt8})
+
+    def _rewrite(self, n_old: int, old_loci: int, n_dogs: int, indices: list[int], codes: np.ndarray) -> None:
+        """
+        Rewrites the .bed, whose rows had `n_old` slots, with rows of `n_dogs` slots for all the loci of
+        `codes`, setting the dogs' slots at `indices`; new loci and slots are missing for the other dogs.
+        """
+        old_rows = self._rows(n_old, old_loci)
+        temp = self._bed.with_suffix(".bed.tmp")
+        with open(temp, "wb") as f:
+            f.write(BED_MAGIC)
+            for start in range(0, codes.shape[1], _BLOCK_LOCI):
+                stop = min(start + _BLOCK_LOCI, codes.shape[1])
+                block = np.full((stop - start, n_dogs), _TO_BED[MISSING], dtype=np.uint8)
+                if start < old_loci:
+                    block[:min(stop, old_loci) - start, :n_old] = _unpack_rows(np.asarray(old_rows[start:stop]), n_old)
+                for index, dog_codes in zip(indices, codes):
+                    block[:, index] = dog_codes[start:stop]
+                f.write(_pack_rows(block).tobytes())
+        del old_rows
+        os.replace(temp, self._bed)
+
+    def _update(self, n_dogs: int, old_loci: int, indices: list[int], codes: np.ndarray) -> None:
+        """
+        Sets the dogs' slots at `indices` in the rows of the .bed, which have `n_dogs` slots, and appends
+        rows for the loci of `codes` beyond the first `old_loci`, missing for the other dogs.
+        """
+        row_bytes = self._row_bytes(n_dogs)
+        with open(self._bed, "r+b") as f:
+            # Drop partial rows left by an interrupted append
+            f.truncate(len(BED_MAGIC) + old_loci * row_bytes)
+            f.seek(0, os.SEEK_END)
+            for start in range(old_loci, codes.shape[1], _BLOCK_LOCI):
+                stop = min(start + _BLOCK_LOCI, codes.shape[1])
+                block = np.full((stop - start, n_dogs), _TO_BED[MISSING], dtype=np.uint8)
+                for index, dog_codes in zip(indices, codes):
+                    block[:, index] = dog_codes[start:stop]
+                f.write(_pack_rows(block).tobytes())
+
+        if old_loci == 0:
+            return
+        rows = np.memmap(self._bed, dtype=np.uint8, mode="r+", offset=len(BED_MAGIC), shape=(old_loci, row_bytes))
+        for index, dog_codes in zip(indices, codes):
+            column, shift = divmod(index, CALLS_PER_BYTE)
+            shift *= 2
+            rows[:, column] = (rows[:, column] & np.uint8(~(0b11 << shift) & 0xFF)) \
+                | (dog_codes[:old_loci] << shift).astype(np.uint8)
+        rows.flush()
+        del rows
+
+    def _write_fam(self, samples: pl.DataFrame) -> None:
+        temp = self._fam.with_suffix(".fam.tmp")
+        samples.select(TFAM_COLUMNS).write_csv(temp, separator=" ", include_header=False)
+        os.replace(temp, self._fam)
+
+    def _write_loci(self, loci: pl.DataFrame) -> None:
+        temp = self._loci.with_suffix(".tmp")
+        loci.write_parquet(temp)
+        os.replace(temp, self._loci)
+
+        temp = self._bim.with_suffix(".bim.tmp")
+        pl.DataFrame({
+            "chromosome": loci["chromosome"],
+            "locusID": loci["locusID"],
+            "cm": pl.repeat(0, loci.height, eager=True),
+            "position": loci["position"],
+            "a1": _BASES[loci["alt"].to_numpy()],
+            "a2": _BASES[loci["ref"].to_numpy()]
+        }).write_csv(temp, separator="\t", include_header=False)
+        os.replace(temp, self._bim)
+
+_cohort: Optional[Cohort] = None
+
+def get_cohort() -> Cohort:
+    """
+    Returns the process-wide cohort fileset, configured from the environment.
+    """
+    global _cohort
+    if _cohort is None:
+        _cohort = Cohort.from_env()
+    return _cohort
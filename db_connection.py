@@ -1,9 +1,22 @@
 import os
+import time
 import logging
-from typing import Optional
-from zip_file_handler import unzip_file
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional
+from zip_file_handler import (CHUNK_SIZE, UNZIP_MAX_COMPRESSION_RATIO, UNZIP_MAX_MEMBER_BYTES, UNZIP_MAX_MEMBERS,
+                              iter_member_lines, unzip_file)
+from genotypes import (TPED_LOCUS_SCHEMA, chromosome_codes, decode_alleles, iter_tped_chromosomes,
+                       map_bases, read_tped, tped_schema, tped_samples)
+from locus_dictionary import INDEX_SCHEMA, LocusDictionary
+from metrics import record_rows, span
+from genotype_packing import (MISSING, LocusPanel, align_to_panel, build_panel, decode_calls, encode_calls,
+                              extend_panel, load_panel, pack_codes, unpack_codes)
 
+import numpy as np
 import psycopg
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 import dotenv
 import polars as pl
 
@@ -19,168 +32,771 @@ def _get_env(key: str, default: Optional[str] = None) -> str:
         raise RuntimeError(f"Missing required environment variable: {key}")
     return value
 
-def _map_bases(df: pl.DataFrame) -> pl.DataFrame:
-    """
-    Map DNA bases to numeric values: A=1, C=2, G=3, T=4, 0=0
+def process_zip(file_path: str, extract: bool = True, output_folder: Path = Path("uploads"),
+                max_member_size: Optional[int] = UNZIP_MAX_MEMBER_BYTES,
+                max_compression_ratio: Optional[float] = UNZIP_MAX_COMPRESSION_RATIO,
+                max_members: Optional[int] = UNZIP_MAX_MEMBERS) -> pl.DataFrame:
     """
+    Loads the .tped file of a zip archive into a DataFrame.
 
-    mapping = {
-        "A": "1",
-        "C": "2",
-        "G": "3",
-        "T": "4",
-        "0": "0"
-    }
-    # Replace values in firstAllele and secondAllele columns and return new DataFrame
-    return df.with_columns([
-        pl.col("firstAllele").replace(mapping).cast(pl.Int8),
-        pl.col("secondAllele").replace(mapping).cast(pl.Int8)
-    ])
+    The archive limits apply whether it is extracted or streamed.
+
+    Args:
+        file_path (str): The path to the zip file.
+        extract (bool): Unzip the archive to disk first (default). When False, the .tped member is
+            streamed straight from the archive into the parser and nothing is written to disk.
+        output_folder (Path): The folder the archive is extracted to.
+        max_member_size (int): Maximum uncompressed size of a member in bytes (default: UNZIP_MAX_MEMBER_BYTES).
+        max_compression_ratio (float): Maximum compression ratio of a member (default: UNZIP_MAX_COMPRESSION_RATIO).
+        max_members (int): Maximum number of members in the archive (default: UNZIP_MAX_MEMBERS).
+    """
+    limits = {"max_member_size": max_member_size, "max_compression_ratio": max_compression_ratio,
+              "max_members": max_members}
+    if not extract:
+        with span("parse_tped"):
+            return pl.concat(iter_tped_batches(file_path, **limits), how="vertical_relaxed")
 
-def process_zip(file_path: str) -> pl.DataFrame:
     # Unzip the file
-    path, contents = unzip_file(file_path)
+    path, contents = unzip_file(file_path, output_folder, **limits)
 
     # Load the TPED file
     file_name = next((name for name in contents.keys() if name.endswith(".tped")), None)
     if file_name is None:
         raise FileNotFoundError("No .tped file found in the zip archive.")
     tped_file_path = os.path.join(path, file_name)
-    return pl.read_csv(tped_file_path, separator="\t", has_header=False)
+    with span("parse_tped"):
+        return read_tped(tped_file_path)
+
+def iter_tped_batches(file_path: str, chunk_size: int = CHUNK_SIZE, max_member_size: Optional[int] = None,
+                      max_compression_ratio: Optional[float] = None,
+                      max_members: Optional[int] = None) -> Iterator[pl.DataFrame]:
+    """
+    Parses the .tped member of a zip archive block by block, without extracting it.
+
+    Only one decompressed block of `chunk_size` bytes is held in memory at a time.
+
+    Args:
+        file_path (str): The path to the zip file.
+        chunk_size (int): Approximate number of decompressed bytes parsed per batch.
+        max_member_size (int): Maximum uncompressed size of the member in bytes (default: no limit).
+        max_compression_ratio (float): Maximum compression ratio of the member (default: no limit).
+        max_members (int): Maximum number of members in the archive (default: no limit).
+    """
+    for block in iter_member_lines(file_path, suffix=".tped", chunk_size=chunk_size, max_member_size=max_member_size,
+                                   max_compression_ratio=max_compression_ratio, max_members=max_members):
+        # Every block is parsed with the same compact schema as scan_tped
+        frame = pl.read_csv(block, separator="\t", has_header=False, schema=tped_schema())
+        yield decode_alleles(frame.lazy()).collect()
+
+def _connection_kwargs() -> dict:
+    """
+    Connection parameters read from the environment
+
+    Required env vars:
+        - PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD
+    """
+    return {
+        "host": _get_env("PGHOST"),
+        "port": int(_get_env("PGPORT")),
+        "dbname": _get_env("PGDATABASE"),
+        "user": _get_env("PGUSER"),
+        "password": _get_env("PGPASSWORD"),
+        "autocommit": True,
+    }
+
+def _pool_settings() -> dict:
+    """
+    Pool sizing read from the environment
+
+    Optional env vars (defaults in brackets):
+        - PGPOOL_MIN_SIZE [1], PGPOOL_MAX_SIZE [10], PGPOOL_TIMEOUT [30], PGPOOL_MAX_IDLE [600]
+    """
+    return {
+        "min_size": int(_get_env("PGPOOL_MIN_SIZE", "1")),
+        "max_size": int(_get_env("PGPOOL_MAX_SIZE", "10")),
+        "timeout": float(_get_env("PGPOOL_TIMEOUT", "30")),
+        "max_idle": float(_get_env("PGPOOL_MAX_IDLE", "600")),
+    }
 
 def get_connection() -> psycopg.Connection:
     """
-    Return new psycopg connection
+    Return new psycopg connection, outside of the shared pool
 
     Required env vars:
         - PGHOST, PGPORT, PGDATABASE, PGUSER, PGPASSWORD
     """
-    host = _get_env("PGHOST")
-    port = int(_get_env("PGPORT"))
-    dbname = _get_env("PGDATABASE")
-    user = _get_env("PGUSER")
-    password = _get_env("PGPASSWORD")
-
-    conn = psycopg.connect(
-        host=host,
-        port=port,
-        dbname=dbname,
-        user=user,
-        password=password,
-        autocommit=True,
-    )
-    return conn
+    return psycopg.connect(**_connection_kwargs())
+
+_pool: Optional[ConnectionPool] = None
+_async_pool: Optional[AsyncConnectionPool] = None
+_pool_lock = threading.Lock()
 
-def add_to_tbl_loci(tped: pl.DataFrame) -> None:
+def get_pool() -> ConnectionPool:
+    """
+    Return the process-wide connection pool, creating it on first use
     """
-    Takes a tped dataframe and adds its loci to tbl_loci.
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                kwargs=_connection_kwargs(),
+                check=ConnectionPool.check_connection,
+                name="snp",
+                open=True,
+                **_pool_settings()
+            )
+    return _pool
 
-    Args:
-        tped (pl.DataFrame): DataFrame representing the tped file.
+async def get_async_pool() -> AsyncConnectionPool:
+    """
+    Return the process-wide async connection pool, creating and opening it on first use
     """
+    global _async_pool
+    if _async_pool is None:
+        pool = AsyncConnectionPool(
+            kwargs=_connection_kwargs(),
+            check=AsyncConnectionPool.check_connection,
+            name="snp-async",
+            open=False,
+            **_pool_settings()
+        )
+        await pool.open()
+        if _async_pool is None:
+            _async_pool = pool
+        else:
+            await pool.close()
+    return _async_pool
 
-    # Create loci DataFrame
-    loci = pl.DataFrame(
-        schema=["indexID","chromossome","locusID","distance","embark8","VHL","embark9","myDogDNA"]
-    )
+@contextmanager
+def connection() -> Iterator[psycopg.Connection]:
+    """
+    Borrow a connection from the shared pool
+    """
+    with get_pool().connection() as conn:
+        yield conn
 
-    # Create indexID as multiples of 8
-    # tped[6] = (tped.index + 1) * 8
-    tped = tped.with_columns(
-        (pl.arange(1, tped.height + 1) * 8).alias("indexID")
-    )
+@asynccontextmanager
+async def async_connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """
+    Borrow an AsyncConnection from the shared async pool
+    """
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
 
-    # Assign values to loci DataFrame from tped file
-    loci = tped.select([
-        pl.col("indexID"),
-        pl.col("chromossome"),
-        pl.col("locusID"),
-        pl.col("distance"),
-        pl.lit(True).alias("embark8"),
-        pl.lit(None).alias("VHL"),
-        pl.lit(None).alias("embark9"),
-        pl.lit(None).alias("myDogDNA")
-    ])
+def check_database() -> bool:
+    """
+    Health check: True if a pooled connection answers a trivial query
+    """
+    try:
+        with connection() as conn:
+            conn.execute("SELECT 1")
+        return True
+    except Exception as e:
+        _get_logger().error(f"Database health check failed: {e}")
+        return False
 
-    # add tbl_loci
+async def async_check_database() -> bool:
+    """
+    Health check: True if a pooled async connection answers a trivial query
+    """
+    try:
+        async with async_connection() as conn:
+            await conn.execute("SELECT 1")
+        return True
+    except Exception as e:
+        _get_logger().error(f"Database health check failed: {e}")
+        return False
+
+def pool_stats() -> dict[str, dict[str, int]]:
+    """
+    Return the statistics of the pools that have been opened
+    """
+    stats = {}
+    if _pool is not None:
+        stats["sync"] = _pool.get_stats()
+    if _async_pool is not None:
+        stats["async"] = _async_pool.get_stats()
+    return stats
+
+def close_pool() -> None:
+    """
+    Close the shared connection pool, if it was opened
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+async def close_async_pool() -> None:
+    """
+    Close the shared async connection pool, if it was opened
+    """
+    global _async_pool
+    if _async_pool is not None:
+        pool, _async_pool = _async_pool, None
+        await pool.close()
+
+_TBL_LOCI_COLUMNS = [
+    "lngLocusID", "intChromosome", "strLocusIdentifier", "lngDistance", "blnEmbark8", "blnVHL", "blnEmbark9",
+    "blnMyDogDNA"
+]
+_TBL_ALLELES_COLUMNS = [
+    "lngDogID", "lngLocusID", "bytFirstAllele", "bytSecondAllele", "blnIsHomozygous", "lngSourceID"
+]
+# Columns of the staging table new loci are copied into before they are merged into tbl_loci
+_STAGED_LOCI_COLUMNS = ["intChromosome", "strLocusIdentifier", "lngDistance"]
+
+def _copy_frame(cur: psycopg.Cursor, table: str, columns: list[str], frame: pl.DataFrame,
+                batch_size: int, schema: str = "public") -> None:
+    """
+    Streams a DataFrame into a table with COPY ... FROM STDIN.
+
+    Each chunk is serialised by Polars straight to CSV bytes, so no Python tuples are built per row.
+    Empty fields are read back as NULL by COPY.
+    """
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    with cur.copy(f'COPY "{schema}"."{table}" ({column_list}) FROM STDIN (FORMAT CSV)') as copy:
+        for batch in frame.iter_slices(batch_size):
+            copy.write(batch.write_csv(include_header=False))
+
+def _executemany_frame(cur: psycopg.Cursor, table: str, columns: list[str], frame: pl.DataFrame,
+                       batch_size: int, schema: str = "public") -> None:
+    """
+    Inserts a DataFrame into a table with one INSERT per row, batch by batch.
+    """
+    logger = _get_logger()
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    total_rows = frame.height
+    for start in range(0, total_rows, batch_size):
+        end = min(start + batch_size, total_rows)
+        batch = frame.slice(start, end - start)
+        cur.executemany(
+            f'INSERT INTO "{schema}"."{table}" ({column_list}) VALUES ({placeholders})',
+            batch.rows()
+        )
+        logger.info(f"Inserted rows {start + 1} to {end} into {table}.")
+
+def _load_frame(frame: pl.DataFrame, table: str, columns: list[str], method: str = "copy",
+                batch_size: int = 10000) -> None:
+    """
+    Loads a DataFrame whose columns are ordered like `columns` into `table`.
+
+    Args:
+        frame (pl.DataFrame): Rows to load.
+        table (str): Target table in the public schema.
+        columns (list[str]): Target column names, in the order of the DataFrame columns.
+        method (str): "copy" (COPY FROM STDIN) or "executemany" (row-by-row INSERT fallback).
+        batch_size (int): Number of rows per COPY chunk / executemany batch.
+    """
+    loader = _loader(method)
     logger = _get_logger()
-    batch_size = 10000
-    total_rows = len(loci)
-    logger.info(f"Starting to insert {total_rows} rows into tbl_loci in batches of {batch_size}...")
+    total_rows = frame.height
+    logger.info(f"Starting to insert {total_rows} rows into {table} using {method} in batches of {batch_size}...")
 
+    start_time = time.perf_counter()
     try:
-        with get_connection() as conn:
+        with span(f"db_{table}"), connection() as conn:
             with conn.cursor() as cur:
-                for start in range(0, total_rows, batch_size):
-                    end = min(start + batch_size, total_rows)
-                    batch = loci.slice(start, end - start)
-                    values = batch.rows()
-
-                    cur.executemany(
-                        '''
-                        INSERT INTO "public"."tbl_loci" (
-                        "lngLocusID", "intChromosome", "strLocusIdentifier", "lngDistance", "blnEmbark8", "blnVHL", "blnEmbark9", "blnMyDogDNA")
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        ''',
-                        values
-                    )
-                    logger.info(f"Inserted rows {start + 1} to {end} into tbl_loci.")
+                loader(cur, table, columns, frame, batch_size)
+    except Exception as e:
+        logger.error(f"Error inserting into {table}: {e}")
+        raise
+
+    elapsed = time.perf_counter() - start_time
+    record_rows(f"db_{table}", total_rows, elapsed)
+    rate = total_rows / elapsed if elapsed > 0 else float("inf")
+    logger.info(f"Inserted {total_rows} rows into {table} using {method} in {elapsed:.2f}s ({rate:,.0f} rows/sec).")
+
+def _loader(method: str):
+    """
+    Return the frame loader of a load method: "copy" (COPY FROM STDIN) or "executemany" (row-by-row INSERT)
+    """
+    loaders = {"copy": _copy_frame, "executemany": _executemany_frame}
+    if method not in loaders:
+        raise ValueError(f"Unknown load method: {method}. Expected one of {list(loaders)}")
+    return loaders[method]
+
+def _copy_to_frame(cur: psycopg.Cursor, query: str, schema: dict[str, pl.DataType],
+                   params: Optional[tuple] = None) -> pl.DataFrame:
+    """
+    Reads the rows of a query with COPY ... TO STDOUT into a DataFrame of the given schema.
+
+    The CSV output is parsed by Polars in one go, so no Python tuples are built per row.
+    """
+    buffer = bytearray()
+    with cur.copy(f"COPY ({query}) TO STDOUT (FORMAT CSV)", params) as copy:
+        for block in copy:
+            buffer += block
+    if not buffer:
+        return pl.DataFrame(schema=schema)
+    return pl.read_csv(bytes(buffer), has_header=False, new_columns=list(schema), schema_overrides=schema)
+
+_locus_dictionary: Optional[LocusDictionary] = None
+_locus_dictionary_lock = threading.Lock()
+
+def get_locus_dictionary() -> LocusDictionary:
+    """
+    Return the process-wide locus dictionary, loading the loci of tbl_loci into it on first use
+    """
+    global _locus_dictionary
+    with _locus_dictionary_lock:
+        if _locus_dictionary is None:
+            with connection() as conn, conn.cursor() as cur:
+                index = _copy_to_frame(cur, 'SELECT "strLocusIdentifier", "lngLocusID" FROM "public"."tbl_loci"',
+                                       INDEX_SCHEMA)
+            _locus_dictionary = LocusDictionary(index)
+            _get_logger().info(f"Loaded {len(_locus_dictionary)} loci into the locus dictionary.")
+    return _locus_dictionary
+
+def locus_keys(tped: pl.DataFrame, method: str = "copy", batch_size: int = 10000) -> pl.Series:
+    """
+    Return the tbl_loci key (lngLocusID) of each locus of a tped dataframe, in order.
+
+    Loci tbl_loci doesn't have yet are inserted first; known loci aren't sent to the database at all.
+
+    Args:
+        tped (pl.DataFrame): DataFrame representing the tped file.
+        method (str): "copy" (default) or "executemany", for the new loci.
+        batch_size (int): Number of rows sent per COPY chunk / executemany batch.
+    """
+    dictionary = get_locus_dictionary()
+    with dictionary.lock:
+        new = dictionary.missing(tped.select(["chromossome", "locusID", "distance"]))
+        if not new.is_empty():
+            dictionary.update(_insert_loci(new, method, batch_size))
+    return dictionary.keys(tped["locusID"])
+
+def _insert_loci(loci: pl.DataFrame, method: str, batch_size: int) -> pl.DataFrame:
+    """
+    Insert loci into tbl_loci through a staging table, and return the keys of all of them.
+
+    Loci another process inserted in the meantime are skipped by ON CONFLICT, and their existing key is returned.
+    """
+    logger = _get_logger()
+    loader = _loader(method)
+    staged = loci.select(
+        pl.Series("intChromosome", chromosome_codes(loci["chromossome"])),
+        pl.col("locusID"),
+        pl.col("distance")
+    )
+
+    start_time = time.perf_counter()
+    try:
+        with span("db_tbl_loci"), connection() as conn, conn.transaction(), conn.cursor() as cur:
+            cur.execute(
+                '''
+                CREATE TEMP TABLE "tmp_loci" ("intChromosome" integer, "strLocusIdentifier" text, "lngDistance" bigint)
+                ON COMMIT DROP
+                '''
+            )
+            loader(cur, "tmp_loci", _STAGED_LOCI_COLUMNS, staged, batch_size, schema="pg_temp")
+            cur.execute(
+                '''
+                INSERT INTO "public"."tbl_loci"
+                    ("intChromosome", "strLocusIdentifier", "lngDistance", "blnEmbark8", "blnVHL", "blnEmbark9",
+                     "blnMyDogDNA")
+                SELECT "intChromosome", "strLocusIdentifier", "lngDistance", TRUE, NULL, NULL, NULL
+                FROM "pg_temp"."tmp_loci"
+                -- Loaders inserting overlapping loci take their index locks in the same order, so they don't deadlock
+                ORDER BY "strLocusIdentifier"
+                ON CONFLICT ("strLocusIdentifier") DO NOTHING
+                '''
+            )
+            inserted = cur.rowcount
+            cur.execute(
+                '''
+                SELECT l."strLocusIdentifier", l."lngLocusID"
+                FROM "public"."tbl_loci" l
+                JOIN "pg_temp"."tmp_loci" t ON t."strLocusIdentifier" = l."strLocusIdentifier"
+                '''
+            )
+            keys = pl.DataFrame(cur.fetchall(), schema=INDEX_SCHEMA, orient="row")
     except Exception as e:
         logger.error(f"Error inserting into tbl_loci: {e}")
         raise
 
-    logger.info("Loci added successfully.")
+    elapsed = time.perf_counter() - start_time
+    record_rows("db_tbl_loci", inserted, elapsed)
+    logger.info(f"Inserted {inserted} new loci into tbl_loci ({loci.height - inserted} already there) in {elapsed:.2f}s.")
+    return keys
 
-def add_to_tbl_alleles(tped: pl.DataFrame, dog: int, source: int) -> None:
+def add_to_tbl_loci(tped: pl.DataFrame, method: str = "copy", batch_size: int = 10000) -> None:
     """
-    Takes a tped dataframe and adds its alleles to tbl_alleles.
+    Takes a tped dataframe and adds the loci tbl_loci doesn't have yet (see locus_keys).
+
+    Args:
+        tped (pl.DataFrame): DataFrame representing the tped file.
+        method (str): "copy" to stream the rows with COPY FROM STDIN (default) or
+            "executemany" for the row-by-row INSERT fallback.
+        batch_size (int): Number of rows sent per COPY chunk / executemany batch.
+    """
+    locus_keys(tped, method=method, batch_size=batch_size)
+
+    _get_logger().info("Loci added successfully.")
+
+def add_to_tbl_alleles(tped: pl.DataFrame, dog: int, source: int, method: str = "copy",
+                       batch_size: int = 10000) -> None:
+    """
+    Takes a tped dataframe and adds its alleles to tbl_alleles, referencing their loci by tbl_loci key.
+
+    Loci tbl_loci doesn't have yet are added to it first (see locus_keys).
 
     Args:
         tped (pl.DataFrame): DataFrame representing the tped file.
         dog (int): Dog ID.
         source (int): Source ID.
+        method (str): "copy" to stream the rows with COPY FROM STDIN (default) or
+            "executemany" for the row-by-row INSERT fallback.
+        batch_size (int): Number of rows sent per COPY chunk / executemany batch.
     """
 
-    # Create alleles DataFrame with Polars
-    alleles = tped.select([
-        pl.col("locusID"),
+    keys = locus_keys(tped, method=method, batch_size=batch_size)
+    _load_frame(_alleles_frame(tped, keys, dog, source), "tbl_alleles", _TBL_ALLELES_COLUMNS, method=method,
+                batch_size=batch_size)
+
+    _get_logger().info("Alleles added successfully.")
+
+def add_tped_to_tbl_alleles(tped_file: Path, dogs: list[int], source: int, method: str = "copy",
+                            batch_size: int = 10000) -> None:
+    """
+    Streams the alleles of a (multi-sample) TPED file into tbl_alleles, one chromosome at a time.
+
+    Only one chromosome of the file is held in memory, so TPEDs of any number of samples load with
+    bounded memory (see genotypes.iter_tped_chromosomes).
+
+    Args:
+        tped_file (Path): The path to the TPED file (with extension).
+        dogs (list[int]): Dog IDs of the samples, in TFAM order.
+        source (int): Source ID.
+        method (str): "copy" to stream the rows with COPY FROM STDIN (default) or
+            "executemany" for the row-by-row INSERT fallback.
+        batch_size (int): Number of rows sent per COPY chunk / executemany batch.
+    """
+    n_samples = tped_samples(Path(tped_file))
+    if len(dogs) != n_samples:
+        raise ValueError(f"{tped_file} has {n_samples} samples, got {len(dogs)} dog IDs")
+
+    for chromosome in iter_tped_chromosomes(Path(tped_file), n_samples):
+        keys = locus_keys(chromosome, method=method, batch_size=batch_size)
+        for i, dog in enumerate(dogs):
+            sample = chromosome
+            if n_samples > 1:
+                sample = chromosome.select(
+                    pl.col("locusID"),
+                    pl.col(f"firstAllele_{i}").alias("firstAllele"),
+                    pl.col(f"secondAllele_{i}").alias("secondAllele")
+                )
+            _load_frame(_alleles_frame(sample, keys, dog, source), "tbl_alleles", _TBL_ALLELES_COLUMNS, method=method,
+                        batch_size=batch_size)
+
+    _get_logger().info(f"Alleles of {len(dogs)} dogs added successfully.")
+
+def _alleles_frame(tped: pl.DataFrame, keys: pl.Series, dog: int, source: int) -> pl.DataFrame:
+    """
+    The rows of a dog's alleles, in the column order of tbl_alleles, with the tbl_loci keys of its loci
+    """
+    # Map bases (A=1, C=2, G=3, T=4, 0=0) unless the alleles are already decoded
+    calls = map_bases(tped.select(["locusID", "firstAllele", "secondAllele"]))
+    return calls.select([
+        pl.lit(dog).alias("dogID"),
+        keys.alias("locusKey"),
         pl.col("firstAllele"),
         pl.col("secondAllele"),
         (pl.col("firstAllele") == pl.col("secondAllele")).alias("isHomozygous"),
-        pl.lit(source).alias("sourceID"),
-        pl.lit(dog).alias("dogID")
+        pl.lit(source).alias("sourceID")
     ])
 
-    # Map bases (A=1, C=2, G=3, T=4, 0=0)
-    alleles = _map_bases(alleles)
+# Key of the advisory lock serialising extensions of the genotype panel across processes and hosts
+_PANEL_LOCK_KEY = 0x736E705F70616E
+_PANEL_COLUMNS = ["lngPanelIndex", "strLocusIdentifier", "bytRef", "bytAlt", "lngVersion"]
+_PANEL_SCHEMA = {"index": pl.Int64, "locusID": pl.String, "ref": pl.UInt8, "alt": pl.UInt8, "version": pl.Int64}
+
+# The panel as last read from tbl_genotype_panel, and the version it was read at
+_panel: Optional[LocusPanel] = None
+_panel_version = 0
+_panel_lock = threading.Lock()
+
+def _legacy_panel_path() -> Path:
+    return Path(_get_env("GENOTYPE_PANEL_PATH", "cache/genotype_panel.parquet"))
+
+def _panel_changes(cur: psycopg.Cursor, panel: Optional[LocusPanel],
+                   version: int) -> tuple[Optional[LocusPanel], int]:
+    """
+    Apply the rows of tbl_genotype_panel changed after `version` to a panel; returns the panel and its version.
+    """
+    changes = _copy_to_frame(
+        cur,
+        'SELECT "lngPanelIndex", "strLocusIdentifier", "bytRef", "bytAlt", "lngVersion" '
+        'FROM "public"."tbl_genotype_panel" WHERE "lngVersion" > %s',
+        _PANEL_SCHEMA, (version,)
+    )
+    if changes.is_empty():
+        return panel, version
+
+    old = len(panel) if panel is not None else 0
+    n_loci = max(old, int(changes["index"].max()) + 1)
+    locus_ids = np.empty(n_loci, dtype=object)
+    ref = np.zeros(n_loci, dtype=np.uint8)
+    alt = np.zeros(n_loci, dtype=np.uint8)
+    if panel is not None:
+        locus_ids[:old], ref[:old], alt[:old] = panel.locus_ids, panel.ref, panel.alt
+    index = changes["index"].to_numpy()
+    locus_ids[index] = changes["locusID"].to_numpy()
+    ref[index] = changes["ref"].to_numpy()
+    alt[index] = changes["alt"].to_numpy()
+    return LocusPanel(locus_ids, ref, alt), int(changes["version"].max())
+
+def get_genotype_panel(min_version: int = 0) -> Optional[LocusPanel]:
+    """
+    Return the locus panel packed genotypes are encoded against (tbl_genotype_panel), or None if none was built yet.
+
+    The panel is cached in memory and read again, from the rows changed since, once it is older than `min_version`.
+    """
+    global _panel, _panel_version
+    with _panel_lock:
+        if _panel is None or _panel_version < min_version:
+            with connection() as conn, conn.cursor() as cur:
+                _panel, _panel_version = _panel_changes(cur, _panel, _panel_version)
+        panel = _panel
+    if panel is None and _legacy_panel_path().exists():
+        # Seeds the database with the panel of a deployment that kept it in a local file
+        panel, _ = _panel_for(np.zeros(0, dtype=object), np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8))
+    return panel
+
+def _panel_for(locus_ids: np.ndarray, first: np.ndarray, second: np.ndarray) -> tuple[LocusPanel, int]:
+    """
+    Return the locus panel, extended with the loci and alleles of a new dog when needed, and its version.
+
+    The panel is extended under a transaction-level advisory lock, starting from the latest rows of
+    tbl_genotype_panel, so API processes and ingest.py on any host extend the same panel. New loci are
+    appended and unknown alleles filled in, and every row written gets the next version.
+    """
+    global _panel, _panel_version
+    with _panel_lock:
+        with span("db_tbl_genotype_panel"), connection() as conn, conn.transaction(), conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (_PANEL_LOCK_KEY,))
+            panel, version = _panel_changes(cur, _panel, _panel_version)
+            if panel is None:
+                old = 0
+                legacy = _legacy_panel_path()
+                seed = load_panel(legacy) if legacy.exists() else None
+                extended = (build_panel(locus_ids, first, second) if seed is None
+                            else extend_panel(seed, locus_ids, first, second))
+            else:
+                old = len(panel)
+                extended = extend_panel(panel, locus_ids, first, second)
+
+            # Loci added, and known loci whose alleles were filled in
+            changed = np.concatenate([
+                np.flatnonzero((extended.ref[:old] != panel.ref) | (extended.alt[:old] != panel.alt)) if old
+                else np.zeros(0, dtype=np.int64),
+                np.arange(old, len(extended))
+            ])
+            if len(changed):
+                version += 1
+                rows = pl.DataFrame({
+                    "index": changed,
+                    "locusID": extended.locus_ids[changed].astype(str),
+                    "ref": extended.ref[changed],
+                    "alt": extended.alt[changed],
+                    "version": np.full(len(changed), version)
+                }, schema=_PANEL_SCHEMA)
+                cur.execute(
+                    '''
+                    CREATE TEMP TABLE "tmp_panel" (LIKE "public"."tbl_genotype_panel" INCLUDING DEFAULTS)
+                    ON COMMIT DROP
+                    '''
+                )
+                _copy_frame(cur, "tmp_panel", _PANEL_COLUMNS, rows, 10000, schema="pg_temp")
+                cur.execute(
+                    '''
+                    INSERT INTO "public"."tbl_genotype_panel"
+                    SELECT * FROM "pg_temp"."tmp_panel"
+                    ON CONFLICT ("lngPanelIndex") DO UPDATE
+                    SET "bytRef" = EXCLUDED."bytRef", "bytAlt" = EXCLUDED."bytAlt", "lngVersion" = EXCLUDED."lngVersion"
+                    '''
+                )
+                _get_logger().info(f"Genotype panel version {version}: {len(extended) - old} loci added, "
+                                   f"{len(changed) - (len(extended) - old)} alleles filled in.")
+        _panel, _panel_version = extended, version
+        return extended, version
 
-    # Add tbl_alleles
+def add_to_tbl_packed_genotypes(tped: pl.DataFrame, dog: int, source: int) -> None:
+    """
+    Takes a tped dataframe and stores its calls as one 2-bit packed row in tbl_packed_genotypes.
+
+    Calls are encoded against the shared locus panel (tbl_genotype_panel, see genotype_packing), which is
+    extended with any loci or alleles it doesn't know yet; the row records the panel version it was encoded
+    at. Can be used instead of, or alongside, add_to_tbl_alleles.
+
+    Args:
+        tped (pl.DataFrame): DataFrame representing the tped file.
+        dog (int): Dog ID.
+        source (int): Source ID.
+    """
     logger = _get_logger()
-    batch_size = 10000
-    total_rows = alleles.height
-    logger.info(f"Starting to insert {total_rows} rows into tbl_alleles in batches of {batch_size}...")
+    calls = map_bases(tped.select(["locusID", "firstAllele", "secondAllele"]))
+    locus_ids = calls["locusID"].to_numpy()
+    first = calls["firstAllele"].to_numpy().astype(np.uint8)
+    second = calls["secondAllele"].to_numpy().astype(np.uint8)
+
+    panel, version = _panel_for(locus_ids, first, second)
+    first, second = align_to_panel(panel, locus_ids, first, second)
+    packed = pack_codes(encode_calls(first, second, panel.ref, panel.alt))
 
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                for start in range(0, total_rows, batch_size):
-                    end = min(start + batch_size, total_rows)
-                    # Use slice instead of iloc
-                    batch = alleles.slice(start, end - start)
-                    # Use rows() instead of iterrows()
-                    values = batch.rows()
-
-                    cur.executemany(
-                        '''
-                        INSERT INTO "public"."tbl_alleles" (
-                        "lngDogID", "strLocusID", "bytFirstAllele", "bytSecondAllele", "blnIsHomozygous", "lngSourceID")
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                        ''',
-                        values
-                    )
-                    logger.info(f"Inserted rows {start + 1} to {end} into tbl_alleles.")
+        with span("db_tbl_packed_genotypes"), connection() as conn:
+            conn.execute(
+                '''
+                INSERT INTO "public"."tbl_packed_genotypes"
+                    ("lngDogID", "lngSourceID", "lngCallCount", "lngPanelVersion", "bytGenotypes")
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT ("lngDogID", "lngSourceID") DO UPDATE
+                SET "lngCallCount" = EXCLUDED."lngCallCount", "lngPanelVersion" = EXCLUDED."lngPanelVersion",
+                    "bytGenotypes" = EXCLUDED."bytGenotypes"
+                ''',
+                (dog, source, len(panel), version, packed.tobytes())
+            )
     except Exception as e:
-        logger.error(f"Error inserting into tbl_alleles: {e}")
+        logger.error(f"Error inserting into tbl_packed_genotypes: {e}")
         raise
 
-    logger.info("Alleles added successfully.")
\ No newline at end of file
+    logger.info(f"Packed genotypes of dog {dog} added successfully ({len(panel)} calls in {packed.nbytes} bytes).")
+
+# Columns read back from tbl_alleles joined to tbl_loci, before they are put in TPED order
+_STORED_ALLELES_SCHEMA = {"chromossome": pl.String, "locusID": pl.String, "distance": pl.Int32,
+                          "firstAllele": pl.UInt8, "secondAllele": pl.UInt8, "sourceID": pl.Int64}
+
+_locus_positions: Optional[pl.DataFrame] = None
+_locus_positions_lock = threading.Lock()
+
+def _positions_of(locus_ids: pl.Series) -> pl.DataFrame:
+    """
+    Return the chromosome and position of loci (locusID, chromossome, distance) from tbl_loci, in the given order.
+
+    tbl_loci is read once and again only when it lacks some of the loci, e.g. after new loci were ingested.
+    """
+    global _locus_positions
+    wanted = pl.DataFrame({"locusID": locus_ids.cast(pl.String)})
+    with _locus_positions_lock:
+        for attempt in range(2):
+            if _locus_positions is None or attempt:
+                with connection() as conn, conn.cursor() as cur:
+                    _locus_positions = _copy_to_frame(
+                        cur, 'SELECT "strLocusIdentifier", "intChromosome", "lngDistance" FROM "public"."tbl_loci"',
+                        {"locusID": pl.String, "chromossome": pl.String, "distance": pl.Int32}
+                    )
+            positions = wanted.join(_locus_positions, on="locusID", how="left", maintain_order="left")
+            if positions["chromossome"].null_count() == 0:
+                break
+    return positions
+
+def _tped_frame(calls: pl.DataFrame) -> pl.DataFrame:
+    """
+    Put stored calls (locusID, chromossome, distance and allele codes) in TPED order and columns.
+    """
+    return calls.sort(
+        pl.col("chromossome").cast(pl.Int32, strict=False), pl.col("distance"), nulls_last=True
+    ).select(
+        pl.col("chromossome").cast(TPED_LOCUS_SCHEMA["chromossome"]),
+        pl.col("locusID"),
+        pl.lit(0.0, dtype=TPED_LOCUS_SCHEMA["geneticDistance"]).alias("geneticDistance"),
+        pl.col("distance"),
+        pl.col("firstAllele"),
+        pl.col("secondAllele")
+    )
+
+def _dog_filter(dog: int, source: Optional[int], alias: Optional[str] = None) -> tuple[str, tuple]:
+    """
+    Return the WHERE clause (and its parameters) selecting a dog's rows, of one source when given
+    """
+    prefix = f"{alias}." if alias else ""
+    if source is None:
+        return f'{prefix}"lngDogID" = %s', (dog,)
+    return f'{prefix}"lngDogID" = %s AND {prefix}"lngSourceID" = %s', (dog, source)
+
+def read_packed_genotypes(dog: int, source: Optional[int] = None) -> Optional[pl.DataFrame]:
+    """
+    Read a dog's packed genotypes back as a single-sample TPED frame with numeric allele codes.
+
+    Loci without a call are left out: a packed row can't tell a no-call from a locus the dog wasn't typed for.
+
+    Args:
+        dog (int): Dog ID.
+        source (int): Source ID (default: the lowest source stored for the dog).
+
+    Returns:
+        Optional[pl.DataFrame]: The calls, or None if the dog has no packed row.
+    """
+    where, params = _dog_filter(dog, source)
+    with span("db_read_packed_genotypes"), connection() as conn:
+        row = conn.execute(
+            f'''
+            SELECT "lngCallCount", "lngPanelVersion", "bytGenotypes" FROM "public"."tbl_packed_genotypes"
+            WHERE {where}
+            ORDER BY "lngSourceID"
+            LIMIT 1
+            ''',
+            params
+        ).fetchone()
+    if row is None:
+        return None
+
+    # Rows are encoded against the panel as it was at their version; loci are only appended and alleles only
+    # filled in, so any later version decodes them the same
+    n_calls, version, genotypes = row
+    panel = get_genotype_panel(min_version=version)
+    if panel is None or len(panel) < n_calls:
+        raise RuntimeError(f"Genotype panel version {version} of dog {dog}'s packed row is missing from the database")
+    codes = unpack_codes(genotypes, n_calls)
+    first, second = decode_calls(codes, panel.ref[:n_calls], panel.alt[:n_calls])
+    called = codes != MISSING
+    calls = pl.DataFrame({
+        "locusID": panel.locus_ids[:n_calls][called].astype(str),
+        "firstAllele": first[called],
+        "secondAllele": second[called]
+    }, schema={"locusID": pl.String, "firstAllele": pl.UInt8, "secondAllele": pl.UInt8})
+    positions = _positions_of(calls["locusID"])
+    return _tped_frame(calls.with_columns(positions["chromossome"], positions["distance"]).drop_nulls("chromossome"))
+
+def read_stored_genotypes(dog: int, source: Optional[int] = None) -> Optional[pl.DataFrame]:
+    """
+    Read a dog's stored genotypes as a single-sample TPED frame (TPED_COLUMNS, numeric allele codes).
+
+    The packed row is used when there is one (a single primary-key lookup), else the dog's tbl_alleles rows
+    are read with one bulk query on the lngDogID index (see sql/tbl_alleles_dog_index.sql).
+
+    Args:
+        dog (int): Dog ID.
+        source (int): Source ID (default: all sources; a locus stored by several keeps the lowest source's call).
+
+    Returns:
+        Optional[pl.DataFrame]: The calls, in chromosome and position order, or None if the dog isn't stored.
+    """
+    packed = read_packed_genotypes(dog, source)
+    if packed is not None:
+        return packed
+
+    where, params = _dog_filter(dog, source, alias="a")
+    start_time = time.perf_counter()
+    with span("db_read_tbl_alleles"), connection() as conn, conn.cursor() as cur:
+        calls = _copy_to_frame(
+            cur,
+            f'''
+            SELECT l."intChromosome", l."strLocusIdentifier", l."lngDistance", a."bytFirstAllele",
+                   a."bytSecondAllele", a."lngSourceID"
+            FROM "public"."tbl_alleles" a
+            JOIN "public"."tbl_loci" l ON l."lngLocusID" = a."lngLocusID"
+            WHERE {where}
+            ''',
+            _STORED_ALLELES_SCHEMA,
+            params
+        )
+    record_rows("db_read_tbl_alleles", calls.height, time.perf_counter() - start_time)
+    if calls.is_empty():
+        return None
+    calls = calls.sort("sourceID").unique("locusID", keep="first", maintain_order=True)
+    return _tped_frame(calls)
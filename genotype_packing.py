@@ -0,0 +1,149 @@
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import polars as pl
+
+# 2-bit genotype codes, relative to the reference/alternate alleles of the locus panel
+MISSING = 0
+HOM_REF = 1
+HET = 2
+HOM_ALT = 3
+
+CALLS_PER_BYTE = 4
+
+class LocusPanel(NamedTuple):
+    """
+    Fixed locus ordering that packed genotypes are encoded against.
+
+    Alleles use the numeric base codes of `genotypes.map_bases` (A=1, C=2, G=3, T=4, 0=unknown). Loci are only ever
+    appended and unknown alleles only ever filled in, so genotypes packed against an older
+    panel keep their meaning.
+    """
+    locus_ids: np.ndarray
+    ref: np.ndarray
+    alt: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.locus_ids)
+
+def _observed_alleles(first: np.ndarray, second: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Picks a reference and an alternate allele per locus from one dog's calls (0 where unknown).
+    """
+    ref = np.where(first != 0, first, second).astype(np.uint8)
+    alt = np.where((second != 0) & (second != ref), second, 0).astype(np.uint8)
+    return ref, alt
+
+def build_panel(locus_ids: np.ndarray, first: np.ndarray, second: np.ndarray) -> LocusPanel:
+    """
+    Builds a panel from the loci and calls of a first dog, in file order.
+    """
+    ref, alt = _observed_alleles(np.asarray(first), np.asarray(second))
+    return LocusPanel(np.asarray(locus_ids, dtype=object), ref, alt)
+
+def extend_panel(panel: LocusPanel, locus_ids: np.ndarray, first: np.ndarray,
+                 second: np.ndarray) -> LocusPanel:
+    """
+    Adds a dog's unseen loci to the end of the panel, and fills in alleles the panel doesn't know yet.
+    """
+    positions = _panel_positions(panel, locus_ids)
+    ref_seen, alt_seen = _observed_alleles(np.asarray(first), np.asarray(second))
+
+    ref = panel.ref.copy()
+    alt = panel.alt.copy()
+    known = positions >= 0
+    for observed in (ref_seen[known], alt_seen[known]):
+        index = positions[known]
+        fill_ref = (ref[index] == 0) & (observed != 0)
+        ref[index[fill_ref]] = observed[fill_ref]
+        fill_alt = (alt[index] == 0) & (observed != 0) & (observed != ref[index])
+        alt[index[fill_alt]] = observed[fill_alt]
+
+    new = ~known
+    return LocusPanel(
+        np.concatenate([panel.locus_ids, np.asarray(locus_ids, dtype=object)[new]]),
+        np.concatenate([ref, ref_seen[new]]),
+        np.concatenate([alt, alt_seen[new]])
+    )
+
+def _panel_positions(panel: LocusPanel, locus_ids: np.ndarray) -> np.ndarray:
+    """
+    Returns the panel index of each locus id, or -1 for loci that aren't in the panel.
+    """
+    index = {locus_id: i for i, locus_id in enumerate(panel.locus_ids)}
+    return np.fromiter((index.get(locus_id, -1) for locus_id in locus_ids), dtype=np.int64, count=len(locus_ids))
+
+def align_to_panel(panel: LocusPanel, locus_ids: np.ndarray, first: np.ndarray,
+                   second: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reorders a dog's calls into panel order; panel loci the dog wasn't genotyped at are left as 0.
+    """
+    positions = _panel_positions(panel, locus_ids)
+    known = positions >= 0
+    aligned_first = np.zeros(len(panel), dtype=np.uint8)
+    aligned_second = np.zeros(len(panel), dtype=np.uint8)
+    aligned_first[positions[known]] = np.asarray(first)[known]
+    aligned_second[positions[known]] = np.asarray(second)[known]
+    return aligned_first, aligned_second
+
+def encode_calls(first: np.ndarray, second: np.ndarray, ref: np.ndarray, alt: np.ndarray) -> np.ndarray:
+    """
+    Encodes allele pairs as 2-bit genotype codes (one uint8 per call).
+
+    Calls with an allele that is neither the reference nor the alternate allele are encoded as MISSING.
+    """
+    first = np.asarray(first)
+    second = np.asarray(second)
+    first_ref = (first == ref) & (ref != 0)
+    second_ref = (second == ref) & (ref != 0)
+    first_alt = (first == alt) & (alt != 0)
+    second_alt = (second == alt) & (alt != 0)
+
+    codes = np.full(first.shape, MISSING, dtype=np.uint8)
+    codes[first_ref & second_ref] = HOM_REF
+    codes[(first_ref & second_alt) | (first_alt & second_ref)] = HET
+    codes[first_alt & second_alt] = HOM_ALT
+    return codes
+
+def decode_calls(codes: np.ndarray, ref: np.ndarray, alt: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes 2-bit genotype codes back into allele pairs; missing calls become 0/0.
+    """
+    codes = np.asarray(codes)
+    first = np.select([codes == HOM_REF, codes == HET, codes == HOM_ALT], [ref, ref, alt], 0).astype(np.uint8)
+    second = np.select([codes == HOM_REF, codes == HET, codes == HOM_ALT], [ref, alt, alt], 0).astype(np.uint8)
+    return first, second
+
+def pack_codes(codes: np.ndarray) -> np.ndarray:
+    """
+    Packs genotype codes four to a byte, the first call in the lowest two bits.
+    """
+    codes = np.asarray(codes, dtype=np.uint8)
+    padded = np.zeros(-(-len(codes) // CALLS_PER_BYTE) * CALLS_PER_BYTE, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    quads = padded.reshape(-1, CALLS_PER_BYTE)
+    return quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)
+
+def unpack_codes(packed: np.ndarray | bytes, n_calls: int) -> np.ndarray:
+    """
+    Unpacks `n_calls` genotype codes; calls beyond the packed data (loci added to the panel later) are MISSING.
+    """
+    packed = np.frombuffer(packed, dtype=np.uint8) if isinstance(packed, (bytes, bytearray, memoryview)) \
+        else np.asarray(packed, dtype=np.uint8)
+    shifts = np.array([0, 2, 4, 6], dtype=np.uint8)
+    codes = ((packed[:, None] >> shifts) & 0b11).reshape(-1)
+    if len(codes) >= n_calls:
+        return codes[:n_calls]
+    return np.concatenate([codes, np.zeros(n_calls - len(codes), dtype=np.uint8)])
+
+def load_panel(path: Path) -> LocusPanel:
+    """
+    Reads a panel saved as Parquet (locusID, ref, alt), as panels were kept before they moved to the database.
+    """
+    frame = pl.read_parquet(path)
+    return LocusPanel(
+        frame["locusID"].to_numpy().astype(object),
+        frame["ref"].to_numpy(),
+        frame["alt"].to_numpy()
+    )
@@ -0,0 +1,198 @@
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import polars as pl
+
+# Column names of a single-sample TPED file
+TPED_COLUMNS = ["chromossome", "locusID", "geneticDistance", "distance", "firstAllele", "secondAllele"]
+TFAM_COLUMNS = ["FID", "IID", "PAT", "MAT", "SEX", "PHE"]
+
+# Compact types of the TPED locus columns; alleles are read as strings and decoded to BASE_CODES
+TPED_LOCUS_SCHEMA = {
+    "chromossome": pl.Categorical,
+    "locusID": pl.String,
+    "geneticDistance": pl.Float32,
+    "distance": pl.Int32
+}
+
+# Numeric allele codes: A=1, C=2, G=3, T=4, 0 (and anything else) = unknown
+BASE_CODES = {"A": 1, "C": 2, "G": 3, "T": 4, "0": 0}
+
+# Rows per batch while streaming a TPED
+TPED_BATCH_ROWS = 100_000
+# PLINK --dog numeric codes of the non-autosomal chromosomes
+DOG_AUTOSOMES = 38
+DOG_CHROMOSOME_CODES = {"X": 39, "Y": 40, "XY": 41, "MT": 42}
+
+def map_bases(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Map DNA bases to numeric values: A=1, C=2, G=3, T=4, 0=0
+
+    Allele columns that already hold numeric codes (see scan_tped) are returned as they are
+    """
+    if df.schema["firstAllele"].is_numeric() and df.schema["secondAllele"].is_numeric():
+        return df
+
+    mapping = {
+        "A": "1",
+        "C": "2",
+        "G": "3",
+        "T": "4",
+        "0": "0"
+    }
+    # Replace values in firstAllele and secondAllele columns and return new DataFrame
+    return df.with_columns([
+        pl.col("firstAllele").replace(mapping).cast(pl.Int8),
+        pl.col("secondAllele").replace(mapping).cast(pl.Int8)
+    ])
+
+def allele_columns(n_samples: int = 1) -> list[str]:
+    """
+    Names of the allele columns of a TPED with `n_samples` samples: firstAllele/secondAllele for a single
+    sample, firstAllele_{i}/secondAllele_{i} (i from 0) otherwise.
+    """
+    if n_samples == 1:
+        return ["firstAllele", "secondAllele"]
+    return [f"{name}_{i}" for i in range(n_samples) for name in ("firstAllele", "secondAllele")]
+
+def tped_schema(n_samples: int = 1) -> dict[str, pl.DataType]:
+    """
+    The schema TPED files are scanned with: typed locus columns, then the allele columns as strings.
+    """
+    return {**TPED_LOCUS_SCHEMA, **{column: pl.String for column in allele_columns(n_samples)}}
+
+def decode_alleles(frame: pl.LazyFrame, n_samples: int = 1) -> pl.LazyFrame:
+    """
+    Decodes the allele columns of a TPED frame to UInt8 BASE_CODES.
+    """
+    return frame.with_columns(
+        pl.col(column).str.to_uppercase().replace_strict(BASE_CODES, default=0, return_dtype=pl.UInt8)
+        for column in allele_columns(n_samples)
+    )
+
+def tped_samples(tped_file: Path) -> int:
+    """
+    Number of samples of a TPED file: the lines of its TFAM when there is one, else counted on its first line.
+    """
+    tped_file = Path(tped_file)
+    tfam_file = tped_file.with_suffix(".tfam")
+    if tfam_file.exists():
+        with open(tfam_file, "r") as f:
+            return sum(1 for line in f if line.strip())
+    with open(tped_file, "r") as f:
+        return (len(f.readline().rstrip("\r\n").split("\t")) - len(TPED_LOCUS_SCHEMA)) // 2
+
+def scan_tped(tped_file: Path, n_samples: Optional[int] = None) -> pl.LazyFrame:
+    """
+    Lazily scans a TPED file with compact types: categorical chromosome, Int32 positions and UInt8 allele
+    codes (see BASE_CODES), decoded during the scan.
+
+    Args:
+        tped_file (Path): The path to the TPED file (with extension).
+        n_samples (Optional[int]): Number of samples; read from the TFAM or the first line by default.
+    """
+    n_samples = n_samples or tped_samples(tped_file)
+    frame = pl.scan_csv(tped_file, separator="\t", has_header=False, schema=tped_schema(n_samples))
+    return decode_alleles(frame, n_samples)
+
+def read_tped(tped_file: Path) -> pl.DataFrame:
+    """
+    Reads a single-sample TPED file into the named columns used across the service (see scan_tped).
+
+    Args:
+        tped_file (Path): The path to the TPED file (with extension).
+    """
+    return scan_tped(tped_file, n_samples=1).collect()
+
+def iter_tped_chromosomes(tped_file: Path, n_samples: Optional[int] = None,
+                          batch_rows: int = TPED_BATCH_ROWS) -> Iterator[pl.DataFrame]:
+    """
+    Streams a TPED file one chromosome at a time, so only one chromosome (plus one batch) is held in memory.
+
+    Chromosomes are expected in contiguous blocks, as PLINK writes them; a chromosome that shows up again
+    later in the file is yielded again.
+
+    Args:
+        tped_file (Path): The path to the TPED file (with extension).
+        n_samples (Optional[int]): Number of samples; read from the TFAM or the first line by default.
+        batch_rows (int): Number of rows parsed per batch.
+    """
+    pending: list[pl.DataFrame] = []
+    for batch in scan_tped(tped_file, n_samples).collect_batches(chunk_size=batch_rows):
+        # Split the batch where the chromosome changes
+        runs = batch.with_row_index("row").group_by(
+            pl.col("chromossome").rle_id(), maintain_order=True
+        ).agg(pl.col("row").first().alias("start"), pl.len().alias("rows"))
+        for start, rows in runs.select("start", "rows").iter_rows():
+            run = batch.slice(start, rows)
+            if pending and pending[-1]["chromossome"][0] != run["chromossome"][0]:
+                yield pl.concat(pending)
+                pending = []
+            pending.append(run)
+    if pending:
+        yield pl.concat(pending)
+
+def read_tfam(tfam_file: Path) -> pl.DataFrame:
+    """
+    Reads a TFAM/FAM file (whitespace-separated FID IID PAT MAT SEX PHE).
+
+    Args:
+        tfam_file (Path): The path to the TFAM file (with extension).
+    """
+    with open(tfam_file, "r") as f:
+        rows = [line.split()[:len(TFAM_COLUMNS)] for line in f if line.strip()]
+    return pl.DataFrame(rows, schema=TFAM_COLUMNS, orient="row").with_columns(
+        pl.col("SEX").cast(pl.Int8, strict=False),
+        pl.col("PHE").cast(pl.Float64, strict=False).cast(pl.Int32, strict=False)
+    )
+
+def write_tped(tped: pl.DataFrame, samples: pl.DataFrame, prefix: Path) -> Path:
+    """
+    Writes a single-sample TPED frame (alleles as bases or BASE_CODES) and its TFAM row as {prefix}.tped/.tfam.
+
+    Args:
+        tped (pl.DataFrame): The TPED rows, with the columns of TPED_COLUMNS.
+        samples (pl.DataFrame): The sample's TFAM row (columns of TFAM_COLUMNS).
+        prefix (Path): The path of the files, without extension.
+
+    Returns:
+        Path: The .tped path.
+    """
+    bases = {code: base for base, code in BASE_CODES.items()}
+    tped_file = Path(f"{prefix}.tped")
+    tped.select(
+        pl.col("chromossome").cast(pl.String),
+        pl.col("locusID"),
+        pl.col("geneticDistance"),
+        pl.col("distance"),
+        *(pl.col(column).replace_strict(bases, default="0", return_dtype=pl.String)
+          if tped.schema[column].is_numeric() else pl.col(column)
+          for column in ("firstAllele", "secondAllele"))
+    ).write_csv(tped_file, separator="\t", include_header=False)
+    samples.select(TFAM_COLUMNS).write_csv(Path(f"{prefix}.tfam"), separator=" ", include_header=False)
+    return tped_file
+
+def chromosome_codes(chromosomes: pl.Series) -> np.ndarray:
+    """
+    Converts chromosome names to PLINK --dog numeric codes (X=39, Y=40, XY=41, MT=42; unknown=0).
+    """
+    names = chromosomes.cast(pl.String).str.to_uppercase().str.replace("^CHR", "")
+    return names.replace(DOG_CHROMOSOME_CODES).cast(pl.Int8, strict=False).fill_null(0).to_numpy()
+
+def tped_calls(tped: pl.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Extracts the arrays the native engines work on from a TPED DataFrame.
+
+    Returns:
+        dict[str, np.ndarray]: "chromosome" (PLINK codes), "position" (bp), "locus_id", and the
+            numeric "first"/"second" allele codes of `map_bases`.
+    """
+    calls = map_bases(tped.select(["chromossome", "locusID", "distance", "firstAllele", "secondAllele"]))
+    return {
+        "chromosome": chromosome_codes(calls["chromossome"]),
+        "position": calls["distance"].cast(pl.Int64).to_numpy(),
+        "locus_id": calls["locusID"].cast(pl.String).to_numpy(),
+        "first": calls["firstAllele"].to_numpy().astype(np.uint8),
+        "second": calls["secondAllele"].to_numpy().astype(np.uint8)
+    }
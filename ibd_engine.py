@@ -0,0 +1,306 @@
+import math
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import polars as pl
+
+from genotypes import DOG_AUTOSOMES, read_tfam, read_tped, tped_calls
+from plink_reports import GENOME_SCHEMA
+
+# Columns of a default (not "full") PLINK .genome report
+GENOME_COLUMNS = ["FID1", "IID1", "FID2", "IID2", "RT", "EZ", "Z0", "Z1", "Z2", "PI_HAT", "PHE", "DST", "PPC", "RATIO"]
+
+def dosages(first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """
+    Converts (dogs x SNPs) allele code matrices to reference-allele counts (0, 1, 2; -1 = missing).
+
+    The reference allele of a locus is the highest allele code seen across the dogs, which is
+    consistent for bi-allelic SNPs whatever the order the dogs are given in.
+    """
+    first = np.atleast_2d(first)
+    second = np.atleast_2d(second)
+    ref = np.maximum(first.max(axis=0), second.max(axis=0))
+    counts = (first == ref).astype(np.int8) + (second == ref).astype(np.int8)
+    counts[(first == 0) | (second == 0)] = -1
+    return counts
+
+def _expected_ibs(counts: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Per-locus expected IBS sharing given IBD state, from the sample allele counts.
+
+    Uses PLINK's small-sample correction: allele frequencies are drawn without replacement from the
+    2N observed alleles. Loci with fewer than 4 observed alleles get no weight.
+    """
+    called = counts >= 0
+    a = np.where(called, counts, 0).sum(axis=0).astype(np.float64)
+    b = np.where(called, 2 - counts, 0).sum(axis=0).astype(np.float64)
+    t = a + b
+    usable = t >= 4
+    t = np.where(usable, t, 4)
+    d4 = t * (t - 1) * (t - 2) * (t - 3)
+    d3 = t * (t - 1) * (t - 2)
+    return {
+        "usable": usable,
+        "e00": 2 * a * (a - 1) * b * (b - 1) / d4,
+        "e10": 4 * (a * (a - 1) * (a - 2) * b + a * b * (b - 1) * (b - 2)) / d4,
+        "e20": (a * (a - 1) * (a - 2) * (a - 3) + b * (b - 1) * (b - 2) * (b - 3) + 4 * a * (a - 1) * b * (b - 1)) / d4,
+        "e11": 2 * (a * (a - 1) * b + a * b * (b - 1)) / d3,
+        "e21": (a * (a - 1) * (a - 2) + b * (b - 1) * (b - 2) + a * (a - 1) * b + a * b * (b - 1)) / d3,
+    }
+
+def _upper_normal_tail(z: np.ndarray) -> np.ndarray:
+    return 0.5 * np.vectorize(math.erfc)(z / math.sqrt(2))
+
+def genome_pairs(counts: np.ndarray, samples: pl.DataFrame,
+                 pairs: Optional[np.ndarray] = None) -> pl.DataFrame:
+    """
+    Method-of-moments IBD estimates for pairs of dogs, laid out like PLINK's .genome report.
+
+    Args:
+        counts (np.ndarray): (dogs x SNPs) reference-allele counts from `dosages`; allele frequencies
+            are estimated from all the dogs given.
+        samples (pl.DataFrame): One row per dog with FID and IID columns.
+        pairs (np.ndarray): (pairs x 2) row indices to compare (default: every pair, like --genome).
+
+    Returns:
+        pl.DataFrame: FID1 IID1 FID2 IID2 RT EZ Z0 Z1 Z2 PI_HAT PHE DST PPC RATIO, plus IBS0, IBS1,
+            IBS2 and HETHET counts.
+    """
+    dogs = counts.shape[0]
+    if pairs is None:
+        pairs = np.array([(i, j) for i in range(dogs) for j in range(i + 1, dogs)], dtype=np.int64).reshape(-1, 2)
+    expected = _expected_ibs(counts)
+
+    g1, g2 = counts[pairs[:, 0]], counts[pairs[:, 1]]
+    both = (g1 >= 0) & (g2 >= 0) & expected["usable"]
+    difference = np.abs(g1.astype(np.int16) - g2)
+    ibs0 = (both & (difference == 2)).sum(axis=1)
+    ibs1 = (both & (difference == 1)).sum(axis=1)
+    ibs2 = (both & (difference == 0)).sum(axis=1)
+    hethet = (both & (g1 == 1) & (g2 == 1)).sum(axis=1)
+    loci = np.maximum(both.sum(axis=1), 1)
+
+    def mean_expected(key: str) -> np.ndarray:
+        return np.where(both, expected[key], 0).sum(axis=1) / loci
+
+    e00, e10, e20, e11, e21 = (mean_expected(key) for key in ("e00", "e10", "e20", "e11", "e21"))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z0 = np.nan_to_num(ibs0 / loci / e00)
+        z1 = np.nan_to_num((ibs1 / loci - z0 * e10) / e11)
+        z2 = ibs2 / loci - z0 * e20 - z1 * e21
+
+    # Bound the estimates to valid probabilities, as PLINK does
+    z = np.clip(np.stack([z0, z1, z2], axis=1), 0, None)
+    z = z / np.maximum(z.sum(axis=1, keepdims=True), 1e-12)
+    z0, z1, z2 = z[:, 0], z[:, 1], z[:, 2]
+
+    # IBS binomial test: HETHET:IBS0 is 2:1 between unrelated dogs
+    tested = ibs0 + hethet
+    null_rate = 1 / 3
+    spread = np.sqrt(np.maximum(tested * null_rate * (1 - null_rate), 1e-12))
+    ppc = _upper_normal_tail((ibs0 - tested * null_rate) / spread)
+
+    fid = samples["FID"].cast(pl.String).to_numpy()
+    iid = samples["IID"].cast(pl.String).to_numpy()
+    fid1, fid2 = fid[pairs[:, 0]], fid[pairs[:, 1]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(ibs0 > 0, hethet / np.maximum(ibs0, 1), np.nan)
+
+    return pl.DataFrame({
+        "FID1": fid1,
+        "IID1": iid[pairs[:, 0]],
+        "FID2": fid2,
+        "IID2": iid[pairs[:, 1]],
+        "RT": np.where(fid1 == fid2, "OT", "UN"),
+        "EZ": np.full(len(pairs), np.nan),
+        "Z0": z0,
+        "Z1": z1,
+        "Z2": z2,
+        "PI_HAT": z1 / 2 + z2,
+        "PHE": np.full(len(pairs), -1),
+        "DST": (ibs2 + 0.5 * ibs1) / loci,
+        "PPC": ppc,
+        "RATIO": ratio,
+        "IBS0": ibs0,
+        "IBS1": ibs1,
+        "IBS2": ibs2,
+        "HETHET": hethet
+    }, nan_to_null=True).cast({column: GENOME_SCHEMA[column] for column in GENOME_SCHEMA if column != "HOMHOM"})
+
+def mendelian_errors(offspring: np.ndarray, parent1: np.ndarray, parent2: np.ndarray) -> dict[str, float]:
+    """
+    Counts the loci where an offspring's genotype can't be inherited from the two parents.
+
+    Args:
+        offspring, parent1, parent2 (np.ndarray): Reference-allele counts from `dosages` (or stacked
+            (candidates x SNPs) arrays for the parents, compared row by row).
+
+    Returns:
+        dict[str, float]: "mendelian_errors", "informative_loci" (called in all three) and "error_rate".
+    """
+    called = (offspring >= 0) & (parent1 >= 0) & (parent2 >= 0)
+    # Fewest and most reference alleles the parents can pass on together
+    fewest = (parent1 == 2).astype(np.int8) + (parent2 == 2)
+    most = (parent1 >= 1).astype(np.int8) + (parent2 >= 1)
+    errors = (called & ((offspring < fewest) | (offspring > most))).sum(axis=-1)
+    informative = called.sum(axis=-1)
+    return {
+        "mendelian_errors": errors,
+        "informative_loci": informative,
+        "error_rate": errors / np.maximum(informative, 1)
+    }
+
+def load_aligned_calls(tped_files: list[Path], autosomes_only: bool = True) -> dict[str, np.ndarray]:
+    """
+    Reads several single-sample TPEDs and aligns them on the loci they share (see align_calls).
+    """
+    return align_calls([tped_calls(read_tped(Path(tped_file))) for tped_file in tped_files], autosomes_only)
+
+def align_calls(calls: list[dict[str, np.ndarray]], autosomes_only: bool = True) -> dict[str, np.ndarray]:
+    """
+    Aligns the calls of several dogs (each in the layout of genotypes.tped_calls) on the loci they share.
+
+    Returns:
+        dict[str, np.ndarray]: "locus_id", "chromosome", "position" and (dogs x SNPs) "first"/"second" allele codes.
+    """
+    shared = calls[0]["locus_id"]
+    for dog in calls[1:]:
+        # Locus ids are object arrays, on which np.isin compares every pair
+        present = set(dog["locus_id"])
+        shared = shared[np.fromiter((locus_id in present for locus_id in shared), dtype=bool, count=len(shared))]
+
+    aligned = {"first": [], "second": []}
+    for dog in calls:
+        order = np.argsort(dog["locus_id"])
+        index = order[np.searchsorted(dog["locus_id"], shared, sorter=order)]
+        aligned["first"].append(dog["first"][index])
+        aligned["second"].append(dog["second"][index])
+        if "locus_id" not in aligned:
+            aligned.update(locus_id=shared, chromosome=dog["chromosome"][index], position=dog["position"][index])
+
+    keep = np.ones(len(shared), dtype=bool)
+    if autosomes_only:
+        keep = (aligned["chromosome"] > 0) & (aligned["chromosome"] <= DOG_AUTOSOMES)
+    return {
+        "locus_id": aligned["locus_id"][keep],
+        "chromosome": aligned["chromosome"][keep],
+        "position": aligned["position"][keep],
+        "first": np.stack(aligned["first"])[:, keep],
+        "second": np.stack(aligned["second"])[:, keep]
+    }
+
+def native_parentage(offspring_file: Path, parent1_file: Path,
+                     parent2_file: Path) -> tuple[pl.DataFrame, dict[str, float]]:
+    """
+    In-process alternative to plink_parentage: pairwise IBD between the three dogs plus a trio
+    Mendelian-inconsistency count, on the autosomal loci the three TPEDs share.
+
+    Args:
+        offspring_file (Path): The path to the offspring's .tped file (a .tfam must sit next to it).
+        parent1_file (Path): The path to the first parent's .tped file.
+        parent2_file (Path): The path to the second parent's .tped file.
+
+    Returns:
+        tuple[pl.DataFrame, dict[str, float]]: The .genome-style frame and the trio Mendelian error summary.
+    """
+    tped_files = [Path(offspring_file), Path(parent1_file), Path(parent2_file)]
+    samples = pl.concat([read_tfam(tped_file.with_suffix(".tfam")).head(1) for tped_file in tped_files])
+    return trio_parentage(load_aligned_calls(tped_files), samples)
+
+def trio_parentage(calls: dict[str, np.ndarray], samples: pl.DataFrame,
+                   autosomes_only: bool = True) -> tuple[pl.DataFrame, dict[str, float]]:
+    """
+    Pairwise IBD and the trio Mendelian-inconsistency count for calls already in memory.
+
+    Args:
+        calls (dict[str, np.ndarray]): "chromosome" and (3 x SNPs) "first"/"second" allele codes of the
+            offspring and the two parents, in that order (e.g. from load_aligned_calls or Cohort.calls).
+        samples (pl.DataFrame): The three dogs' FID and IID.
+        autosomes_only (bool): Only use chromosomes 1-38 (default: True).
+    """
+    keep = np.ones(len(calls["chromosome"]), dtype=bool)
+    if autosomes_only:
+        keep = (calls["chromosome"] > 0) & (calls["chromosome"] <= DOG_AUTOSOMES)
+    counts = dosages(calls["first"][:, keep], calls["second"][:, keep])
+
+    genome = genome_pairs(counts, samples).select(GENOME_COLUMNS)
+    trio = mendelian_errors(counts[0], counts[1], counts[2])
+    return genome, {key: value.item() for key, value in trio.items()}
+
+def _rank_candidates(pairs: pl.DataFrame) -> pl.DataFrame:
+    """
+    Orders offspring-candidate pairs from most to least likely parent: highest PI_HAT, then fewest
+    opposite homozygotes (IBS0) when available.
+    """
+    order = ["PI_HAT", "IBS0"] if "IBS0" in pairs.columns else ["PI_HAT"]
+    descending = [True, False][:len(order)]
+    return pairs.sort(order, descending=descending, nulls_last=True).with_row_index("RANK", offset=1)
+
+def screen_candidates(offspring_file: Path, candidate_files: list[Path], roles: Optional[list[str]] = None,
+                      top_k: int = 5, pair_results: Optional[pl.DataFrame] = None
+                      ) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Screens one offspring against N candidate parents in a single pass.
+
+    Offspring-candidate IBD is computed only for those N pairs (allele frequencies come from all N + 1
+    dogs), instead of N separate trio runs. The `top_k` candidates are then combined into trios and scored
+    by Mendelian inconsistencies: sires x dams when roles are given, every pair of candidates otherwise.
+
+    Args:
+        offspring_file (Path): The path to the offspring's .tped file (a .tfam must sit next to it).
+        candidate_files (list[Path]): The paths to the candidates' .tped files.
+        roles (list[str]): "sire" or "dam" per candidate (default: unknown).
+        top_k (int): Number of best-ranked candidates (per role, when given) combined into trios.
+        pair_results (pl.DataFrame): Offspring-candidate rows of a PLINK .genome report, in candidate
+            order, to rank instead of the native IBD estimates.
+
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame]: Candidates ranked by relatedness to the offspring, and trio
+            combinations ranked by Mendelian error rate.
+    """
+    tped_files = [Path(offspring_file)] + [Path(candidate_file) for candidate_file in candidate_files]
+    if roles is None:
+        roles = ["unknown"] * len(candidate_files)
+    if len(roles) != len(candidate_files):
+        raise ValueError("roles must have one entry per candidate")
+
+    samples = pl.concat([read_tfam(tped_file.with_suffix(".tfam")).head(1) for tped_file in tped_files])
+    calls = load_aligned_calls(tped_files)
+    counts = dosages(calls["first"], calls["second"])
+    candidates = np.arange(1, len(tped_files))
+
+    if pair_results is None:
+        pair_results = genome_pairs(counts, samples, np.stack([np.zeros_like(candidates), candidates], axis=1))
+    ranked = _rank_candidates(pair_results.with_columns(
+        pl.Series("CANDIDATE", candidates - 1, dtype=pl.Int32),
+        pl.Series("ROLE", roles, dtype=pl.String)
+    ))
+
+    # Trio combinations among the best candidates
+    if any(role != "unknown" for role in roles):
+        sires = ranked.filter(pl.col("ROLE") == "sire").head(top_k)["CANDIDATE"].to_list()
+        dams = ranked.filter(pl.col("ROLE") == "dam").head(top_k)["CANDIDATE"].to_list()
+        combinations = [(sire, dam) for sire in sires for dam in dams]
+    else:
+        best = ranked.head(top_k)["CANDIDATE"].to_list()
+        combinations = [(best[i], best[j]) for i in range(len(best)) for j in range(i + 1, len(best))]
+
+    trio_schema = {"PARENT1": pl.Int32, "IID_PARENT1": pl.String, "PARENT2": pl.Int32, "IID_PARENT2": pl.String,
+                   "MENDELIAN_ERRORS": pl.Int64, "INFORMATIVE_LOCI": pl.Int64, "ERROR_RATE": pl.Float64}
+    if not combinations:
+        return ranked, pl.DataFrame(schema=trio_schema).with_row_index("RANK", offset=1)
+
+    parents = np.array(combinations, dtype=np.int64) + 1
+    errors = mendelian_errors(counts[0], counts[parents[:, 0]], counts[parents[:, 1]])
+    iid = samples["IID"].cast(pl.String).to_numpy()
+    trios = pl.DataFrame({
+        "PARENT1": parents[:, 0] - 1,
+        "IID_PARENT1": iid[parents[:, 0]],
+        "PARENT2": parents[:, 1] - 1,
+        "IID_PARENT2": iid[parents[:, 1]],
+        "MENDELIAN_ERRORS": errors["mendelian_errors"],
+        "INFORMATIVE_LOCI": errors["informative_loci"],
+        "ERROR_RATE": errors["error_rate"]
+    }).cast(trio_schema)
+    return ranked, trios.sort("ERROR_RATE").with_row_index("RANK", offset=1)
@@ -0,0 +1,364 @@
+"""
+Bulk ingestion of a folder of genotype archives (e.g. an Embark batch) into the database.
+
+Archives are unzipped and parsed in a process pool (unzip_file + process_zip), and the parsed
+genotypes are handed over a bounded queue to loader threads that write them with the db_connection
+loaders (tbl_loci/tbl_alleles, and optionally tbl_packed_genotypes) and appended to the standing
+cohort fileset (COHORT_DIR, as /snp_upload does) a batch at a time. Every archive loaded or failed
+is appended to a progress file, so an interrupted run picks up where it stopped; archives that
+changed since they were loaded are loaded again.
+
+The dog ID of an archive is read from its file name with --dog-id-pattern (first group, default:
+the first number, e.g. 289 for 289_223766.zip), or looked up in a --dog-ids CSV (columns: file, dog_id,
+file being the archive path relative to the folder).
+
+Usage:
+    python ingest.py "files/Embark 8" --source 1 --workers 8
+    python ingest.py "files/Embark 8" --source 1 --dog-ids dogs.csv --packed --summary summary.json
+"""
+import argparse
+import csv
+import json
+import os
+import queue
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Iterator, NamedTuple, Optional
+
+import polars as pl
+
+import db_connection
+from cohort import Cohort, get_cohort
+from genotypes import tped_calls
+from metrics import request_timings, span
+
+PROGRESS_NAME = ".ingest_progress.jsonl"
+
+class Archive(NamedTuple):
+    """A zip archive to ingest and the dog it belongs to."""
+    path: Path
+    name: str
+    dog_id: int
+    # Size and modification time, so archives changed after they were loaded are loaded again
+    version: str
+
+class Parsed(NamedTuple):
+    """Genotypes of an archive parsed by a pool worker, with the time spent per stage."""
+    archive: Archive
+    tped: Optional[pl.DataFrame]
+    timings: dict[str, float]
+    error: Optional[str] = None
+
+class Progress:
+    """
+    Append-only log of the archives already ingested, one JSON object per line.
+
+    Args:
+        path (Path): The progress file; created on first use.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._done: dict[str, str] = {}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by an interrupted run
+                        continue
+                    if entry.get("status") == "done":
+                        self._done[entry["file"]] = entry["version"]
+                    else:
+                        self._done.pop(entry["file"], None)
+
+    def is_done(self, archive: Archive) -> bool:
+        return self._done.get(archive.name) == archive.version
+
+    def record(self, archive: Archive, status: str, **details: Any) -> None:
+        entry = {"file": archive.name, "version": archive.version, "dog_id": archive.dog_id, "status": status,
+                 "finished_at": time.time(), **details}
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+            if status == "done":
+                self._done[archive.name] = archive.version
+
+class StageTotals:
+    """
+    Seconds, rows and archives per stage, summed over the archives of a run.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.stages: dict[str, dict[str, float]] = {}
+
+    def add(self, timings: dict[str, float], rows: int, archives: int = 1) -> None:
+        with self._lock:
+            for stage, seconds in timings.items():
+                totals = self.stages.setdefault(stage, {"seconds": 0.0, "rows": 0, "archives": 0})
+                totals["seconds"] += seconds
+                totals["rows"] += rows
+                totals["archives"] += archives
+
+    def summary(self, elapsed: float, archives: int, failed: int, rows: int) -> dict:
+        stages = {
+            stage: {**totals, "rows_per_second": totals["rows"] / totals["seconds"] if totals["seconds"] else None}
+            for stage, totals in self.stages.items()
+        }
+        return {
+            "archives": archives,
+            "failed": failed,
+            "rows": rows,
+            "seconds": elapsed,
+            "archives_per_second": archives / elapsed if elapsed else None,
+            "rows_per_second": rows / elapsed if elapsed else None,
+            "stages": stages
+        }
+
+class CohortBatches:
+    """
+    Collects loaded archives and appends their dogs to a cohort fileset `batch_size` at a time, so the
+    .bed is rewritten at most once per batch rather than once per four dogs (see Cohort.add_many).
+
+    Args:
+        cohort (Cohort): The cohort the dogs are appended to.
+        batch_size (int): Archives per append.
+    """
+
+    def __init__(self, cohort: Cohort, batch_size: int) -> None:
+        self.cohort = cohort
+        self.batch_size = max(batch_size, 1)
+        self._lock = threading.Lock()
+        self._pending: list[Parsed] = []
+
+    def add(self, parsed: Parsed) -> list[Parsed]:
+        """
+        Queues a loaded archive; returns the batch to append once it is full, else nothing.
+        """
+        with self._lock:
+            self._pending.append(parsed)
+            if len(self._pending) < self.batch_size:
+                return []
+            batch, self._pending = self._pending, []
+        return batch
+
+    def drain(self) -> list[Parsed]:
+        """
+        Returns the archives still queued, to append at the end of a run.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return batch
+
+    def append(self, batch: list[Parsed]) -> dict[str, float]:
+        """
+        Appends the dogs of a batch to the cohort and returns the time spent.
+        """
+        with request_timings() as timings:
+            with span("cohort_append"):
+                self.cohort.add_many([(parsed.archive.dog_id, tped_calls(parsed.tped), None) for parsed in batch])
+        return timings.to_dict()
+
+def find_archives(folder: Path, dog_id_pattern: str, dog_ids: Optional[dict[str, int]] = None) -> list[Archive]:
+    """
+    Lists the zip archives under a folder, in path order, with the dog ID of each.
+
+    Raises:
+        ValueError: If the dog ID of an archive can't be found.
+    """
+    pattern = re.compile(dog_id_pattern)
+    archives = []
+    for path in sorted(Path(folder).rglob("*.zip")):
+        name = path.relative_to(folder).as_posix()
+        if dog_ids is not None:
+            if name not in dog_ids:
+                raise ValueError(f"No dog ID for {name} in the --dog-ids file")
+            dog_id = dog_ids[name]
+        else:
+            match = pattern.search(path.stem)
+            if match is None:
+                raise ValueError(f"No dog ID in the file name {name} (pattern {dog_id_pattern!r})")
+            dog_id = int(match.group(1) if match.groups() else match.group(0))
+        stat = path.stat()
+        archives.append(Archive(path, name, dog_id, f"{stat.st_size}:{stat.st_mtime_ns}"))
+    return archives
+
+def read_dog_ids(csv_file: Path) -> dict[str, int]:
+    """
+    Reads a CSV with file and dog_id columns into {file: dog_id}.
+    """
+    with open(csv_file, "r", newline="") as f:
+        return {row["file"]: int(row["dog_id"]) for row in csv.DictReader(f)}
+
+def parse_archive(archive: Archive, scratch: str, extract: bool = True) -> Parsed:
+    """
+    Unzips and parses one archive; runs in a pool worker.
+
+    Errors are returned rather than raised, so one bad archive doesn't stop the run.
+    """
+    with request_timings() as timings:
+        try:
+            with tempfile.TemporaryDirectory(dir=scratch) as folder:
+                tped = db_connection.process_zip(str(archive.path), extract=extract, output_folder=Path(folder))
+            return Parsed(archive, tped, timings.to_dict())
+        except Exception as e:
+            return Parsed(archive, None, timings.to_dict(), f"{type(e).__name__}: {e}")
+
+def _parsed(archives: list[Archive], workers: int, scratch: str, extract: bool) -> Iterator[Parsed]:
+    """
+    Parses archives in a process pool, keeping at most two per worker in flight, and yields them as they finish.
+    """
+    pending = iter(archives)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running: set[Future] = set()
+        while True:
+            while len(running) < 2 * workers and (archive := next(pending, None)) is not None:
+                running.add(pool.submit(parse_archive, archive, scratch, extract))
+            if not running:
+                return
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield future.result()
+
+def _load(parsed: Parsed, source: int, packed: bool, method: str, batch_size: int) -> dict[str, float]:
+    """
+    Writes a parsed archive with the database loaders and returns the time spent per table.
+    """
+    with request_timings() as timings:
+        db_connection.add_to_tbl_alleles(parsed.tped, parsed.archive.dog_id, source, method=method,
+                                         batch_size=batch_size)
+        if packed:
+            db_connection.add_to_tbl_packed_genotypes(parsed.tped, parsed.archive.dog_id, source)
+    return timings.to_dict()
+
+def ingest(archives: list[Archive], progress: Progress, source: int, workers: int = os.cpu_count() or 1,
+           loaders: int = 2, queue_size: int = 8, packed: bool = False, extract: bool = True,
+           method: str = "copy", batch_size: int = 10000, cohort: Optional[Cohort] = None,
+           cohort_batch: int = 16) -> dict:
+    """
+    Parses archives in `workers` processes and loads them with `loaders` threads, through a queue of at
+    most `queue_size` parsed archives; returns the run summary (see StageTotals.summary).
+
+    With a `cohort`, loaded dogs are appended to it `cohort_batch` at a time, and an archive only counts as
+    done once its dog is in the cohort.
+    """
+    totals = StageTotals()
+    counts = {"archives": 0, "failed": 0, "rows": 0}
+    counts_lock = threading.Lock()
+    parsed_queue: queue.Queue[Optional[Parsed]] = queue.Queue(maxsize=queue_size)
+    batches = CohortBatches(cohort, cohort_batch) if cohort is not None else None
+
+    def finish(archive: Archive, error: Optional[str] = None, rows: int = 0, **details: Any) -> None:
+        progress.record(archive, "failed" if error else "done", error=error, rows=rows, **details)
+        with counts_lock:
+            counts["archives"] += 1
+            counts["failed"] += bool(error)
+            counts["rows"] += rows
+        print(f"{'FAILED' if error else 'loaded'} {archive.name} (dog {archive.dog_id})"
+              + (f": {error}" if error else f", {rows} rows"), flush=True)
+
+    def append(batch: list[Parsed]) -> None:
+        if not batch:
+            return
+        try:
+            timings = batches.append(batch)
+            totals.add(timings, sum(parsed.tped.height for parsed in batch), archives=len(batch))
+        except Exception as e:
+            for parsed in batch:
+                finish(parsed.archive, f"{type(e).__name__}: {e}")
+            return
+        for parsed in batch:
+            finish(parsed.archive, rows=parsed.tped.height)
+
+    def load() -> None:
+        while (parsed := parsed_queue.get()) is not None:
+            try:
+                timings = _load(parsed, source, packed, method, batch_size)
+                totals.add(timings, parsed.tped.height)
+            except Exception as e:
+                finish(parsed.archive, f"{type(e).__name__}: {e}")
+                continue
+            if batches is None:
+                finish(parsed.archive, rows=parsed.tped.height)
+            else:
+                append(batches.add(parsed))
+
+    threads = [threading.Thread(target=load, daemon=True) for _ in range(loaders)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="ingest-") as scratch:
+        try:
+            for parsed in _parsed(archives, workers, scratch, extract):
+                if parsed.error:
+                    finish(parsed.archive, parsed.error)
+                    continue
+                totals.add(parsed.timings, parsed.tped.height)
+                # Blocks while the loaders are behind, so parsed archives don't pile up in memory
+                parsed_queue.put(parsed)
+        finally:
+            for _ in threads:
+                parsed_queue.put(None)
+            for thread in threads:
+                thread.join()
+            if batches is not None:
+                append(batches.drain())
+
+    return totals.summary(time.perf_counter() - start, counts["archives"], counts["failed"], counts["rows"])
+
+def print_summary(summary: dict) -> None:
+    print(f"\n{summary['archives']} archives ({summary['failed']} failed), {summary['rows']:,} rows "
+          f"in {summary['seconds']:.1f}s")
+    print(f"{'stage':<28} {'seconds':>10} {'archives':>9} {'rows/s':>14}")
+    for stage, totals in summary["stages"].items():
+        rate = f"{totals['rows_per_second']:14,.0f}" if totals["rows_per_second"] else f"{'-':>14}"
+        print(f"{stage:<28} {totals['seconds']:10.2f} {totals['archives']:9d} {rate}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", type=Path, help="folder searched for *.zip archives, recursively")
+    parser.add_argument("--source", type=int, required=True, help="source ID of the genotypes")
+    parser.add_argument("--dog-id-pattern", default=r"(\d+)",
+                        help="regular expression finding the dog ID in an archive's file name (first group)")
+    parser.add_argument("--dog-ids", type=Path, help="CSV with file and dog_id columns, instead of the pattern")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="archive parsing processes")
+    parser.add_argument("--loaders", type=int, default=2, help="database loader threads")
+    parser.add_argument("--queue-size", type=int, default=8, help="parsed archives waiting for the loaders")
+    parser.add_argument("--packed", action="store_true", help="also store 2-bit packed genotypes")
+    parser.add_argument("--stream", action="store_true", help="parse the .tped members without extracting them")
+    parser.add_argument("--method", choices=["copy", "executemany"], default="copy")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--no-cohort", action="store_true", help="don't append the dogs to the cohort fileset")
+    parser.add_argument("--cohort-batch", type=int, default=16, help="dogs appended to the cohort fileset at a time")
+    parser.add_argument("--progress", type=Path, help=f"progress file (default: FOLDER/{PROGRESS_NAME})")
+    parser.add_argument("--summary", type=Path, help="also save the run summary as JSON")
+    args = parser.parse_args()
+
+    archives = find_archives(args.folder, args.dog_id_pattern, read_dog_ids(args.dog_ids) if args.dog_ids else None)
+    progress = Progress(args.progress or args.folder / PROGRESS_NAME)
+    todo = [archive for archive in archives if not progress.is_done(archive)]
+    print(f"{len(archives)} archives, {len(archives) - len(todo)} already loaded, {len(todo)} to load")
+
+    summary = ingest(todo, progress, args.source, workers=args.workers, loaders=args.loaders,
+                     queue_size=args.queue_size, packed=args.packed, extract=not args.stream, method=args.method,
+                     batch_size=args.batch_size, cohort=None if args.no_cohort else get_cohort(),
+                     cohort_batch=args.cohort_batch)
+    print_summary(summary)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if summary["failed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from metrics import request_timings
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+@dataclass
+class Job:
+    """
+    State of a background analysis job.
+    """
+    id: str
+    kind: str
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Any = None
+    error: Optional[str] = None
+    # Seconds spent per stage while the job ran
+    timings: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed", "cancelled")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "timings": self.timings
+        }
+
+class JobQueue:
+    """
+    Runs blocking analysis functions (PLINK calls) in worker threads, off the event loop.
+
+    At most `max_concurrent` functions run at once; the rest wait their turn in submission order. Queued jobs
+    and calls awaited through run() both count towards `max_queued`.
+
+    Args:
+        max_concurrent (int): Number of analyses allowed to run at the same time.
+        max_queued (int): Number of submitted jobs that may be waiting or running before new submissions are refused.
+        max_finished (int): Number of finished jobs kept for polling; the oldest are forgotten first.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queued: int = 100, max_finished: int = 1000) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._jobs: dict[str, Job] = {}
+        self._tasks: set[asyncio.Task] = set()
+        # Calls of run() waiting or running
+        self._calls = 0
+
+    @classmethod
+    def from_env(cls) -> "JobQueue":
+        """
+        Build a queue sized from PLINK_MAX_CONCURRENT_JOBS, PLINK_MAX_QUEUED_JOBS and JOBS_MAX_FINISHED
+        """
+        return cls(
+            max_concurrent=int(os.getenv("PLINK_MAX_CONCURRENT_JOBS", "2")),
+            max_queued=int(os.getenv("PLINK_MAX_QUEUED_JOBS", "100")),
+            max_finished=int(os.getenv("JOBS_MAX_FINISHED", "1000"))
+        )
+
+    def pending(self) -> int:
+        """Number of jobs and run() calls waiting or running."""
+        return self._calls + sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _admit(self) -> None:
+        if self.pending() >= self.max_queued:
+            raise QueueFullError(f"Job queue is full ({self.max_queued} jobs pending)")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def submit(self, kind: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Job:
+        """
+        Queue `func(*args, **kwargs)` as a background job and return immediately.
+
+        Must be called from the event loop.
+
+        Raises:
+            QueueFullError: If `max_queued` jobs are already pending.
+        """
+        self._admit()
+
+        job = Job(id=uuid.uuid4().hex, kind=kind)
+        self._jobs[job.id] = job
+        task = asyncio.create_task(self._run_job(job, func, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run `func(*args, **kwargs)` in a worker thread under the concurrency limit and wait for its result.
+
+        Raises:
+            QueueFullError: If `max_queued` jobs are already pending.
+        """
+        self._admit()
+        self._calls += 1
+        try:
+            async with self._semaphore:
+                return await asyncio.to_thread(func, *args, **kwargs)
+        finally:
+            self._calls -= 1
+
+    async def _run_job(self, job: Job, func: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        try:
+            async with self._semaphore:
+                job.status = "running"
+                job.started_at = time.time()
+                # The task inherited the submitting request's context; the job collects its own timings
+                with request_timings() as timings:
+                    try:
+                        job.result = await asyncio.to_thread(func, *args, **kwargs)
+                        job.status = "completed"
+                    except Exception as e:
+                        job.error = str(e)
+                        job.status = "failed"
+                    finally:
+                        job.finished_at = time.time()
+                        job.timings = timings.to_dict()
+        except asyncio.CancelledError:
+            # E.g. on shutdown, while queued or running: the job is no longer pending either way
+            job.status = "cancelled"
+            job.error = "Job was cancelled"
+            job.finished_at = job.finished_at or time.time()
+            raise
+        finally:
+            self._prune()
+
+    def _prune(self) -> None:
+        finished = [job for job in self._jobs.values() if job.finished]
+        excess = len(finished) - self.max_finished
+        if excess > 0:
+            for job in sorted(finished, key=lambda job: job.finished_at or 0)[:excess]:
+                del self._jobs[job.id]
@@ -0,0 +1,55 @@
+import threading
+from typing import Optional
+
+import polars as pl
+
+# Schema of the index: locus identifier (tbl_loci.strLocusIdentifier) -> key (tbl_loci.lngLocusID)
+INDEX_SCHEMA = {"locusID": pl.String, "lngLocusID": pl.Int64}
+
+class LocusDictionary:
+    """
+    In-memory hash index of the loci in tbl_loci, mapping locus identifiers to their integer keys.
+
+    The index is loaded once and then only grows: loaders ask it for the loci it doesn't know yet,
+    insert just those, and record the keys the database gave them. Lookups are hash joins, so mapping
+    a 220k-locus TPED to keys doesn't go through Python objects.
+
+    Args:
+        index (Optional[pl.DataFrame]): Known loci with the columns of INDEX_SCHEMA.
+    """
+
+    def __init__(self, index: Optional[pl.DataFrame] = None) -> None:
+        self._index = pl.DataFrame(schema=INDEX_SCHEMA) if index is None else index.select(
+            pl.col(name).cast(dtype) for name, dtype in INDEX_SCHEMA.items()
+        ).unique("locusID", keep="first")
+        # Held by loaders from looking for unknown loci until their keys are recorded
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._index.height
+
+    def __contains__(self, locus_id: str) -> bool:
+        return not self._index.filter(pl.col("locusID") == locus_id).is_empty()
+
+    def missing(self, loci: pl.DataFrame) -> pl.DataFrame:
+        """
+        Returns the rows of `loci` whose locusID isn't in the index, once per locus, in file order.
+        """
+        return loci.unique("locusID", keep="first", maintain_order=True).join(
+            self._index, on="locusID", how="anti"
+        )
+
+    def update(self, keys: pl.DataFrame) -> None:
+        """
+        Records the keys of newly inserted loci (columns of INDEX_SCHEMA); known loci keep their key.
+        """
+        new = keys.select(pl.col(name).cast(dtype) for name, dtype in INDEX_SCHEMA.items())
+        self._index = pl.concat([self._index, new.join(self._index, on="locusID", how="anti")])
+
+    def keys(self, locus_ids: pl.Series) -> pl.Series:
+        """
+        Returns the key of each locus identifier, in order (null for loci that aren't in the index).
+        """
+        return pl.DataFrame({"locusID": locus_ids.cast(pl.String)}).join(
+            self._index, on="locusID", how="left", maintain_order="left"
+        )["lngLocusID"]
@@ -1,32 +1,174 @@
-from plink_integration import plink_roh, plink_parentage
-from zip_file_handler import unzip_file
+from plink_integration import (get_bed_cache, plink_cohort_parentage, plink_cohort_roh, plink_roh, plink_parentage,
+                               plink_parentage_screen)
+from ibd_engine import align_calls, native_parentage, screen_candidates, trio_parentage
+from roh_engine import call_roh_batch, native_roh
+from cohort import Cohort, get_cohort
+from genotypes import read_tfam, read_tped, tped_calls
+from stored_genotypes import get_genotype_cache, load_genotypes, stored_samples, write_stored_tfile
+from zip_file_handler import UNZIP_MAX_COMPRESSION_RATIO, UNZIP_MAX_MEMBER_BYTES, UNZIP_MAX_MEMBERS, ZipLimitError
+from upload_store import StoredUpload, UploadStore
+from jobs import JobQueue, QueueFullError
+from result_cache import ResultCache
+from bed_cache import plink_version
+from plink_scheduler import BATCH, get_plink_scheduler, run_with_priority
+from workspace import get_workspaces
+from relatedness import get_relatedness_store
+import metrics
+from metrics import span
+from responses import NotAcceptableError, ResponseFormat, negotiate, result_response
+import db_connection
 import polars as pl
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import Depends, FastAPI, Query, Request, UploadFile, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import Any, Callable, Optional
+import asyncio
+import logging
 import os
-import shutil
 import uvicorn
 
-app = FastAPI(title="File Upload API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open the database pools on startup (when configured) and close them on shutdown
+    """
+    if os.getenv("PGHOST"):
+        await db_connection.get_async_pool()
+    yield
+    await db_connection.close_async_pool()
+    db_connection.close_pool()
+
+app = FastAPI(title="File Upload API", lifespan=lifespan)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bounded pool for PLINK work, sized from PLINK_MAX_CONCURRENT_JOBS / PLINK_MAX_QUEUED_JOBS
+job_queue = JobQueue.from_env()
+
+# Analysis engines: PLINK subprocesses or the in-process NumPy implementations
+ENGINES = ["plink", "native"]
 
 # Create uploads directory
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
+# Uploads are stored once per content digest and extracted once, and removed once unused for a while
+upload_store = UploadStore(
+    Path(os.getenv("UPLOAD_STORE_DIR", UPLOAD_DIR / "store")),
+    max_member_size=UNZIP_MAX_MEMBER_BYTES,
+    max_compression_ratio=UNZIP_MAX_COMPRESSION_RATIO,
+    max_members=UNZIP_MAX_MEMBERS,
+    max_bytes=int(os.getenv("UPLOAD_STORE_MAX_BYTES", "0")),
+    ttl=float(os.getenv("UPLOAD_STORE_TTL_SECONDS", str(30 * 24 * 3600)))
+)
+
+# Finished ROH and parentage results, keyed by genotype digests and parameters
+result_cache = ResultCache.from_env()
+
+PLINK_PATH = "plink/plink"
+
+# Where the genotypes of a relatedness build come from: the uploaded dogs' cohort fileset or the database
+GENOTYPE_SOURCES = ["cohort", "stored"]
+
+# PLINK outputs kept once an analysis' scratch workspace is dropped (see workspace.WorkspaceManager)
+ROH_ARTIFACTS = ("*.hom", "*.hom.indiv", "*.log")
+GENOME_ARTIFACTS = ("*.genome", "*.log")
+
+@dataclass
+class RohParams:
+    """
+    Scanning window and segment thresholds of an ROH analysis (see plink_roh)
+    """
+    window_snp: int = 50
+    window_het: int = 1
+    window_missing: int = 5
+    window_threshold: float = 0.05
+    homozyg_gap: int = 1000
+    homozyg_het: int = 1000
+    homozyg_density: int = 50
+    homozyg_snp: int = 100
+    homozyg_kb: int = 1000
+
+def response_format(request: Request, format: Optional[str] = None, result: Optional[str] = None) -> ResponseFormat:
+    """
+    Negotiate the format of analysis results from the format query parameter or the Accept header
+
+    json (default), ndjson, arrow or parquet; result picks the table of the single-table formats
+    """
+    try:
+        return ResponseFormat(negotiate(request.headers.get("accept"), format), result)
+    except NotAcceptableError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+@app.middleware("http")
+async def time_request(request: Request, call_next):
+    """
+    Collect the stages run while serving a request and report them in a Server-Timing header
+
+    Stages run while a large body streams (its serialize_* stages) come after the header: once the body is
+    sent, the request's full timings are logged instead
+    """
+    with metrics.request_timings() as timings:
+        response = await call_next(request)
+        response.headers["Server-Timing"] = timings.server_timing()
+        reported = len(timings.stages)
+    response.body_iterator = _log_late_timings(request, response.body_iterator, timings, reported)
+    return response
+
+async def _log_late_timings(request: Request, body, timings: metrics.RequestTimings, reported: int):
+    """
+    Pass a response body through, then log the request's timings if stages ran after its header was sent
+    """
+    async for chunk in body:
+        yield chunk
+    if len(timings.stages) > reported:
+        logger.info(f"{request.method} {request.url.path} Server-Timing: {timings.server_timing()}")
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Report stage timings, subprocess resource usage, queue and cache state in the Prometheus text format
+    """
+    metrics.registry.set("snp_jobs_pending", job_queue.pending())
+    for name, cache in (("bed", get_bed_cache()), ("result", result_cache), ("genotype", get_genotype_cache())):
+        for stat in ("hits", "misses", "evictions"):
+            metrics.registry.set(f"snp_cache_{stat}", getattr(cache, stat), cache=name)
+    return PlainTextResponse(metrics.render())
+
+@app.get("/health")
+async def health():
+    """
+    Report service health, database connectivity, cache, PLINK scheduler and workspace statistics
+    """
+    response = {"status": "ok", "bed_cache": get_bed_cache().stats(), "result_cache": result_cache.stats(),
+                "genotype_cache": get_genotype_cache().stats(), "plink_scheduler": get_plink_scheduler().stats(),
+                "workspaces": get_workspaces().stats()}
+    if not os.getenv("PGHOST"):
+        return {**response, "database": "not configured"}
+
+    database_ok = await db_connection.async_check_database()
+    if not database_ok:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {**response, "database": "ok", "pools": db_connection.pool_stats()}
+
 @app.post("/snp_upload")
 async def upload_file(dog_id: int, file: UploadFile):
     """
     Upload a file with dog ID
     """
-    file_path = UPLOAD_DIR / f"{dog_id}/{file.filename}"
-
     try:
-        # Create parent directory if it doesn't exist
-        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # Save file into the content-addressed store
+        stored = await asyncio.to_thread(_store_upload, file)
+        # Analyses of the dog read its genotypes again rather than the ones cached before this upload
+        get_genotype_cache().invalidate(dog_id)
 
-        # Save file
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Append the dog to the standing cohort fileset; the upload stands even if that fails
+        tped_file = _find_tped(stored)
+        cohort_row = await asyncio.to_thread(_add_to_cohort, dog_id, tped_file) if tped_file else None
+        genotype_digest = await asyncio.to_thread(_genotype_digest, _without_extension(tped_file)) if tped_file else None
 
         # Return success response
         return {
@@ -34,132 +176,777 @@ async def upload_file(dog_id: int, file: UploadFile):
             "message": "File uploaded successfully",
             "dog_id": dog_id,
             "filename": file.filename,
-            "file_path": str(file_path)
+            "file_path": str(stored.archive_path),
+            "digest": stored.digest,
+            "reused": stored.reused,
+            "genotype_digest": genotype_digest,
+            "cohort_row": cohort_row
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/snp_roh")
-async def process_roh(dog_id: int, file: UploadFile):
+async def process_roh(dog_id: int, file: UploadFile, engine: str = "plink", params: RohParams = Depends(),
+                      fmt: ResponseFormat = Depends(response_format)):
     """
     Upload and process a file to calculate ROH
+
+    engine selects PLINK --homozyg ("plink") or the in-process caller ("native"); results are cached
+    per genotypes and parameters (see the X-Cache header)
+    """
+    try:
+        _check_engine(engine)
+        tped_file = await asyncio.to_thread(_prepare_roh, dog_id, file)
+
+        # PLINK runs in a worker thread so the event loop keeps serving other clients
+        body = await job_queue.run(_run_roh, dog_id, tped_file, engine, params)
+        return _result_response(body, fmt)
+
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/snp_parentage")
+async def process_parentage(dog_id: int, offspring_file: UploadFile, parent1_file: UploadFile,
+                            parent2_file: UploadFile, engine: str = "plink",
+                            fmt: ResponseFormat = Depends(response_format)):
     """
-    file_path = UPLOAD_DIR / f"{dog_id}/{file.filename}"
-    results_folder = Path(f"roh/{dog_id}")
+    Upload and process one offspring and two parent files to calculate parentage
 
+    engine selects PLINK --genome ("plink") or the in-process IBD estimator ("native"); results are
+    cached per genotypes (see the X-Cache header)
+    """
     try:
-        # Create directories if they don't exist
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        results_folder.mkdir(parents=True, exist_ok=True)
-        results_file_path = results_folder / f"{dog_id}_roh"
+        _check_engine(engine)
+        paths = await asyncio.to_thread(_prepare_parentage, dog_id, offspring_file, parent1_file, parent2_file)
 
-        # Save file and unzip if necessary
-        extracted_path, _ = _save_file_and_unzip(file, file_path)
+        # PLINK runs in a worker thread so the event loop keeps serving other clients
+        return _result_response(await job_queue.run(_run_parentage, dog_id, *paths, engine), fmt)
 
-        # Find .tped file
-        matches = []
-        for f in os.listdir(extracted_path):
-            if f.endswith(".tped"):
-                matches.append(os.path.join(extracted_path, f))
-                break
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if not matches:
-            raise HTTPException(status_code=400, detail="No .tped file found in the uploaded content")
-        if len(matches) > 1:
-            raise HTTPException(status_code=400, detail="Multiple .tped files found; please upload only one")
+@app.post("/snp_parentage_screen")
+async def process_parentage_screen(dog_id: int, offspring_file: UploadFile,
+                                   sire_files: Optional[list[UploadFile]] = None,
+                                   dam_files: Optional[list[UploadFile]] = None,
+                                   candidate_files: Optional[list[UploadFile]] = None,
+                                   top_k: int = 5, engine: str = "plink",
+                                   fmt: ResponseFormat = Depends(response_format)):
+    """
+    Upload one offspring and any number of candidate parents and rank them in a single IBD run
 
-        # completes path and removes extension
-        tped_file = Path(os.path.splitext(matches[0])[0])
+    Candidates are given as sire_files and dam_files, or as candidate_files when their sex is unknown.
+    The top_k best candidates (per role) are combined into trios ranked by Mendelian inconsistencies
+    """
+    try:
+        _check_engine(engine)
+        paths = await asyncio.to_thread(
+            _prepare_parentage_screen, dog_id, offspring_file, sire_files or [], dam_files or [],
+            candidate_files or []
+        )
 
-        # Call plink_roh function
-        roh_results, roh_indiv_results = plink_roh(tped_file, results_file_path)
+        # PLINK runs in a worker thread so the event loop keeps serving other clients
+        return _result_response(await job_queue.run(_run_parentage_screen, dog_id, *paths, top_k, engine), fmt)
 
-        # Return success response
-        return {
-            "status": "success",
-            "message": "ROH analysis completed successfully",
-            "dog_id": dog_id,
-            "roh_results": roh_results.write_json(),
-            "roh_indiv_results": roh_indiv_results.write_json()
-        }
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/cohort")
+async def cohort_stats():
+    """
+    Report the size of the standing cohort fileset
+    """
+    return await asyncio.to_thread(get_cohort().stats)
+
+@app.post("/cohort/roh")
+async def process_cohort_roh(dog_id: int, engine: str = "plink", params: RohParams = Depends(),
+                             fmt: ResponseFormat = Depends(response_format)):
+    """
+    Calculate ROH for an already uploaded dog from the cohort fileset
+    """
+    try:
+        _check_engine(engine)
+        return _result_response(await job_queue.run(_run_cohort_roh, dog_id, engine, params), fmt)
 
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/snp_parentage")
-async def process_parentage(dog_id: int, offspring_file: UploadFile, parent1_file: UploadFile,
-                            parent2_file: UploadFile):
+@app.post("/cohort/parentage")
+async def process_cohort_parentage(offspring_id: int, parent1_id: int, parent2_id: int, engine: str = "plink",
+                                   fmt: ResponseFormat = Depends(response_format)):
     """
-    Upload and process one offspring and two parent files to calculate parentage
+    Calculate parentage for three already uploaded dogs from the cohort fileset
     """
-    offspring_file_path = UPLOAD_DIR / f"{dog_id}/{offspring_file.filename}"
-    parent1_file_path = UPLOAD_DIR / f"{dog_id}/{parent1_file.filename}"
-    parent2_file_path = UPLOAD_DIR / f"{dog_id}/{parent2_file.filename}"
-    output_genome_file = Path(f"ibd/{dog_id}/{dog_id}")
+    try:
+        _check_engine(engine)
+        body = await job_queue.run(_run_cohort_parentage, offspring_id, parent1_id, parent2_id, engine)
+        return _result_response(body, fmt)
+
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/stored/roh")
+async def process_stored_roh(dog_id: int, source: Optional[int] = None, engine: str = "plink",
+                             params: RohParams = Depends(), fmt: ResponseFormat = Depends(response_format)):
+    """
+    Calculate ROH for a dog whose genotypes are stored in the database, without uploading them again
+
+    source restricts the genotypes to one source (default: all)
+    """
     try:
-        # Create parent directory if it doesn't exist
-        offspring_file_path.parent.mkdir(parents=True, exist_ok=True)
-        output_genome_file.parent.mkdir(parents=True, exist_ok=True)
+        _check_engine(engine)
+        return _result_response(await job_queue.run(_run_stored_roh, dog_id, source, engine, params), fmt)
 
-        # Save files and unzip
-        if not offspring_file.filename or not parent1_file.filename or not parent2_file.filename:
-            raise HTTPException(status_code=400, detail="One or more uploaded files are missing filenames")
-        _, offspring_contents = _save_file_and_unzip(offspring_file, offspring_file_path)
-        _, parent1_contents = _save_file_and_unzip(parent1_file, parent1_file_path)
-        _, parent2_contents = _save_file_and_unzip(parent2_file, parent2_file_path)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        path_offspring = Path()
-        path_parent1 = Path()
-        path_parent2 = Path()
+@app.post("/stored/parentage")
+async def process_stored_parentage(offspring_id: int, parent1_id: int, parent2_id: int,
+                                   offspring_file: Optional[UploadFile] = None, source: Optional[int] = None,
+                                   engine: str = "plink", fmt: ResponseFormat = Depends(response_format)):
+    """
+    Calculate parentage for dogs whose genotypes are stored in the database, without uploading them again
 
-        # Find .tped files
-        for file in offspring_contents:
-            if file.endswith(".tped"):
-                path_offspring = UPLOAD_DIR / f"{dog_id}/{file}"
+    With an offspring_file, the offspring's genotypes come from the upload and only the parents' from the
+    database (offspring_id then just labels the results)
+    """
+    try:
+        _check_engine(engine)
+        path_offspring = None
+        if offspring_file is not None:
+            path_offspring = _find_tped(await asyncio.to_thread(_store_upload, offspring_file))
+            if not path_offspring:
+                raise HTTPException(status_code=400, detail="No .tped file found in the uploaded content")
+        body = await job_queue.run(_run_stored_parentage, offspring_id, parent1_id, parent2_id, path_offspring,
+                                   source, engine)
+        return _result_response(body, fmt)
 
-        for file in parent1_contents:
-            if file.endswith(".tped"):
-                path_parent1 = UPLOAD_DIR / f"{dog_id}/{file}"
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        for file in parent2_contents:
-            if file.endswith(".tped"):
-                path_parent2 = UPLOAD_DIR / f"{dog_id}/{file}"
+@app.delete("/stored/cache")
+async def invalidate_stored_cache(dog_id: Optional[int] = None):
+    """
+    Drop the in-memory copies of stored genotypes: those of one dog (e.g. after ingesting it again), or all of them
+    """
+    return {"status": "success", "removed": get_genotype_cache().invalidate(dog_id)}
 
-        if not path_offspring or not path_parent1 or not path_parent2:
-            raise HTTPException(status_code=400, detail="No .tped file found in the uploaded content")
+@app.post("/jobs/roh", status_code=202)
+async def submit_roh_job(dog_id: int, file: UploadFile, engine: str = "plink", params: RohParams = Depends()):
+    """
+    Upload a file and queue an ROH analysis, returning a job id to poll
+    """
+    try:
+        _check_engine(engine)
+        tped_file = await asyncio.to_thread(_prepare_roh, dog_id, file)
+        job = job_queue.submit("roh", run_with_priority, BATCH, _run_roh, dog_id, tped_file, engine, params)
+        return job.to_dict()
 
-        # Call plink_parentage function
-        genome_results = plink_parentage(path_offspring, path_parent1, path_parent2, output_genome_file)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return {
+@app.post("/jobs/parentage", status_code=202)
+async def submit_parentage_job(dog_id: int, offspring_file: UploadFile, parent1_file: UploadFile,
+                               parent2_file: UploadFile, engine: str = "plink"):
+    """
+    Upload one offspring and two parent files and queue a parentage analysis, returning a job id to poll
+    """
+    try:
+        _check_engine(engine)
+        paths = await asyncio.to_thread(_prepare_parentage, dog_id, offspring_file, parent1_file, parent2_file)
+        job = job_queue.submit("parentage", run_with_priority, BATCH, _run_parentage, dog_id, *paths, engine)
+        return job.to_dict()
+
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/jobs/parentage_screen", status_code=202)
+async def submit_parentage_screen_job(dog_id: int, offspring_file: UploadFile,
+                                      sire_files: Optional[list[UploadFile]] = None,
+                                      dam_files: Optional[list[UploadFile]] = None,
+                                      candidate_files: Optional[list[UploadFile]] = None,
+                                      top_k: int = 5, engine: str = "plink"):
+    """
+    Upload one offspring and its candidate parents and queue a parentage screen, returning a job id to poll
+    """
+    try:
+        _check_engine(engine)
+        paths = await asyncio.to_thread(
+            _prepare_parentage_screen, dog_id, offspring_file, sire_files or [], dam_files or [],
+            candidate_files or []
+        )
+        job = job_queue.submit("parentage_screen", run_with_priority, BATCH, _run_parentage_screen, dog_id, *paths,
+                               top_k, engine)
+        return job.to_dict()
+
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/jobs/relatedness", status_code=202)
+async def submit_relatedness_job(genotypes: str = "cohort", dog_ids: Optional[list[int]] = Query(None),
+                                 source: Optional[int] = None):
+    """
+    Queue a relatedness build (GRM and IBS matrices) over uploaded or stored dogs, returning a job id to poll
+
+    genotypes=cohort uses the cohort fileset (dog_ids default to all of it); genotypes=stored reads dog_ids'
+    genotypes from the database (source restricts them to one source)
+    """
+    try:
+        if genotypes not in GENOTYPE_SOURCES:
+            raise HTTPException(status_code=400,
+                                detail=f"Unknown genotypes: {genotypes}. Expected one of {GENOTYPE_SOURCES}")
+        if genotypes == "stored" and not dog_ids:
+            raise HTTPException(status_code=400, detail="dog_ids are required for stored genotypes")
+        job = job_queue.submit("relatedness", run_with_priority, BATCH, _run_relatedness, genotypes, dog_ids, source)
+        return job.to_dict()
+
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/relatedness")
+async def list_relatedness():
+    """
+    List the relatedness builds kept, newest first
+    """
+    return {"builds": await asyncio.to_thread(get_relatedness_store().builds)}
+
+@app.get("/relatedness/{relatedness_id}/top")
+async def relatedness_top(relatedness_id: str, dog_id: int, k: int = 10, metric: str = "grm",
+                          fmt: ResponseFormat = Depends(response_format)):
+    """
+    Return the k dogs of a relatedness build most related to a dog, by GRM or IBS similarity (metric=dst)
+    """
+    try:
+        related = await asyncio.to_thread(_relatedness_top, relatedness_id, dog_id, k, metric)
+        return _result_response({
             "status": "success",
-            "message": "Parentage analysis completed successfully",
+            "relatedness_id": relatedness_id,
             "dog_id": dog_id,
-            "genome_results": genome_results.write_json()
-        }
+            "metric": metric,
+            "related": related
+        }, fmt)
 
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def _save_file_and_unzip(file: UploadFile, file_path: Path) -> tuple[Path, dict[str, bytes]]:
+@app.get("/relatedness/{relatedness_id}/pairs")
+async def relatedness_pairs(relatedness_id: str, dog_id: Optional[int] = None, min_grm: Optional[float] = None,
+                            fmt: ResponseFormat = Depends(response_format)):
+    """
+    Return the pairs of dogs of a relatedness build, optionally those of one dog and/or with GRM >= min_grm
+    """
+    try:
+        pairs = await asyncio.to_thread(_relatedness_pairs, relatedness_id, dog_id, min_grm)
+        return _result_response({"status": "success", "relatedness_id": relatedness_id, "pairs": pairs}, fmt)
+
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/cache")
+async def invalidate_cache(digest: Optional[str] = None):
+    """
+    Drop cached results: those of one genotype digest (from /snp_upload), or all of them
+    """
+    removed = await asyncio.to_thread(result_cache.invalidate, digest=digest)
+    return {"status": "success", "removed": removed}
+
+@app.delete("/cache/{key}")
+async def invalidate_cache_entry(key: str):
     """
-    Save a file and unzip
+    Drop one cached result, by the key returned in its X-Cache-Key header
+    """
+    removed = await asyncio.to_thread(result_cache.invalidate, key=key)
+    if not removed:
+        raise HTTPException(status_code=404, detail=f"Cache entry {key} not found")
+    return {"status": "success", "removed": removed}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, fmt: ResponseFormat = Depends(response_format)):
+    """
+    Poll a queued analysis; completed jobs include the same result body as the synchronous endpoints
+
+    Asked for another format than JSON, a completed job returns its result alone in that format
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    if job.status != "completed":
+        return job.to_dict()
+    if fmt.name != "json":
+        return _result_response(job.result, fmt, {"X-Job-Id": job.id})
+    return result_response({**job.to_dict(), "result": job.result}, fmt)
+
+def _check_engine(engine: str) -> None:
+    if engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown engine: {engine}. Expected one of {ENGINES}")
+
+def _prepare_roh(dog_id: int, file: UploadFile) -> Path:
+    """
+    Save and unzip an ROH upload
+
+    Returns the .tped path (without extension)
+    """
+    # Save file and unzip, unless the same archive is already in the store
+    stored = _store_upload(file)
+
+    # Find .tped file
+    matches = [name for name in stored.contents if name.endswith(".tped")]
+
+    if not matches:
+        raise HTTPException(status_code=400, detail="No .tped file found in the uploaded content")
+    if len(matches) > 1:
+        raise HTTPException(status_code=400, detail="Multiple .tped files found; please upload only one")
+
+    # completes path and removes extension
+    tped_file = Path(os.path.splitext(stored.contents[matches[0]].path)[0])
+    return tped_file
 
-    Returns the path to the extracted folder
+def _run_roh(dog_id: int, tped_file: Path, engine: str = "plink", params: Optional[RohParams] = None) -> dict:
     """
+    Run ROH analysis with PLINK or the native engine, or reuse a cached result, and build the response body
+
+    PLINK runs in a scratch workspace of its own; only its reports are kept
+    """
+    params = params or RohParams()
+
+    def analyse() -> tuple[dict[str, pl.DataFrame], dict]:
+        if engine == "native":
+            with span("native_roh"):
+                roh_results, roh_indiv_results = native_roh(tped_file, **asdict(params))
+        else:
+            with get_workspaces().open("roh", dog_id) as workspace:
+                roh_results, roh_indiv_results = plink_roh(tped_file, workspace.prefix(f"{dog_id}_roh"),
+                                                           **asdict(params))
+                workspace.promote(*ROH_ARTIFACTS)
+        return {"roh_results": roh_results, "roh_indiv_results": roh_indiv_results}, {}
+
+    frames, _, cache = _cached_analysis(
+        "roh", [_genotype_digest(tped_file)], {**asdict(params), **_engine_params(engine)}, analyse
+    )
+    return {
+        "status": "success",
+        "message": "ROH analysis completed successfully",
+        "dog_id": dog_id,
+        "roh_results": frames["roh_results"],
+        "roh_indiv_results": frames["roh_indiv_results"],
+        "cache": cache
+    }
+
+def _prepare_parentage(dog_id: int, offspring_file: UploadFile, parent1_file: UploadFile,
+                       parent2_file: UploadFile) -> tuple[Path, Path, Path]:
+    """
+    Save and unzip the offspring and parent uploads
+
+    Returns the offspring, parent1 and parent2 .tped paths
+    """
+    # Save files and unzip, unless the same archives are already in the store
+    if not offspring_file.filename or not parent1_file.filename or not parent2_file.filename:
+        raise HTTPException(status_code=400, detail="One or more uploaded files are missing filenames")
+    path_offspring = _find_tped(_store_upload(offspring_file))
+    path_parent1 = _find_tped(_store_upload(parent1_file))
+    path_parent2 = _find_tped(_store_upload(parent2_file))
+
+    if not path_offspring or not path_parent1 or not path_parent2:
+        raise HTTPException(status_code=400, detail="No .tped file found in the uploaded content")
+
+    return path_offspring, path_parent1, path_parent2
+
+def _run_parentage(dog_id: int, path_offspring: Path, path_parent1: Path, path_parent2: Path,
+                   engine: str = "plink") -> dict:
+    """
+    Run parentage analysis with PLINK or the native engine, or reuse a cached result, and build the response body
+
+    The native engine also reports the trio's Mendelian inconsistencies
+    """
+    def analyse() -> tuple[dict[str, pl.DataFrame], dict]:
+        if engine == "native":
+            with span("native_parentage"):
+                genome_results, trio = native_parentage(path_offspring, path_parent1, path_parent2)
+            return {"genome_results": genome_results}, {"mendelian_errors": trio}
+        with get_workspaces().open("parentage", dog_id) as workspace:
+            genome_results = plink_parentage(path_offspring, path_parent1, path_parent2, workspace.prefix(str(dog_id)))
+            workspace.promote(*GENOME_ARTIFACTS)
+        return {"genome_results": genome_results}, {}
+
+    # Results don't depend on the order the parents are given in
+    parents = sorted(_genotype_digest(_without_extension(path)) for path in (path_parent1, path_parent2))
+    inputs = [_genotype_digest(_without_extension(path_offspring)), *parents]
+    frames, values, cache = _cached_analysis("parentage", inputs, _engine_params(engine), analyse)
+
+    return {
+        "status": "success",
+        "message": "Parentage analysis completed successfully",
+        "dog_id": dog_id,
+        **values,
+        "genome_results": frames["genome_results"],
+        "cache": cache
+    }
+
+def _prepare_parentage_screen(dog_id: int, offspring_file: UploadFile, sire_files: list[UploadFile],
+                              dam_files: list[UploadFile], candidate_files: list[UploadFile]
+                              ) -> tuple[Path, list[Path], list[str], list[str]]:
+    """
+    Save and unzip the offspring and candidate uploads
+
+    Returns the offspring and candidate .tped paths, and the candidates' roles and filenames
+    """
+    uploads = [(file, "sire") for file in sire_files] + [(file, "dam") for file in dam_files] \
+        + [(file, "unknown") for file in candidate_files]
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No candidate parent files uploaded")
+    if any(role == "unknown" for _, role in uploads) and any(role != "unknown" for _, role in uploads):
+        raise HTTPException(status_code=400, detail="Give candidates either as sire/dam files or as candidate files")
+
+    path_offspring = _find_tped(_store_upload(offspring_file))
+    path_candidates = [_find_tped(_store_upload(file)) for file, _ in uploads]
+    if not path_offspring or not all(path_candidates):
+        raise HTTPException(status_code=400, detail="No .tped file found in the uploaded content")
+
+    roles = [role for _, role in uploads]
+    filenames = [file.filename for file, _ in uploads]
+    return path_offspring, path_candidates, roles, filenames
+
+def _run_parentage_screen(dog_id: int, path_offspring: Path, path_candidates: list[Path], roles: list[str],
+                          filenames: list[str], top_k: int = 5, engine: str = "plink") -> dict:
+    """
+    Rank candidate parents with a PLINK --genome run over the offspring-candidate pairs or the native engine and build the response body
+
+    CANDIDATE columns index into candidate_files; trios are always scored in-process
+    """
+    pair_results = None
+    if engine == "plink":
+        with get_workspaces().open("parentage_screen", dog_id) as workspace:
+            pair_results = plink_parentage_screen(path_offspring, path_candidates,
+                                                  workspace.prefix(f"{dog_id}_screen"))
+            workspace.promote(*GENOME_ARTIFACTS)
+    with span("native_screen"):
+        candidates, trios = screen_candidates(path_offspring, path_candidates, roles, top_k, pair_results)
+
+    return {
+        "status": "success",
+        "message": "Parentage screen completed successfully",
+        "dog_id": dog_id,
+        "candidate_files": filenames,
+        "candidates": candidates,
+        "trios": trios
+    }
 
-    with Path(file_path).open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+def _run_cohort_roh(dog_id: int, engine: str = "plink", params: Optional[RohParams] = None) -> dict:
+    """
+    Run ROH analysis on one cohort dog and build the response body
+    """
+    params = params or RohParams()
+    cohort = get_cohort()
+    if engine == "native":
+        samples, calls = cohort.calls([dog_id])
+        with span("native_roh"):
+            roh_results, roh_indiv_results = call_roh_batch(
+                calls["chromosome"], calls["position"], calls["locus_id"], calls["first"], calls["second"], samples,
+                **asdict(params)
+            )
+    else:
+        # Fails on unknown dogs before PLINK runs
+        cohort.require([dog_id])
+        with get_workspaces().open("cohort_roh", dog_id) as workspace:
+            roh_results, roh_indiv_results = plink_cohort_roh(
+                cohort, dog_id, workspace.prefix(f"{dog_id}_roh"), **asdict(params)
+            )
+            workspace.promote(*ROH_ARTIFACTS)
+
+    return {
+        "status": "success",
+        "message": "ROH analysis completed successfully",
+        "dog_id": dog_id,
+        "roh_results": roh_results,
+        "roh_indiv_results": roh_indiv_results
+    }
+
+def _run_cohort_parentage(offspring_id: int, parent1_id: int, parent2_id: int, engine: str = "plink") -> dict:
+    """
+    Run parentage analysis on three cohort dogs and build the response body
+    """
+    cohort = get_cohort()
+    dog_ids = [offspring_id, parent1_id, parent2_id]
+    response = {
+        "status": "success",
+        "message": "Parentage analysis completed successfully",
+        "dog_id": offspring_id
+    }
+    if engine == "native":
+        samples, calls = cohort.calls(dog_ids)
+        with span("native_parentage"):
+            genome_results, trio = trio_parentage(calls, samples)
+        response["mendelian_errors"] = trio
+    else:
+        cohort.require(dog_ids)
+        with get_workspaces().open("cohort_parentage", offspring_id) as workspace:
+            genome_results = plink_cohort_parentage(cohort, *dog_ids, workspace.prefix(f"{offspring_id}_cohort"))
+            workspace.promote(*GENOME_ARTIFACTS)
+
+    response["genome_results"] = genome_results
+    return response
+
+def _run_stored_roh(dog_id: int, source: Optional[int] = None, engine: str = "plink",
+                    params: Optional[RohParams] = None) -> dict:
+    """
+    Run ROH analysis on a dog's stored genotypes and build the response body
+    """
+    params = params or RohParams()
+    if engine == "native":
+        calls = tped_calls(load_genotypes(dog_id, source))
+        with span("native_roh"):
+            roh_results, roh_indiv_results = call_roh_batch(
+                calls["chromosome"], calls["position"], calls["locus_id"], calls["first"], calls["second"],
+                stored_samples([dog_id]), **asdict(params)
+            )
+    else:
+        with get_workspaces().open("stored_roh", dog_id) as workspace:
+            write_stored_tfile(dog_id, workspace.prefix(str(dog_id)), source)
+            roh_results, roh_indiv_results = plink_roh(
+                workspace.prefix(str(dog_id)), workspace.prefix(f"{dog_id}_roh"), **asdict(params)
+            )
+            workspace.promote(*ROH_ARTIFACTS)
+
+    return {
+        "status": "success",
+        "message": "ROH analysis completed successfully",
+        "dog_id": dog_id,
+        "roh_results": roh_results,
+        "roh_indiv_results": roh_indiv_results
+    }
+
+def _run_stored_parentage(offspring_id: int, parent1_id: int, parent2_id: int, path_offspring: Optional[Path] = None,
+                          source: Optional[int] = None, engine: str = "plink") -> dict:
+    """
+    Run parentage analysis on stored genotypes (the offspring's may come from an upload) and build the response body
+    """
+    response = {
+        "status": "success",
+        "message": "Parentage analysis completed successfully",
+        "dog_id": offspring_id
+    }
+    parents = [parent1_id, parent2_id]
+    if engine == "native":
+        if path_offspring is None:
+            calls = [tped_calls(load_genotypes(offspring_id, source))]
+            samples = stored_samples([offspring_id])
+        else:
+            calls = [tped_calls(read_tped(path_offspring))]
+            samples = read_tfam(Path(path_offspring).with_suffix(".tfam")).head(1)
+        calls += [tped_calls(load_genotypes(parent_id, source)) for parent_id in parents]
+        samples = pl.concat([samples.select(["FID", "IID"]), stored_samples(parents).select(["FID", "IID"])])
+        with span("native_parentage"):
+            genome_results, trio = trio_parentage(align_calls(calls), samples)
+        response["mendelian_errors"] = trio
+    else:
+        with get_workspaces().open("stored_parentage", offspring_id) as workspace:
+            if path_offspring is None:
+                path_offspring = write_stored_tfile(offspring_id, workspace.prefix(str(offspring_id)), source)
+            path_parents = [write_stored_tfile(parent_id, workspace.prefix(str(parent_id)), source)
+                            for parent_id in parents]
+            genome_results = plink_parentage(path_offspring, *path_parents,
+                                             workspace.prefix(f"{offspring_id}_stored"))
+            workspace.promote(*GENOME_ARTIFACTS)
+
+    response["genome_results"] = genome_results
+    return response
+
+def _run_relatedness(genotypes: str = "cohort", dog_ids: Optional[list[int]] = None,
+                     source: Optional[int] = None) -> dict:
+    """
+    Build the relatedness matrices of cohort or stored dogs and build the response body
+    """
+    store = get_relatedness_store()
+    details = {"genotypes": genotypes, "source": source}
+    if genotypes == "cohort":
+        build = store.build(get_cohort(), dog_ids, details)
+    else:
+        # Stored dogs are packed into a scratch cohort fileset, read straight from the database rather than
+        # through the genotype cache, which is sized for a few dogs at a time
+        with get_workspaces().open("relatedness", "stored") as workspace:
+            cohort = Cohort(workspace.path / "cohort")
+            dogs = []
+            for dog_id in dog_ids:
+                genotypes_frame = db_connection.read_stored_genotypes(dog_id, source)
+                if genotypes_frame is None:
+                    raise KeyError(f"No stored genotypes for dog {dog_id}")
+                dogs.append((dog_id, tped_calls(genotypes_frame), None))
+            cohort.add_many(dogs)
+            build = store.build(cohort, dog_ids, details)
+
+    return {
+        "status": "success",
+        "message": "Relatedness matrices computed successfully",
+        **build.meta
+    }
+
+def _relatedness_top(relatedness_id: str, dog_id: int, k: int, metric: str) -> pl.DataFrame:
+    return get_relatedness_store().get(relatedness_id).top_k(dog_id, k, metric)
+
+def _relatedness_pairs(relatedness_id: str, dog_id: Optional[int] = None,
+                       min_grm: Optional[float] = None) -> pl.DataFrame:
+    """
+    Read the pairs of a relatedness build, filtered while scanning its Parquet parts
+    """
+    pairs = get_relatedness_store().get(relatedness_id).pairs()
+    if dog_id is not None:
+        pairs = pairs.filter((pl.col("IID1") == dog_id) | (pl.col("IID2") == dog_id))
+    if min_grm is not None:
+        pairs = pairs.filter(pl.col("GRM") >= min_grm)
+    return pairs.collect()
+
+def _genotype_digest(tped_file: Path) -> str:
+    """
+    Return the content digest of a TPED/TFAM pair (path without extension)
+    """
+    return get_bed_cache().genotype_digest(str(tped_file))
+
+def _without_extension(path: Path) -> Path:
+    return Path(os.path.splitext(path)[0])
+
+def _engine_params(engine: str) -> dict[str, str]:
+    """
+    Return the engine part of a cache key; PLINK results also depend on the PLINK build
+    """
+    if engine == "plink":
+        return {"engine": engine, "plink": plink_version(PLINK_PATH)}
+    return {"engine": engine}
+
+def _cached_analysis(kind: str, inputs: list[str], params: dict[str, Any],
+                     analyse: Callable[[], tuple[dict[str, pl.DataFrame], dict]]
+                     ) -> tuple[dict[str, pl.DataFrame], dict, dict[str, str]]:
+    """
+    Return an analysis' result frames and other response values from the result cache, running it on a miss
+
+    The third value is the cache status and key, for the X-Cache headers
+    """
+    key = result_cache.key(kind, inputs, params)
+    with span("result_cache_get"):
+        cached = result_cache.get(key)
+    if cached is not None:
+        return cached.frames, cached.values, {"status": "HIT", "key": key}
+
+    frames, values = analyse()
+    with span("result_cache_put"):
+        result_cache.put(key, kind, inputs, params, frames, values)
+    return frames, values, {"status": "MISS", "key": key}
+
+def _add_to_cohort(dog_id: int, tped_file: Path) -> Optional[int]:
+    """
+    Append an uploaded dog to the cohort fileset, returning its row, or None (logged) if that fails
+    """
+    try:
+        return get_cohort().add(dog_id, tped_file)
+    except Exception:
+        logger.exception(f"Could not add dog {dog_id} to the cohort")
+        return None
+
+def _result_response(body: dict, fmt: ResponseFormat, headers: Optional[dict[str, str]] = None) -> Response:
+    """
+    Send an analysis body in the negotiated format, moving its cache status into X-Cache and X-Cache-Key headers
+    """
+    body = dict(body)
+    headers = dict(headers or {})
+    cache = body.pop("cache", None)
+    if cache:
+        headers.update({"X-Cache": cache["status"], "X-Cache-Key": cache["key"]})
+    try:
+        return result_response(body, fmt, headers)
+    except NotAcceptableError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+def _store_upload(file: UploadFile) -> StoredUpload:
+    """
+    Save a zip file into the upload store and unzip it
+
+    Archives already in the store are neither copied nor extracted again
+    """
     if file.filename:
         if file.filename.endswith(".zip"):
-            extracted_folder, contents = unzip_file(file_path, file_path.parent)
-            return extracted_folder, contents
+            try:
+                with span("upload_store"):
+                    return upload_store.put(file.file)
+            except ZipLimitError as e:
+                raise HTTPException(status_code=413, detail=str(e))
         else:
             raise HTTPException(status_code=400, detail="Uploaded file is not a zip file")
     else:
         raise HTTPException(status_code=400, detail="Uploaded file is missing filename")
 
+def _find_tped(stored: StoredUpload) -> Optional[Path]:
+    """
+    Return the path of the .tped file of a stored upload, if any
+    """
+    for name, member in stored.contents.items():
+        if name.endswith(".tped"):
+            return member.path
+    return None
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,229 @@
+import contextvars
+import os
+import resource
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Registry:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text format.
+
+    Counters and gauges hold one value per label set; histograms keep cumulative bucket counts,
+    a sum and a count per label set.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._help: dict[str, tuple[str, str]] = {}
+        self._values: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, list[float]]] = {}
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._histograms.setdefault(name, {}).setdefault(key, [0.0] * (len(DURATION_BUCKETS) + 2))
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._values.items()):
+                lines.extend(self._header(name))
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.extend(self._header(name))
+                for key, counts in series.items():
+                    for bound, count in zip(DURATION_BUCKETS, counts):
+                        lines.append(f"{name}_bucket{_labels(key, le=f'{bound:g}')} {count:g}")
+                    lines.append(f"{name}_bucket{_labels(key, le='+Inf')} {counts[-1]:g}")
+                    lines.append(f"{name}_sum{_labels(key)} {counts[-2]:g}")
+                    lines.append(f"{name}_count{_labels(key)} {counts[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str) -> list[str]:
+        if name not in self._help:
+            return []
+        kind, help_text = self._help[name]
+        return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+def _labels(key: tuple, **extra: str) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(pairs, escaped)) + "}"
+
+registry = Registry()
+registry.describe("snp_stage_seconds", "histogram", "Wall time of pipeline stages.")
+registry.describe("snp_stage_cpu_seconds_total", "counter", "CPU time of pipeline stages (own thread or subprocess).")
+registry.describe("snp_subprocess_peak_rss_bytes", "gauge", "Peak resident set size of the last subprocess of a stage.")
+registry.describe("snp_rows_total", "counter", "Rows processed by row-oriented stages, e.g. database inserts.")
+registry.describe("snp_rows_per_second", "gauge", "Throughput of the last run of a row-oriented stage.")
+registry.describe("snp_process_peak_rss_bytes", "gauge", "Peak resident set size of the service process.")
+registry.describe("snp_jobs_pending", "gauge", "Queued jobs waiting or running.")
+registry.describe("snp_cache_hits", "gauge", "Hits of the binary fileset and result caches since startup.")
+registry.describe("snp_cache_misses", "gauge", "Misses of the binary fileset and result caches since startup.")
+registry.describe("snp_cache_evictions", "gauge", "Entries evicted from the binary fileset and result caches since startup.")
+
+class RequestTimings:
+    """
+    Stage timings collected while serving one request or job, in the order the stages finished.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages: list[tuple[str, float]] = []
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages.append((stage, seconds))
+
+    def totals(self) -> dict[str, tuple[float, int]]:
+        """
+        Total seconds and number of runs per stage.
+        """
+        totals: dict[str, tuple[float, int]] = {}
+        with self._lock:
+            for stage, seconds in self.stages:
+                total, count = totals.get(stage, (0.0, 0))
+                totals[stage] = (total + seconds, count + 1)
+        return totals
+
+    def server_timing(self) -> str:
+        """
+        The timings as a Server-Timing header value (durations in milliseconds), with the total last.
+        """
+        entries = []
+        for stage, (seconds, count) in self.totals().items():
+            entry = f"{stage};dur={seconds * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count} runs"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict[str, float]:
+        return {stage: seconds for stage, (seconds, _) in self.totals().items()}
+
+# Timings of the request (or job) being served; worker threads see it through asyncio.to_thread
+_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("timings", default=None)
+
+@contextmanager
+def request_timings() -> Iterator[RequestTimings]:
+    """
+    Collects the stages run in this context (and the threads it starts) into a new RequestTimings.
+    """
+    timings = RequestTimings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def record(stage: str, seconds: float, cpu_seconds: Optional[float] = None) -> None:
+    """
+    Records a finished stage in the metrics and in the current request's timings.
+    """
+    registry.observe("snp_stage_seconds", seconds, stage=stage)
+    if cpu_seconds is not None:
+        registry.inc("snp_stage_cpu_seconds_total", cpu_seconds, stage=stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Times a block of in-process work as `stage` (wall time, and CPU time of the calling thread).
+    """
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, time.thread_time() - cpu_start)
+
+def record_rows(stage: str, rows: int, seconds: float) -> None:
+    """
+    Records the rows a stage processed and its throughput.
+    """
+    registry.inc("snp_rows_total", rows, stage=stage)
+    if seconds > 0:
+        registry.set("snp_rows_per_second", rows / seconds, stage=stage)
+
+def run_command(command: list[str], stage: str, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+    """
+    Runs a command like subprocess.run(command, check=True, text=True, capture_output=True, timeout=timeout),
+    recording its wall time, CPU time and peak RSS as `stage`.
+
+    Raises:
+        subprocess.CalledProcessError: If the command exits with a non-zero status.
+        subprocess.TimeoutExpired: If the command was killed for running longer than `timeout` seconds.
+    """
+    start = time.perf_counter()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) as process:
+        timed_out = threading.Event()
+
+        def kill() -> None:
+            timed_out.set()
+            process.kill()
+
+        killer = threading.Timer(timeout, kill) if timeout else None
+        if killer is not None:
+            killer.start()
+        output: dict[str, str] = {}
+        readers = [
+            threading.Thread(target=lambda name=name, pipe=pipe: output.__setitem__(name, pipe.read()))
+            for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr))
+        ]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        # wait4 reports the resource usage of this child alone, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if killer is not None:
+            killer.cancel()
+
+    record(stage, time.perf_counter() - start, usage.ru_utime + usage.ru_stime)
+    # ru_maxrss is in kilobytes on Linux
+    registry.set("snp_subprocess_peak_rss_bytes", usage.ru_maxrss * 1024, stage=stage)
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(command, timeout, output["stdout"], output["stderr"])
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output["stdout"], output["stderr"])
+    return subprocess.CompletedProcess(command, process.returncode, output["stdout"], output["stderr"])
+
+def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    registry.set("snp_process_peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+    return registry.render()
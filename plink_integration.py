@@ -1,9 +1,57 @@
+import contextvars
 import subprocess
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
+from typing import Optional
 
 import polars as pl
-import pandas as pd
+
+from bed_cache import BedCache
+from cohort import Cohort
+from genotypes import read_tfam
+from metrics import span
+from plink_reports import read_genome, read_hom, read_hom_indiv
+from plink_scheduler import get_plink_scheduler
+
+# Chromosome sharding of plink_roh: number of shards (0 or 1 = one PLINK run over the whole genome),
+# and number of shards run at once (default: one per CPU)
+PLINK_ROH_SHARDS = int(os.getenv("PLINK_ROH_SHARDS", "0"))
+PLINK_ROH_WORKERS = int(os.getenv("PLINK_ROH_WORKERS", "0")) or os.cpu_count() or 1
+
+_bed_cache: Optional[BedCache] = None
+
+def get_bed_cache() -> BedCache:
+    """
+    Returns the process-wide cache of TPED -> binary fileset conversions, configured from the environment.
+    """
+    global _bed_cache
+    if _bed_cache is None:
+        _bed_cache = BedCache.from_env()
+    return _bed_cache
+
+def _run_plink(command: list, stage: str) -> subprocess.CompletedProcess:
+    """
+    Runs a PLINK command through the PLINK scheduler, which assigns its --threads and --memory and queues it
+    until its share of the CPU/memory budget is free. Its wall time, CPU time and peak memory are recorded
+    as `stage` (see metrics).
+
+    Args:
+        command (list): The PLINK executable and its arguments.
+        stage (str): The stage name reported in /metrics and the Server-Timing header.
+    """
+    try:
+        return get_plink_scheduler().run([str(part) for part in command], stage)
+    except subprocess.CalledProcessError as e:
+        print("Error running PLINK:", e.stderr)
+        raise
+    except subprocess.TimeoutExpired as e:
+        print(f"PLINK timed out after {e.timeout} seconds:", e.stderr)
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        raise
 
 def _plink_merge_bim_files(bim_file_main: str, bim_files_to_merge: list[str], output_bim_file: str,
                             plink_path: str ="plink/plink") -> None:
@@ -20,7 +68,7 @@ def _plink_merge_bim_files(bim_file_main: str, bim_files_to_merge: list[str], ou
         str: The path to the merged BIM file (without extension).
     """
 
-    bim_list = bim_file_main + "_list_to_merge.txt"
+    bim_list = output_bim_file + "_list_to_merge.txt"
 
     with open(bim_list, 'w') as f:
         for bim_file in bim_files_to_merge:
@@ -34,16 +82,9 @@ def _plink_merge_bim_files(bim_file_main: str, bim_files_to_merge: list[str], ou
         "--out", output_bim_file
     ]
 
-    try:
-        # Execute the PLINK command
-        result = subprocess.run(merge_command, check=True, text=True, capture_output=True)
-        print("PLINK output:", result.stdout)
-    except subprocess.CalledProcessError as e:
-        print("Error running PLINK:", e.stderr)
-        raise
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        raise
+    # Execute the PLINK command
+    result = _run_plink(merge_command, "plink_merge")
+    print("PLINK output:", result.stdout)
 
 def _plink_convert_tped_to_bim(tped_file: str, output_file: str, plink_path: str="plink/plink") -> None:
     """
@@ -63,90 +104,117 @@ def _plink_convert_tped_to_bim(tped_file: str, output_file: str, plink_path: str
         "--out", output_file
     ]
 
-    try:
-        # Execute the PLINK command
-        result = subprocess.run(convert_command, check=True, text=True, capture_output=True)
-        print("PLINK output:", result.stdout)
-    except subprocess.CalledProcessError as e:
-        print("Error running PLINK:", e.stderr)
-        raise
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        raise
+    # Execute the PLINK command
+    result = _run_plink(convert_command, "plink_make_bed")
+    print("PLINK output:", result.stdout)
 
 def _plink_produce_genome_file(tped_file_main: Path, tped_files_to_merge: list[Path],
-                            output_genome_file: Path =Path(""), plink_path: Path =Path("plink/plink")
-                            )-> pl.DataFrame:
-    if output_genome_file == "":
+                            output_genome_file: Path =Path(""), plink_path: Path =Path("plink/plink"),
+                            bed_cache: Optional[BedCache] =None, full: bool =False)-> pl.DataFrame:
+    if output_genome_file == Path(""):
         output_genome_file = Path("ibd/" + os.path.basename(tped_file_main))
 
-    tped_file_main_no_ext = os.path.splitext(tped_file_main)[0]
-    # Converts tped files to bim files
-    _plink_convert_tped_to_bim(
-        tped_file=tped_file_main_no_ext,
-        output_file=tped_file_main_no_ext,
-        plink_path=str(plink_path)
-    )
+    # Kept next to the results: the inputs may be shared with other requests
+    merged_bim_file = str(output_genome_file) + "_merged"
+    _plink_merge_tped_files(tped_file_main, tped_files_to_merge, merged_bim_file, plink_path, bed_cache)
 
-    merge = []
-    for tped_file in tped_files_to_merge:
-        file = os.path.splitext(tped_file)[0]
-        merge.append(file)
-        _plink_convert_tped_to_bim(
-            tped_file=file,
-            output_file=file,
-            plink_path=str(plink_path)
-        )
+    print("Producing .genome file...", output_genome_file)
+    # Produces .genome file
+    return _plink_genome(merged_bim_file, output_genome_file, plink_path, full=full)
 
-    merged_bim_file = tped_file_main_no_ext + "_merged"
+def _plink_merge_tped_files(tped_file_main: Path, tped_files_to_merge: list[Path], merged_bim_file: str,
+                            plink_path: Path =Path("plink/plink"), bed_cache: Optional[BedCache] =None) -> None:
+    """
+    Merges TPED files into one binary fileset, through their cached binary conversions.
 
-    # Merges parents' bim files with offspring bim file
-    _plink_merge_bim_files(
-        bim_file_main=tped_file_main_no_ext,
-        bim_files_to_merge=merge,
-        plink_path=str(plink_path),
-        output_bim_file=merged_bim_file
-    )
+    Args:
+        tped_file_main (Path): The path to the main .tped file.
+        tped_files_to_merge (list[Path]): The paths to the .tped files merged into it.
+        merged_bim_file (str): The merged fileset prefix.
+        plink_path (Path): The path to the PLINK executable (default: "plink/plink").
+        bed_cache (BedCache): The conversion cache (default: get_bed_cache()).
+    """
+    if bed_cache is None:
+        bed_cache = get_bed_cache()
+
+    # Converts tped files to bim files, reusing earlier conversions of the same genotypes; they are leased
+    # until merged, so the cache can't evict them while PLINK reads them
+    with ExitStack() as leases:
+        tped_file_main_no_ext = leases.enter_context(bed_cache.lease(
+            os.path.splitext(tped_file_main)[0], str(plink_path), _plink_convert_tped_to_bim
+        ))
+        merge = [
+            leases.enter_context(bed_cache.lease(
+                os.path.splitext(tped_file)[0], str(plink_path), _plink_convert_tped_to_bim
+            ))
+            for tped_file in tped_files_to_merge
+        ]
+
+        # Merges parents' bim files with offspring bim file
+        _plink_merge_bim_files(
+            bim_file_main=tped_file_main_no_ext,
+            bim_files_to_merge=merge,
+            plink_path=str(plink_path),
+            output_bim_file=merged_bim_file
+        )
 
-    print("Producing .genome file...", output_genome_file)
-    # Produces .genome file
-    roh_command = [
+def _plink_genome(bfile: str, output_genome_file: Path, plink_path: Path =Path("plink/plink"), full: bool =False,
+                  keep_file: Optional[Path] =None, freq_file: Optional[Path] =None,
+                  genome_lists: Optional[tuple[Path, Path]] =None) -> pl.DataFrame:
+    """
+    Runs PLINK --genome on a binary fileset and reads the report.
+
+    Args:
+        bfile (str): The binary fileset prefix.
+        output_genome_file (Path): The PLINK output prefix.
+        plink_path (Path): The path to the PLINK executable (default: "plink/plink").
+        full (bool): Add the IBS0/IBS1/IBS2/HOMHOM/HETHET columns (--genome full).
+        keep_file (Path): Optional PLINK --keep file restricting the dogs compared.
+        freq_file (Path): Optional PLINK .frq file of the allele frequencies to use (--read-freq), instead of
+            those of the dogs compared.
+        genome_lists (tuple[Path, Path]): Optional pair of FID/IID lists; only pairs with one dog in each
+            are compared (--genome-lists).
+    """
+    genome_command = [
         str(plink_path),
         "--dog",
-        "--bfile", str(merged_bim_file),
-        "--genome",
+        "--bfile", str(bfile),
+        *(["--keep", str(keep_file)] if keep_file else []),
+        *(["--read-freq", str(freq_file)] if freq_file else []),
+        "--genome", *(["full"] if full else []),
+        *(["--genome-lists", *(str(path) for path in genome_lists)] if genome_lists else []),
         "--out", str(output_genome_file)
     ]
 
-    try:
-        # Execute the PLINK command
-        result = subprocess.run(roh_command, check=True, text=True, capture_output=True)
+    # Execute the PLINK command
+    _run_plink(genome_command, "plink_genome")
 
-        # Digest results
-        genome_df = pd.read_csv(f"{output_genome_file}.genome", sep="\\s+")
-        # Must cast from pandas to polars, the latter doesn't accept plink files
-        return pl.from_pandas(genome_df)
-
-    except subprocess.CalledProcessError as e:
-        print("Error running PLINK:", e.stderr)
-        raise
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        raise
+    # Digest results
+    with span("read_plink_report"):
+        return read_genome(Path(f"{output_genome_file}.genome"))
 
 def plink_roh(input_file: Path, output_folder: Path, plink_path: Path =Path("plink/plink"),
                 window_snp: int = 50, window_het: int = 1, window_missing: int = 5,
                 window_threshold: float = 0.05, homozyg_gap: int = 1000, homozyg_het: int = 1000,
-                homozyg_density: int = 50, homozyg_snp: int = 100, homozyg_kb: int = 1000) -> list[pl.DataFrame]:
+                homozyg_density: int = 50, homozyg_snp: int = 100, homozyg_kb: int = 1000,
+                input_format: str = "tfile", keep_file: Optional[Path] = None,
+                chromosomes: Optional[list[str]] = None, shards: Optional[int] = None) -> list[pl.DataFrame]:
 
     """
     Sends a file to PLINK for Run of Homozygosity (RoH) analysis.
 
+    With more than one shard (default: PLINK_ROH_SHARDS) the chromosomes are scanned in parallel PLINK runs,
+    see plink_roh_sharded.
+
     Args:
         Filesystem:
             input_file (str):               Path to the input file for PLINK, without extension
             output_prefix (str):            Prefix for the output files generated by PLINK
             plink_path (str):               Path to the PLINK executable (default: "plink")
+            input_format (str):             "tfile" for a TPED/TFAM pair (default) or "bfile" for a binary fileset
+            keep_file (Path):               Optional PLINK --keep file restricting the dogs scanned
+            chromosomes (list[str]):        Optional chromosome codes the scan is restricted to (--chr)
+            shards (int):                   Number of chromosome shards (default: PLINK_ROH_SHARDS)
         PLINK Parameters (with default values):
             Defining the scanning window:
                 window_snp (int):           Size of the scanning window in SNPs (default: 50)
@@ -168,10 +236,22 @@ def plink_roh(input_file: Path, output_folder: Path, plink_path: Path =Path("pli
             .hom.summary    	            SNP-based runs-of-homozygosity report.
     """
 
+    params = {
+        "window_snp": window_snp, "window_het": window_het, "window_missing": window_missing,
+        "window_threshold": window_threshold, "homozyg_gap": homozyg_gap, "homozyg_het": homozyg_het,
+        "homozyg_density": homozyg_density, "homozyg_snp": homozyg_snp, "homozyg_kb": homozyg_kb
+    }
+    shards = PLINK_ROH_SHARDS if shards is None else shards
+    if shards > 1 and chromosomes is None:
+        return plink_roh_sharded(input_file, output_folder, plink_path, shards=shards, input_format=input_format,
+                                 keep_file=keep_file, **params)
+
     # Construct the PLINK command
     roh_command = [
         plink_path,
-        "--tfile", input_file,
+        f"--{input_format}", input_file,
+        *(["--keep", str(keep_file)] if keep_file else []),
+        *(["--chr", ",".join(chromosomes)] if chromosomes else []),
         "--dog",
         "--homozyg",
         "--homozyg-window-snp", str(window_snp),
@@ -186,22 +266,91 @@ def plink_roh(input_file: Path, output_folder: Path, plink_path: Path =Path("pli
         "--out", output_folder
     ]
 
-    try:
-        # Execute the PLINK command
-        result = subprocess.run(roh_command, check=True, text=True, capture_output=True)
+    # Execute the PLINK command
+    _run_plink(roh_command, "plink_homozyg")
 
-        # Digest results
-        hom_df = pd.read_csv(f"{output_folder}.hom", sep="\\s+")
-        hom_indiv_df = pd.read_csv(f"{output_folder}.hom.indiv", sep="\\s+")
-        # Must cast from pandas to polars, the latter doesn't accept plink files
-        return [pl.from_pandas(hom_df), pl.from_pandas(hom_indiv_df)]
+    # Digest results
+    with span("read_plink_report"):
+        return [read_hom(Path(f"{output_folder}.hom")), read_hom_indiv(Path(f"{output_folder}.hom.indiv"))]
 
-    except subprocess.CalledProcessError as e:
-        print("Error running PLINK:", e.stderr)
-        raise
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        raise
+def plink_roh_sharded(input_file: Path, output_folder: Path, plink_path: Path =Path("plink/plink"),
+                      shards: Optional[int] = None, workers: Optional[int] = None, input_format: str = "tfile",
+                      keep_file: Optional[Path] = None, **params) -> list[pl.DataFrame]:
+    """
+    Runs plink_roh as parallel PLINK runs over groups of chromosomes, and merges their reports.
+
+    Runs of homozygosity never cross chromosomes, so the merged .hom and .hom.indiv frames match a single
+    run over the whole genome (.hom.indiv KB totals are summed from the shards' rounded values).
+    A TPED/TFAM input is converted to a binary fileset once (through the bed cache), so shards don't
+    each parse the text file.
+
+    Args:
+        input_file (Path): Path to the input file for PLINK, without extension.
+        output_folder (Path): Prefix of the output files; shard i writes {output_folder}.shard{i}.*
+        plink_path (Path): Path to the PLINK executable.
+        shards (int): Number of chromosome groups (default: PLINK_ROH_SHARDS, at least 2).
+        workers (int): Number of PLINK runs at once (default: PLINK_ROH_WORKERS).
+        input_format (str): "tfile" for a TPED/TFAM pair (default) or "bfile" for a binary fileset.
+        keep_file (Path): Optional PLINK --keep file restricting the dogs scanned.
+        **params: The PLINK --homozyg parameters of plink_roh.
+    """
+    with ExitStack() as leases:
+        bfile = str(input_file)
+        if input_format == "tfile":
+            # Leased until every shard is done, so the cache can't evict it while PLINK reads it
+            bfile = leases.enter_context(
+                get_bed_cache().lease(bfile, str(plink_path), _plink_convert_tped_to_bim)
+            )
+
+        groups = _chromosome_shards(Path(f"{bfile}.bim"), max(shards or PLINK_ROH_SHARDS, 2))
+        with ThreadPoolExecutor(max_workers=min(workers or PLINK_ROH_WORKERS, len(groups))) as pool:
+            # Each shard runs in a copy of the caller's context, so its PLINK run is timed with the request
+            futures = [
+                pool.submit(contextvars.copy_context().run, plink_roh, bfile, Path(f"{output_folder}.shard{i}"),
+                            plink_path, input_format="bfile", keep_file=keep_file, chromosomes=chromosomes,
+                            **params)
+                for i, chromosomes in enumerate(groups)
+            ]
+            results = [future.result() for future in futures]
+
+    with span("merge_roh_shards"):
+        return _merge_roh_shards(results)
+
+def _chromosome_shards(bim_file: Path, shards: int) -> list[list[str]]:
+    """
+    Splits the chromosomes of a fileset into at most `shards` groups with similar numbers of SNPs.
+    """
+    counts = pl.read_csv(bim_file, separator="\t", has_header=False, columns=[0],
+                         infer_schema=False).to_series().value_counts(sort=True)
+
+    groups: list[list[str]] = [[] for _ in range(min(shards, counts.height))]
+    sizes = [0] * len(groups)
+    # Largest chromosomes first, each into the group with the fewest SNPs so far
+    for chromosome, count in counts.iter_rows():
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(chromosome)
+        sizes[smallest] += count
+    return groups
+
+def _merge_roh_shards(results: list[list[pl.DataFrame]]) -> list[pl.DataFrame]:
+    """
+    Merges the .hom and .hom.indiv frames of chromosome shards into those of a single run.
+
+    Segments are ordered like PLINK's: by dog (in fileset order), then chromosome and position.
+    """
+    indiv = pl.concat([indiv for _, indiv in results])
+    order = results[0][1].select("FID", "IID").with_row_index("dog")
+
+    hom = pl.concat([hom for hom, _ in results]).join(order, on=["FID", "IID"], how="left")
+    hom = hom.sort(["dog", "CHR", "POS1"]).drop("dog")
+
+    indiv = indiv.group_by(["FID", "IID", "PHE"], maintain_order=True).agg(
+        pl.col("NSEG").sum(),
+        pl.col("KB").sum()
+    ).with_columns(
+        pl.when(pl.col("NSEG") > 0).then(pl.col("KB") / pl.col("NSEG")).otherwise(0.0).alias("KBAVG")
+    )
+    return [hom, indiv]
 
 def plink_parentage(offspring_file: Path, parent1_file: Path, parent2_file: Path, genome_file: Path,
                     plink_path: Path =Path("plink/plink")) -> pl.DataFrame:
@@ -225,4 +374,85 @@ def plink_parentage(offspring_file: Path, parent1_file: Path, parent2_file: Path
 
     return genome_results
 
+def plink_parentage_screen(offspring_file: Path, candidate_files: list[Path], genome_file: Path,
+                           plink_path: Path =Path("plink/plink")) -> pl.DataFrame:
+    """
+    Runs one PLINK --genome full over the offspring-candidate pairs of a merged fileset of an offspring and
+    its candidate parents, without comparing the candidates with each other.
+
+    Allele frequencies are computed over all the dogs (--freq) and read back (--read-freq) by a --genome run
+    restricted to the pairs with the offspring on one side and a candidate on the other (--genome-lists).
+
+    Args:
+        offspring_file (Path): The path to the offspring's .tped file (a .tfam must sit next to it).
+        candidate_files (list[Path]): The paths to the candidates' .tped files.
+        genome_file (Path): The PLINK output prefix.
+        plink_path (Path): The path to the PLINK executable (default: "plink/plink").
+
+    Returns:
+        pl.DataFrame: One --genome full row per candidate, in candidate order, with the offspring as FID1/IID1.
+    """
+    merged_bim_file = str(genome_file) + "_merged"
+    _plink_merge_tped_files(offspring_file, candidate_files, merged_bim_file, plink_path)
+    _run_plink([plink_path, "--dog", "--bfile", merged_bim_file, "--freq", "--out", genome_file], "plink_freq")
+
+    offspring_fam = read_tfam(Path(offspring_file).with_suffix(".tfam")).row(0, named=True)
+    offspring = offspring_fam["IID"]
+    candidate_fams = [read_tfam(Path(candidate_file).with_suffix(".tfam")).row(0, named=True)
+                      for candidate_file in candidate_files]
+
+    offspring_list = Path(f"{genome_file}.offspring.list")
+    offspring_list.write_text(f"{offspring_fam['FID']} {offspring}\n")
+    candidate_list = Path(f"{genome_file}.candidates.list")
+    candidate_list.write_text("".join(f"{fam['FID']} {fam['IID']}\n" for fam in candidate_fams))
+
+    genome_results = _plink_genome(merged_bim_file, genome_file, plink_path, full=True,
+                                   freq_file=Path(f"{genome_file}.frq"),
+                                   genome_lists=(offspring_list, candidate_list))
+
+    # --genome lists each pair in fileset order: put the offspring first
+    ids = ["FID1", "IID1", "FID2", "IID2"]
+    swapped = pl.col("IID2") == offspring
+    pairs = genome_results.with_columns(pl.col(ids).cast(pl.String)).with_columns(
+        *(pl.when(swapped).then(pl.col(f"{column}2")).otherwise(pl.col(f"{column}1")).alias(f"{column}1")
+          for column in ("FID", "IID")),
+        *(pl.when(swapped).then(pl.col(f"{column}1")).otherwise(pl.col(f"{column}2")).alias(f"{column}2")
+          for column in ("FID", "IID"))
+    )
+
+    # Back to candidate order
+    order = pl.DataFrame({
+        "FID2": [str(fam["FID"]) for fam in candidate_fams],
+        "IID2": [str(fam["IID"]) for fam in candidate_fams]
+    }).with_row_index("CANDIDATE")
+    pairs = pairs.join(order, on=["FID2", "IID2"], how="inner").sort("CANDIDATE")
+    if pairs["CANDIDATE"].to_list() != list(range(len(candidate_files))):
+        raise ValueError(f"Expected one pair per candidate in {genome_file}.genome, found {pairs.height}")
+    return pairs.select(genome_results.columns).cast({column: pl.Categorical for column in ids})
+
+def plink_cohort_parentage(cohort: Cohort, offspring_id: int, parent1_id: int, parent2_id: int, genome_file: Path,
+                           plink_path: Path =Path("plink/plink")) -> pl.DataFrame:
+    """
+    Runs PLINK --genome for a trio straight on the standing cohort fileset, with no conversion or merge.
+
+    Args:
+        cohort (Cohort): The cohort holding the three dogs.
+        offspring_id (int): The offspring's dog ID.
+        parent1_id (int): The first parent's dog ID.
+        parent2_id (int): The second parent's dog ID.
+        genome_file (Path): The PLINK output prefix.
+        plink_path (Path): The path to the PLINK executable (default: "plink/plink").
+    """
+    keep_file = cohort.keep_file([offspring_id, parent1_id, parent2_id], Path(f"{genome_file}.keep"))
+    with cohort.reading():
+        return _plink_genome(str(cohort.prefix), genome_file, plink_path, keep_file=keep_file)
 
+def plink_cohort_roh(cohort: Cohort, dog_id: int, output_folder: Path, plink_path: Path =Path("plink/plink"),
+                     **params) -> list[pl.DataFrame]:
+    """
+    Runs plink_roh for one dog straight on the standing cohort fileset; takes the same PLINK parameters.
+    """
+    keep_file = cohort.keep_file([dog_id], Path(f"{output_folder}.keep"))
+    with cohort.reading():
+        return plink_roh(cohort.prefix, output_folder, plink_path, input_format="bfile", keep_file=keep_file,
+                         **params)
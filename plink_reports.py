@@ -0,0 +1,85 @@
+from pathlib import Path
+from typing import Optional
+
+import polars as pl
+
+# Column types of the PLINK 1.9 reports read by this service; unknown columns are kept as strings
+HOM_SCHEMA = {
+    "FID": pl.Categorical, "IID": pl.Categorical, "PHE": pl.Int32, "CHR": pl.Int8,
+    "SNP1": pl.String, "SNP2": pl.String, "POS1": pl.Int64, "POS2": pl.Int64,
+    "KB": pl.Float64, "NSNP": pl.Int32, "DENSITY": pl.Float64, "PHOM": pl.Float64, "PHET": pl.Float64
+}
+HOM_INDIV_SCHEMA = {
+    "FID": pl.Categorical, "IID": pl.Categorical, "PHE": pl.Int32, "NSEG": pl.Int32,
+    "KB": pl.Float64, "KBAVG": pl.Float64
+}
+GENOME_SCHEMA = {
+    "FID1": pl.Categorical, "IID1": pl.Categorical, "FID2": pl.Categorical, "IID2": pl.Categorical,
+    "RT": pl.Categorical, "EZ": pl.Float64, "Z0": pl.Float64, "Z1": pl.Float64, "Z2": pl.Float64,
+    "PI_HAT": pl.Float64, "PHE": pl.Int32, "DST": pl.Float64, "PPC": pl.Float64, "RATIO": pl.Float64,
+    # Only present with --genome full
+    "IBS0": pl.Int64, "IBS1": pl.Int64, "IBS2": pl.Int64, "HOMHOM": pl.Int64, "HETHET": pl.Int64
+}
+
+# Byte that never occurs in PLINK reports, so each line is read as a single field
+_NO_SEPARATOR = "\x1f"
+
+def _read_header(path: Path) -> list[str]:
+    with open(path, "r") as f:
+        header = f.readline()
+    if not header.strip():
+        raise ValueError(f"{path} is empty or has no header line")
+    return header.split()
+
+def scan_plink_report(path: Path, schema: dict[str, pl.DataType],
+                      columns: Optional[list[str]] = None) -> pl.LazyFrame:
+    """
+    Lazily reads a whitespace-aligned PLINK report (.hom, .hom.indiv, .genome, ...) into typed columns.
+
+    Polars' CSV reader can't split on runs of spaces, so each line is read as one string and its
+    whitespace-separated tokens are picked by position. Only the requested columns are extracted and cast.
+
+    Args:
+        path (Path): The path to the report.
+        schema (dict[str, pl.DataType]): Types of the known columns; other columns are left as strings.
+        columns (list[str]): Columns to read, in order (default: all columns of the report).
+
+    Returns:
+        pl.LazyFrame: The report, with "NA" values read as nulls.
+    """
+    header = _read_header(path)
+    if columns is None:
+        columns = header
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError(f"{path} has no column(s) {missing}; available: {header}")
+
+    fields = pl.col("line").str.extract_all(r"\S+")
+    lines = pl.scan_csv(
+        path,
+        has_header=False,
+        skip_rows=1,
+        separator=_NO_SEPARATOR,
+        quote_char=None,
+        schema={"line": pl.String},
+        raise_if_empty=False
+    )
+    return lines.select(fields.alias("fields")).select([
+        _typed_field(column, header.index(column), schema.get(column, pl.String)) for column in columns
+    ])
+
+def _typed_field(column: str, index: int, dtype: pl.DataType) -> pl.Expr:
+    field = pl.col("fields").list.get(index, null_on_oob=True)
+    return pl.when(field != "NA").then(field).cast(dtype).alias(column)
+
+def read_hom(path: Path, columns: Optional[list[str]] = None) -> pl.DataFrame:
+    """Reads a PLINK .hom run-of-homozygosity list."""
+    return scan_plink_report(path, HOM_SCHEMA, columns).collect(engine="streaming")
+
+def read_hom_indiv(path: Path, columns: Optional[list[str]] = None) -> pl.DataFrame:
+    """Reads a PLINK .hom.indiv sample-based runs-of-homozygosity report."""
+    return scan_plink_report(path, HOM_INDIV_SCHEMA, columns).collect(engine="streaming")
+
+def read_genome(path: Path, columns: Optional[list[str]] = None) -> pl.DataFrame:
+    """Reads a PLINK .genome pairwise IBD report."""
+    return scan_plink_report(path, GENOME_SCHEMA, columns).collect(engine="streaming")
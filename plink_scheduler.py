@@ -0,0 +1,198 @@
+import contextvars
+import heapq
+import itertools
+import os
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from metrics import registry, run_command
+
+# Priorities of PLINK runs; lower runs first. Requests waiting on an answer go before queued jobs.
+INTERACTIVE = 0
+BATCH = 10
+
+# PLINK stages that use more than one thread (the others are single-threaded in PLINK 1.9)
+MULTITHREADED_STAGES = {"plink_genome"}
+
+registry.describe("snp_plink_running", "gauge", "PLINK processes running.")
+registry.describe("snp_plink_queued", "gauge", "PLINK processes waiting for CPU or memory budget.")
+registry.describe("snp_plink_threads_in_use", "gauge", "Threads assigned to running PLINK processes.")
+registry.describe("snp_plink_memory_in_use_mb", "gauge", "Memory (MiB) assigned to running PLINK processes.")
+registry.describe("snp_plink_timeouts_total", "counter", "PLINK processes killed for running past their timeout.")
+
+# Priority of the PLINK runs started in the current context (see priority())
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("plink_priority", default=INTERACTIVE)
+
+def _physical_memory_mb() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024 ** 2
+    except (ValueError, OSError, AttributeError):
+        return 8192
+
+class PlinkScheduler:
+    """
+    Admits PLINK processes against a global CPU and memory budget, in priority order.
+
+    Each run is given --threads and --memory flags from its share of the budget and waits until that
+    share is free; waiting runs start by priority (INTERACTIVE before BATCH), then in arrival order.
+    Runs that outlive `timeout` seconds are killed.
+
+    Args:
+        cpus (int): Threads all running PLINK processes may use together.
+        memory_mb (int): MiB all running PLINK processes may use together.
+        threads_per_job (int): Threads given to multi-threaded stages (see MULTITHREADED_STAGES).
+        memory_per_job_mb (int): MiB given to each PLINK process (--memory).
+        timeout (float): Seconds a PLINK process may run (0 = no limit).
+    """
+
+    def __init__(self, cpus: int, memory_mb: int, threads_per_job: int = 1, memory_per_job_mb: int = 2048,
+                 timeout: float = 0) -> None:
+        self.cpus = max(cpus, 1)
+        self.memory_mb = max(memory_mb, 1)
+        self.threads_per_job = max(min(threads_per_job, self.cpus), 1)
+        self.memory_per_job_mb = max(min(memory_per_job_mb, self.memory_mb), 1)
+        self.timeout = timeout
+        self.timeouts = 0
+        self._cond = threading.Condition()
+        self._waiting: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._threads_used = 0
+        self._memory_used = 0
+        self._running = 0
+
+    @classmethod
+    def from_env(cls) -> "PlinkScheduler":
+        """
+        Build a scheduler from PLINK_CPU_BUDGET (default: CPU count), PLINK_MEMORY_BUDGET_MB (default: half of
+        the physical memory), PLINK_THREADS_PER_JOB (default: 2), PLINK_MEMORY_PER_JOB_MB (default: 2048) and
+        PLINK_TIMEOUT_SECONDS (default: 3600, 0 = no limit)
+        """
+        return cls(
+            cpus=int(os.getenv("PLINK_CPU_BUDGET", "0")) or os.cpu_count() or 1,
+            memory_mb=int(os.getenv("PLINK_MEMORY_BUDGET_MB", "0")) or _physical_memory_mb() // 2,
+            threads_per_job=int(os.getenv("PLINK_THREADS_PER_JOB", "2")),
+            memory_per_job_mb=int(os.getenv("PLINK_MEMORY_PER_JOB_MB", "2048")),
+            timeout=float(os.getenv("PLINK_TIMEOUT_SECONDS", "3600"))
+        )
+
+    def stats(self) -> dict[str, float]:
+        with self._cond:
+            return {
+                "running": self._running,
+                "queued": len(self._waiting),
+                "threads_in_use": self._threads_used,
+                "memory_in_use_mb": self._memory_used,
+                "cpus": self.cpus,
+                "memory_mb": self.memory_mb,
+                "timeouts": self.timeouts
+            }
+
+    def run(self, command: list[str], stage: str, threads: Optional[int] = None,
+            memory_mb: Optional[int] = None, priority: Optional[int] = None,
+            timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        """
+        Runs a PLINK command once its share of the budget is free, adding --threads and --memory.
+
+        Args:
+            command (list[str]): The PLINK executable and its arguments.
+            stage (str): The stage name reported in the metrics (see metrics.run_command).
+            threads (int): Threads for this run (default: threads_per_job for multi-threaded stages, else 1).
+            memory_mb (int): MiB for this run (default: memory_per_job_mb).
+            priority (int): INTERACTIVE, BATCH or any other int (default: the priority of the current context).
+            timeout (float): Seconds the run may take (default: the scheduler's timeout).
+
+        Raises:
+            subprocess.CalledProcessError: If PLINK exits with a non-zero status.
+            subprocess.TimeoutExpired: If PLINK was killed for running past its timeout.
+        """
+        if threads is None:
+            threads = self.threads_per_job if stage in MULTITHREADED_STAGES else 1
+        threads = max(min(threads, self.cpus), 1)
+        memory_mb = max(min(memory_mb or self.memory_per_job_mb, self.memory_mb), 1)
+        timeout = self.timeout if timeout is None else timeout
+
+        with self._admitted(threads, memory_mb, _priority.get() if priority is None else priority):
+            try:
+                return run_command([*command, "--threads", str(threads), "--memory", str(memory_mb)], stage,
+                                   timeout=timeout or None)
+            except subprocess.TimeoutExpired:
+                with self._cond:
+                    self.timeouts += 1
+                registry.inc("snp_plink_timeouts_total")
+                raise
+
+    @contextmanager
+    def _admitted(self, threads: int, memory_mb: int, priority: int) -> Iterator[None]:
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            self._publish()
+            # Only the first run in line may start, so large runs aren't overtaken forever by small ones
+            try:
+                while self._waiting[0] != ticket or not self._fits(threads, memory_mb):
+                    self._cond.wait()
+            except BaseException:
+                # A run given up while waiting leaves the line, so the runs behind it aren't stuck
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._publish()
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._threads_used += threads
+            self._memory_used += memory_mb
+            self._running += 1
+            self._publish()
+            # The next run in line may fit as well
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._threads_used -= threads
+                self._memory_used -= memory_mb
+                self._running -= 1
+                self._publish()
+                self._cond.notify_all()
+
+    def _fits(self, threads: int, memory_mb: int) -> bool:
+        return self._threads_used + threads <= self.cpus and self._memory_used + memory_mb <= self.memory_mb
+
+    def _publish(self) -> None:
+        registry.set("snp_plink_running", self._running)
+        registry.set("snp_plink_queued", len(self._waiting))
+        registry.set("snp_plink_threads_in_use", self._threads_used)
+        registry.set("snp_plink_memory_in_use_mb", self._memory_used)
+
+@contextmanager
+def priority(value: int) -> Iterator[None]:
+    """
+    Runs the PLINK commands started in this context (and the threads it starts) with the given priority.
+    """
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def run_with_priority(value: int, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Calls func(*args, **kwargs) with the PLINK runs it starts at the given priority.
+    """
+    with priority(value):
+        return func(*args, **kwargs)
+
+_scheduler: Optional[PlinkScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_plink_scheduler() -> PlinkScheduler:
+    """
+    Returns the process-wide PLINK scheduler, configured from the environment.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PlinkScheduler.from_env()
+    return _scheduler
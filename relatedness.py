@@ -0,0 +1,330 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import polars as pl
+
+from cohort import Cohort
+from genotype_packing import HET, HOM_ALT, HOM_REF, MISSING
+from genotypes import DOG_AUTOSOMES
+from metrics import span
+
+META_NAME = "meta.json"
+
+# Relatedness measures kept as dogs x dogs matrices, and the pair columns they are reported as
+METRICS = {"grm": "GRM", "dst": "DST"}
+
+# Schema of the pairs of a build (pairs/part-*.parquet) and of top-k answers
+PAIR_SCHEMA = {"IID1": pl.Int64, "IID2": pl.Int64, "GRM": pl.Float32, "DST": pl.Float32, "IBS0": pl.UInt32,
+               "NSNP": pl.UInt32}
+
+class RelatednessMatrix:
+    """
+    A finished relatedness build: dogs x dogs matrices memory-mapped from .npy files, and their pairs as Parquet.
+
+    - grm.npy: genomic relationship (VanRaden, method 1) over the autosomal loci polymorphic in the cohort
+    - dst.npy: IBS similarity (IBS2 + 0.5 * IBS1) / NSNP, like PLINK's DST
+    - ibs0.npy, nsnp.npy: loci where the dogs share no allele, and loci called in both
+    - pairs/part-*.parquet: one row per pair of dogs (IID1 before IID2 in sample order), PAIR_SCHEMA
+
+    Args:
+        path (Path): Folder of the build.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.meta = json.loads((self.path / META_NAME).read_text())
+        self.samples = pl.read_parquet(self.path / "samples.parquet")
+
+    def matrix(self, name: str) -> np.ndarray:
+        """Memory-maps one of the matrices (grm, dst, ibs0 or nsnp) read-only."""
+        return np.load(self.path / f"{name}.npy", mmap_mode="r")
+
+    def index(self, dog_id: int) -> int:
+        """
+        Returns a dog's row in the matrices.
+
+        Raises:
+            KeyError: If the dog isn't part of the build.
+        """
+        matches = np.flatnonzero(self.samples["IID"].to_numpy() == dog_id)
+        if len(matches) == 0:
+            raise KeyError(f"Dog {dog_id} is not in relatedness build {self.path.name}")
+        return int(matches[0])
+
+    def top_k(self, dog_id: int, k: int = 10, metric: str = "grm") -> pl.DataFrame:
+        """
+        Returns the k dogs most related to a dog by `metric` ("grm" or "dst"), most related first.
+
+        Only the dog's row of each matrix is read from disk.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}. Expected one of {list(METRICS)}")
+        row = self.index(dog_id)
+        values = np.array(self.matrix(metric)[row], dtype=np.float64)
+        values[row] = -np.inf
+        values[np.isnan(values)] = -np.inf
+        k = max(min(k, len(values) - 1), 0)
+        top = np.argpartition(-values, k - 1)[:k] if k else np.array([], dtype=np.int64)
+        top = top[np.argsort(-values[top], kind="stable")]
+        return self._pairs(np.full(len(top), row), top).with_row_index("RANK", offset=1)
+
+    def pairs(self) -> pl.LazyFrame:
+        """Scans all pairs of the build (PAIR_SCHEMA), e.g. to filter them by GRM."""
+        return pl.scan_parquet(self.path / "pairs" / "*.parquet")
+
+    def _pairs(self, rows: np.ndarray, columns: np.ndarray) -> pl.DataFrame:
+        matrices = {name: self.matrix(name) for name in ("grm", "dst", "ibs0", "nsnp")}
+        return _pair_frame(self.samples["IID"].to_numpy(), matrices, rows, columns)
+
+class RelatednessStore:
+    """
+    Folder of relatedness builds, {root}/{relatedness_id}/; only the `max_builds` most recent are kept.
+
+    Args:
+        root (Path): Folder holding the builds.
+        max_builds (int): Number of builds kept (0 = all).
+        block_dogs (int): Dogs per block of the blocked matrix products.
+        block_loci (int): Loci read and multiplied at a time.
+        workers (int): Threads multiplying dog blocks at once.
+    """
+
+    def __init__(self, root: Path, max_builds: int = 5, block_dogs: int = 512, block_loci: int = 4096,
+                 workers: int = 1) -> None:
+        self.root = Path(root)
+        self.max_builds = max_builds
+        self.block_dogs = max(block_dogs, 1)
+        self.block_loci = max(block_loci, 1)
+        self.workers = max(workers, 1)
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "RelatednessStore":
+        """
+        Build a store from RELATEDNESS_DIR (default: cache/relatedness), RELATEDNESS_MAX_BUILDS (default: 5),
+        RELATEDNESS_BLOCK_DOGS (default: 512), RELATEDNESS_BLOCK_LOCI (default: 4096) and RELATEDNESS_WORKERS
+        (default: one per CPU)
+        """
+        return cls(
+            root=Path(os.getenv("RELATEDNESS_DIR", "cache/relatedness")),
+            max_builds=int(os.getenv("RELATEDNESS_MAX_BUILDS", "5")),
+            block_dogs=int(os.getenv("RELATEDNESS_BLOCK_DOGS", "512")),
+            block_loci=int(os.getenv("RELATEDNESS_BLOCK_LOCI", "4096")),
+            workers=int(os.getenv("RELATEDNESS_WORKERS", "0")) or os.cpu_count() or 1
+        )
+
+    def builds(self) -> list[dict[str, Any]]:
+        """Lists the metadata of the finished builds, newest first."""
+        metas = []
+        for meta in self.root.glob(f"*/{META_NAME}"):
+            try:
+                metas.append(json.loads(meta.read_text()))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        return sorted(metas, key=lambda meta: meta["created_at"], reverse=True)
+
+    def get(self, relatedness_id: str) -> RelatednessMatrix:
+        """
+        Opens a finished build.
+
+        Raises:
+            KeyError: If there is no such build.
+        """
+        path = self.root / relatedness_id
+        if "/" in relatedness_id or relatedness_id.startswith(".") or not (path / META_NAME).exists():
+            raise KeyError(f"Relatedness build {relatedness_id} not found")
+        return RelatednessMatrix(path)
+
+    def build(self, cohort: Cohort, dog_ids: Optional[list[int]] = None,
+              details: Optional[dict[str, Any]] = None) -> RelatednessMatrix:
+        """
+        Computes the relatedness of the dogs of a cohort fileset (default: all of them) into a new build.
+
+        Args:
+            cohort (Cohort): The dogs x loci genotype matrix (2-bit packed .bed rows).
+            dog_ids (list[int]): Dogs to include (default: the whole cohort).
+            details (dict): Extra values recorded in the build's metadata (e.g. where the genotypes came from).
+        """
+        relatedness_id = uuid.uuid4().hex
+        temp = self.root / f".build-{relatedness_id}"
+        temp.mkdir()
+        start = time.perf_counter()
+        try:
+            samples, n_loci = compute_relatedness(cohort, temp, dog_ids, self.block_dogs, self.block_loci,
+                                                  self.workers)
+            meta = {
+                "relatedness_id": relatedness_id,
+                "created_at": time.time(),
+                "dogs": samples.height,
+                "loci": n_loci,
+                "seconds": time.perf_counter() - start,
+                **(details or {})
+            }
+            (temp / META_NAME).write_text(json.dumps(meta))
+            os.replace(temp, self.root / relatedness_id)
+        except Exception:
+            shutil.rmtree(temp, ignore_errors=True)
+            raise
+
+        self._evict(keep=relatedness_id)
+        return RelatednessMatrix(self.root / relatedness_id)
+
+    def _evict(self, keep: str) -> None:
+        """Removes the oldest builds beyond max_builds."""
+        if not self.max_builds:
+            return
+        with self._lock:
+            for meta in self.builds()[self.max_builds:]:
+                if meta["relatedness_id"] != keep:
+                    shutil.rmtree(self.root / meta["relatedness_id"], ignore_errors=True)
+
+_relatedness_store: Optional[RelatednessStore] = None
+
+def get_relatedness_store() -> RelatednessStore:
+    """
+    Returns the process-wide store of relatedness builds, configured from the environment.
+    """
+    global _relatedness_store
+    if _relatedness_store is None:
+        _relatedness_store = RelatednessStore.from_env()
+    return _relatedness_store
+
+def compute_relatedness(cohort: Cohort, output: Path, dog_ids: Optional[list[int]] = None, block_dogs: int = 512,
+                        block_loci: int = 4096, workers: int = 1) -> tuple[pl.DataFrame, int]:
+    """
+    Computes the GRM and IBS matrices of cohort dogs with blocked matrix products, into .npy files in `output`.
+
+    The loci are read a block at a time from the packed .bed rows. For each block, every pair of dog blocks
+    (upper triangle only) is multiplied in a thread pool and added to memory-mapped accumulators, so memory
+    holds one block of loci and the matrices themselves stay on disk. NumPy's BLAS may use several threads per
+    product on top of `workers`.
+
+    Returns:
+        tuple[pl.DataFrame, int]: The dogs (IID, in matrix order) and the number of autosomal loci used.
+    """
+    output = Path(output)
+    # The cohort can't change until the last block is read
+    with cohort.code_blocks(dog_ids, block_loci) as (samples, loci, blocks):
+        n_dogs = samples.height
+        autosomal = ((loci["chromosome"] > 0) & (loci["chromosome"] <= DOG_AUTOSOMES)).to_numpy()
+
+        def accumulator(name: str) -> np.memmap:
+            return np.lib.format.open_memmap(output / f"{name}.npy", mode="w+", dtype=np.float32,
+                                             shape=(n_dogs, n_dogs))
+
+        grm, ibs2, ibs0, nsnp = (accumulator(name) for name in ("grm", "ibs2", "ibs0", "nsnp"))
+        starts = range(0, n_dogs, block_dogs)
+        block_pairs = [(i, j) for i in starts for j in starts if j >= i]
+        scale = 0.0
+        n_used = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            offset = 0
+            for codes in blocks:
+                keep = autosomal[offset:offset + codes.shape[1]]
+                offset += codes.shape[1]
+                codes = codes[:, keep]
+                if codes.shape[1] == 0:
+                    continue
+                with span("relatedness_block"):
+                    scale += _add_block(codes, grm, ibs2, ibs0, nsnp, block_pairs, block_dogs, pool)
+                n_used += codes.shape[1]
+
+    with span("relatedness_finish"):
+        # IBS2 counts are turned into DST in place
+        _finish(grm, ibs2, ibs0, nsnp, scale, block_pairs, block_dogs)
+        for matrix in (grm, ibs2, ibs0, nsnp):
+            matrix.flush()
+        del ibs2
+        os.replace(output / "ibs2.npy", output / "dst.npy")
+        samples = samples.select(pl.col("IID").cast(pl.Int64))
+        samples.write_parquet(output / "samples.parquet")
+        _write_pairs(output, samples["IID"].to_numpy(), {
+            name: np.load(output / f"{name}.npy", mmap_mode="r") for name in ("grm", "dst", "ibs0", "nsnp")
+        }, block_dogs)
+    return samples, n_used
+
+def _add_block(codes: np.ndarray, grm: np.ndarray, ibs2: np.ndarray, ibs0: np.ndarray, nsnp: np.ndarray,
+               block_pairs: list[tuple[int, int]], block_dogs: int, pool: ThreadPoolExecutor) -> float:
+    """
+    Adds one block of loci ((dogs x loci) genotype_packing codes) to the accumulators, one dog block pair per task.
+
+    Returns the block's share of the GRM scale, the sum of 2p(1 - p) over its polymorphic loci.
+    """
+    called = codes != MISSING
+    alt = (codes == HET).astype(np.float32) + 2 * (codes == HOM_ALT)
+    n_called = called.sum(axis=0)
+    p = alt.sum(axis=0) / np.maximum(2 * n_called, 1)
+    polymorphic = (n_called > 0) & (p > 0) & (p < 1)
+
+    # Standardised genotypes (0 where missing), IBS state indicators and called indicators
+    z = np.where(called & polymorphic, alt - 2 * p, 0).astype(np.float32)
+    hom_ref = (codes == HOM_REF).astype(np.float32)
+    hom_alt = (codes == HOM_ALT).astype(np.float32)
+    states = np.concatenate([hom_ref, (codes == HET).astype(np.float32), hom_alt], axis=1)
+    called = called.astype(np.float32)
+
+    def multiply(i: int, j: int) -> None:
+        a, b = slice(i, i + block_dogs), slice(j, j + block_dogs)
+        grm[a, b] += z[a] @ z[b].T
+        ibs2[a, b] += states[a] @ states[b].T
+        ibs0[a, b] += hom_ref[a] @ hom_alt[b].T + hom_alt[a] @ hom_ref[b].T
+        nsnp[a, b] += called[a] @ called[b].T
+
+    for future in [pool.submit(multiply, i, j) for i, j in block_pairs]:
+        future.result()
+    return float((2 * p * (1 - p))[polymorphic].sum())
+
+def _finish(grm: np.ndarray, ibs2: np.ndarray, ibs0: np.ndarray, nsnp: np.ndarray, scale: float,
+            block_pairs: list[tuple[int, int]], block_dogs: int) -> None:
+    """
+    Scales the GRM, turns IBS2 counts into DST, and mirrors the upper triangle of blocks into the lower one.
+    """
+    for i, j in block_pairs:
+        a, b = slice(i, i + block_dogs), slice(j, j + block_dogs)
+        grm[a, b] = grm[a, b] / scale if scale else np.nan
+        n = nsnp[a, b]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ibs2[a, b] = np.where(n > 0, (ibs2[a, b] + 0.5 * (n - ibs2[a, b] - ibs0[a, b])) / n, np.nan)
+        if i != j:
+            for matrix in (grm, ibs2, ibs0, nsnp):
+                matrix[b, a] = matrix[a, b].T
+
+def _write_pairs(output: Path, iid: np.ndarray, matrices: dict[str, np.ndarray], block_dogs: int) -> None:
+    """
+    Writes every pair of dogs once (upper triangle), one Parquet part per block of rows.
+    """
+    folder = output / "pairs"
+    folder.mkdir()
+    n_dogs = len(iid)
+    part = 0
+    for start in range(0, n_dogs, block_dogs):
+        rows = np.arange(start, min(start + block_dogs, n_dogs))
+        columns = [np.arange(row + 1, n_dogs) for row in rows]
+        pairs = _pair_frame(iid, matrices, np.repeat(rows, [len(c) for c in columns]),
+                            np.concatenate(columns))
+        if pairs.height or part == 0:
+            pairs.write_parquet(folder / f"part-{part:05d}.parquet")
+            part += 1
+
+def _pair_frame(iid: np.ndarray, matrices: dict[str, np.ndarray], rows: np.ndarray,
+                columns: np.ndarray) -> pl.DataFrame:
+    """
+    Builds PAIR_SCHEMA rows for the matrix cells (rows[i], columns[i]).
+    """
+    return pl.DataFrame({
+        "IID1": iid[rows],
+        "IID2": iid[columns],
+        "GRM": matrices["grm"][rows, columns],
+        "DST": matrices["dst"][rows, columns],
+        "IBS0": matrices["ibs0"][rows, columns],
+        "NSNP": matrices["nsnp"][rows, columns]
+    }).cast(PAIR_SCHEMA)
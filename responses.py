@@ -0,0 +1,242 @@
+import itertools
+import json
+import os
+import queue
+import threading
+from typing import IO, Any, Callable, Iterator, NamedTuple, Optional
+
+import polars as pl
+from starlette.responses import Response, StreamingResponse
+
+from metrics import span
+
+# Response formats by name, and the media type each is served as
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+# Other media types clients ask for the same formats with
+_ACCEPT_ALIASES = {
+    "application/*": "json",
+    "*/*": "json",
+    "application/jsonl": "ndjson",
+    "application/jsonlines": "ndjson",
+    "application/x-jsonlines": "ndjson",
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.file": "arrow"
+}
+
+# Rows serialized at a time while streaming a result frame
+STREAM_ROWS = int(os.getenv("RESPONSE_STREAM_ROWS", "50000"))
+
+# Bodies up to this many bytes are serialized before the response starts, and sent whole; larger ones are
+# streamed once this much is serialized
+BUFFER_BYTES = int(os.getenv("RESPONSE_BUFFER_BYTES", str(1024 * 1024)))
+
+# Bytes buffered before a chunk of Arrow/Parquet output is handed to the response
+_PIPE_CHUNK = 1024 * 1024
+
+class NotAcceptableError(ValueError):
+    """Raised when a client asks for a response format, or a result, that can't be served."""
+
+class ResponseFormat(NamedTuple):
+    """
+    Negotiated format of an analysis response; `result` names the frame of single-table formats.
+    """
+    name: str = "json"
+    result: Optional[str] = None
+
+def negotiate(accept: Optional[str], format: Optional[str] = None) -> str:
+    """
+    Picks the response format from a `format` name, or else from the Accept header (default: json).
+
+    Raises:
+        NotAcceptableError: If the format is unknown or no accepted media type can be served.
+    """
+    if format:
+        if format not in MEDIA_TYPES:
+            raise NotAcceptableError(f"Unknown format {format!r}; use one of {', '.join(MEDIA_TYPES)}")
+        return format
+    if not accept:
+        return "json"
+
+    by_media_type = {media_type: name for name, media_type in MEDIA_TYPES.items()} | _ACCEPT_ALIASES
+    offers = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *options = (part.strip() for part in item.split(";"))
+        quality = 1.0
+        for option in options:
+            if option.startswith("q="):
+                try:
+                    quality = float(option[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in by_media_type and quality > 0:
+            offers.append((-quality, position, by_media_type[media_type.lower()]))
+    if not offers:
+        raise NotAcceptableError(f"Can't serve {accept!r}; use one of {', '.join(MEDIA_TYPES.values())}")
+    return min(offers)[2]
+
+def result_response(body: dict[str, Any], response_format: ResponseFormat,
+                    headers: Optional[dict[str, str]] = None) -> Response:
+    """
+    Streams an analysis response body whose result tables are DataFrame values.
+
+    Bodies of up to BUFFER_BYTES are serialized before the response is built, so their serialize_* stages
+    are in its Server-Timing header; larger ones are streamed as they are serialized.
+
+    - json: the body as one JSON object, each frame an array of row objects
+    - ndjson: a first line with the other values of the body, then one line per row, tagged with its frame
+    - arrow, parquet: one frame (response_format.result, default: the first) as an Arrow IPC stream or a
+      Parquet file; X-Result names it, X-Results lists all frames and X-Result-Meta holds the other values
+
+    Raises:
+        NotAcceptableError: If response_format.result isn't a frame of the body.
+    """
+    headers = dict(headers or {})
+    name = response_format.name
+    if name == "json":
+        content = iter_json(body)
+    elif name == "ndjson":
+        content = iter_ndjson(body)
+    else:
+        frames = {key: value for key, value in body.items() if isinstance(value, pl.DataFrame)}
+        result = response_format.result or next(iter(frames), None)
+        if result not in frames:
+            raise NotAcceptableError(f"No result {result!r}; available: {', '.join(frames)}")
+        meta = {key: value for key, value in body.items() if key not in frames}
+        headers.update({
+            "X-Result": result,
+            "X-Results": ",".join(frames),
+            "X-Result-Meta": json.dumps(meta)
+        })
+        if name == "arrow":
+            content = iter_arrow(frames[result])
+        else:
+            content = iter_piped(lambda f: frames[result].write_parquet(f, row_group_size=STREAM_ROWS),
+                                 "serialize_parquet")
+
+    content = iter(content)
+    buffered, size = [], 0
+    for chunk in content:
+        buffered.append(chunk.encode() if isinstance(chunk, str) else chunk)
+        size += len(buffered[-1])
+        if size > BUFFER_BYTES:
+            return StreamingResponse(itertools.chain(buffered, content), media_type=MEDIA_TYPES[name],
+                                     headers=headers)
+    return Response(b"".join(buffered), media_type=MEDIA_TYPES[name], headers=headers)
+
+def iter_json(value: Any) -> Iterator[str]:
+    """
+    Serializes a value to JSON in pieces, writing DataFrames as arrays of row objects STREAM_ROWS at a time.
+    """
+    if isinstance(value, pl.DataFrame):
+        yield "["
+        for offset in range(0, value.height, STREAM_ROWS):
+            with span("serialize_json"):
+                rows = value.slice(offset, STREAM_ROWS).write_json()[1:-1]
+            yield ("," if offset else "") + rows
+        yield "]"
+    elif isinstance(value, dict) and any(isinstance(item, (pl.DataFrame, dict)) for item in value.values()):
+        yield "{"
+        for i, (key, item) in enumerate(value.items()):
+            yield ("," if i else "") + json.dumps(str(key)) + ":"
+            yield from iter_json(item)
+        yield "}"
+    else:
+        yield json.dumps(value)
+
+def iter_ndjson(body: dict[str, Any]) -> Iterator[str]:
+    """
+    Serializes a body as NDJSON: its non-frame values on the first line, then each frame's rows with a
+    "frame" field naming the frame.
+    """
+    frames = {key: value for key, value in body.items() if isinstance(value, pl.DataFrame)}
+    yield json.dumps({**{key: value for key, value in body.items() if key not in frames},
+                      "frames": list(frames)}) + "\n"
+    for name, frame in frames.items():
+        tagged = frame.select(pl.lit(name).alias("frame"), pl.all())
+        for offset in range(0, tagged.height, STREAM_ROWS):
+            with span("serialize_ndjson"):
+                yield tagged.slice(offset, STREAM_ROWS).write_ndjson()
+
+def iter_arrow(frame: pl.DataFrame) -> Iterator[bytes]:
+    """
+    Serializes a frame as an Arrow IPC stream, one record batch per STREAM_ROWS rows.
+    """
+    return iter_piped(_chunked(frame).write_ipc_stream, "serialize_arrow")
+
+def _chunked(frame: pl.DataFrame) -> pl.DataFrame:
+    """
+    The frame split into chunks of STREAM_ROWS rows, so writers emit one record batch per chunk.
+    """
+    if frame.height <= STREAM_ROWS:
+        return frame
+    return pl.concat([frame.slice(offset, STREAM_ROWS) for offset in range(0, frame.height, STREAM_ROWS)],
+                     rechunk=False)
+
+class _Pipe:
+    """
+    Write end of iter_piped: buffers writes and hands them over in chunks through a bounded queue.
+    """
+
+    def __init__(self) -> None:
+        self.queue: queue.Queue = queue.Queue(maxsize=8)
+        self.closed = False
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= _PIPE_CHUNK:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _put(self, item: Any) -> None:
+        # Gives up once the reader has gone, e.g. when the client disconnects
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise BrokenPipeError("Response stream closed")
+
+def iter_piped(write: Callable[[IO[bytes]], None], stage: str) -> Iterator[bytes]:
+    """
+    Runs write(file) in a thread and yields what it writes as it is written, timing the writer as `stage`.
+    """
+    pipe = _Pipe()
+    errors: list[BaseException] = []
+    done = object()
+
+    def run() -> None:
+        try:
+            with span(stage):
+                write(pipe)
+            pipe.flush()
+        except BrokenPipeError:
+            return
+        except BaseException as e:
+            errors.append(e)
+        try:
+            pipe._put(done)
+        except BrokenPipeError:
+            pass
+
+    writer = threading.Thread(target=run, daemon=True)
+    writer.start()
+    try:
+        while (chunk := pipe.queue.get()) is not done:
+            yield chunk
+        if errors:
+            raise errors[0]
+    finally:
+        pipe.closed = True
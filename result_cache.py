@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+import polars as pl
+
+META_NAME = "meta.json"
+
+# Errors reading an entry that is gone, half-removed or corrupt; such entries are dropped and count as misses
+_UNREADABLE = (OSError, ValueError, KeyError, pl.exceptions.PolarsError)
+
+class CachedResult(NamedTuple):
+    """
+    A cached analysis: its result frames by name and the other values of its response.
+    """
+    key: str
+    frames: dict[str, pl.DataFrame]
+    values: dict[str, Any]
+
+class ResultCache:
+    """
+    Disk cache of ROH and parentage results, keyed by the input genotype digests and the analysis parameters.
+
+    Each entry is a folder {root}/{key}/ with one Parquet file per result frame and a meta.json holding the
+    inputs, parameters, creation time and the response's other values. Entries expire `ttl` seconds after
+    they were written, and the least recently used ones are evicted once the cache grows beyond `max_bytes`.
+
+    Args:
+        root (Path): Folder holding the cached results.
+        max_bytes (int): Size budget of the cache in bytes.
+        ttl (float): Lifetime of an entry in seconds (0 = no expiry).
+    """
+
+    def __init__(self, root: Path, max_bytes: int, ttl: float) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """
+        Build a cache from RESULT_CACHE_DIR (default: cache/results), RESULT_CACHE_MAX_BYTES (default: 1 GiB)
+        and RESULT_CACHE_TTL_SECONDS (default: 7 days)
+        """
+        return cls(
+            root=Path(os.getenv("RESULT_CACHE_DIR", "cache/results")),
+            max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 ** 3))),
+            ttl=float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+        )
+
+    @staticmethod
+    def key(kind: str, inputs: list[str], params: dict[str, Any]) -> str:
+        """
+        Returns the cache key of an analysis.
+
+        Args:
+            kind (str): The analysis, e.g. "roh" or "parentage".
+            inputs (list[str]): Genotype digests of the inputs, in an order that is significant to the analysis.
+            params (dict[str, Any]): The analysis parameters; key order doesn't matter.
+        """
+        normalized = json.dumps({"kind": kind, "inputs": inputs, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def stats(self) -> dict[str, int]:
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(entry[1] for entry in entries),
+            "max_bytes": self.max_bytes
+        }
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        """
+        Returns the cached result of `key`, or None if it isn't cached, has expired or can't be read (the
+        entry is then dropped).
+        """
+        folder = self.root / key
+        try:
+            meta = self._read_meta(folder)
+            if self._expired(meta):
+                self._remove(folder)
+                raise FileNotFoundError(folder)
+            frames = {name: pl.read_parquet(folder / f"{name}.parquet") for name in meta["frames"]}
+            os.utime(folder / META_NAME)
+        except _UNREADABLE:
+            self._remove(folder)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return CachedResult(key, frames, meta["values"])
+
+    def put(self, key: str, kind: str, inputs: list[str], params: dict[str, Any],
+            frames: dict[str, pl.DataFrame], values: Optional[dict[str, Any]] = None) -> None:
+        """
+        Stores a result; an entry written concurrently for the same key is kept instead.
+        """
+        temp = self.root / f".put-{uuid.uuid4().hex}"
+        temp.mkdir()
+        try:
+            for name, frame in frames.items():
+                frame.write_parquet(temp / f"{name}.parquet")
+            with open(temp / META_NAME, "w") as f:
+                json.dump({
+                    "kind": kind,
+                    "inputs": inputs,
+                    "params": params,
+                    "created_at": time.time(),
+                    "frames": list(frames),
+                    "values": values or {}
+                }, f, default=str)
+            try:
+                os.replace(temp, self.root / key)
+            except OSError:
+                # Already cached by a concurrent request
+                pass
+        finally:
+            shutil.rmtree(temp, ignore_errors=True)
+
+        self._evict(keep=key)
+
+    def invalidate(self, key: Optional[str] = None, digest: Optional[str] = None) -> int:
+        """
+        Removes one entry, every entry with a given input digest, or (with neither) the whole cache.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        removed = 0
+        for folder in self._folders():
+            if key is not None and folder.name != key:
+                continue
+            if digest is not None:
+                try:
+                    if digest not in self._read_meta(folder)["inputs"]:
+                        continue
+                except FileNotFoundError:
+                    # Removed concurrently
+                    continue
+                except _UNREADABLE:
+                    # Corrupt entries are dropped as well
+                    pass
+            self._remove(folder)
+            removed += 1
+        return removed
+
+    def _expired(self, meta: dict) -> bool:
+        return self.ttl > 0 and time.time() - meta["created_at"] > self.ttl
+
+    @staticmethod
+    def _read_meta(folder: Path) -> dict:
+        with open(folder / META_NAME, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _remove(folder: Path) -> None:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def _folders(self) -> list[Path]:
+        return [folder for folder in self.root.iterdir() if folder.is_dir() and not folder.name.startswith(".")]
+
+    def _entries(self) -> list[tuple[Path, int, float, dict]]:
+        """
+        Lists the cache entries as (folder, size in bytes, last use time, meta).
+        """
+        entries = []
+        for folder in self._folders():
+            try:
+                size = sum(path.stat().st_size for path in folder.iterdir())
+                entries.append((folder, size, (folder / META_NAME).stat().st_mtime, self._read_meta(folder)))
+            except _UNREADABLE:
+                # Removed concurrently, or corrupt
+                self._remove(folder)
+                continue
+        return entries
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """
+        Removes expired entries, then the least recently used ones until the cache fits its size budget.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(entry[1] for entry in entries)
+        for folder, size, _, meta in entries:
+            if total <= self.max_bytes and not self._expired(meta):
+                continue
+            if folder.name == keep:
+                continue
+            self._remove(folder)
+            total -= size
+            with self._lock:
+                self.evictions += 1
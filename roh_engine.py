@@ -0,0 +1,199 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import polars as pl
+
+from genotypes import DOG_AUTOSOMES, read_tfam, read_tped, tped_calls
+from plink_reports import HOM_INDIV_SCHEMA, HOM_SCHEMA
+
+def _het_missing(first: np.ndarray, second: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the heterozygous and missing call masks of (dogs x SNPs) allele code matrices.
+    """
+    missing = (first == 0) | (second == 0)
+    het = (first != second) & ~missing
+    return het, missing
+
+def _running_total(mask: np.ndarray) -> np.ndarray:
+    """
+    Cumulative count along the SNP axis, with a leading zero column: total[:, j] = mask[:, :j].sum(axis=1).
+    """
+    total = np.zeros((mask.shape[0], mask.shape[1] + 1), dtype=np.int32)
+    np.cumsum(mask, axis=1, out=total[:, 1:])
+    return total
+
+def _chromosome_segments(het: np.ndarray, missing: np.ndarray, positions: np.ndarray, window_snp: int,
+                         window_het: int, window_missing: int, window_threshold: float, homozyg_gap: int,
+                         homozyg_het: int, homozyg_density: int, homozyg_snp: int,
+                         homozyg_kb: int) -> dict[str, np.ndarray]:
+    """
+    Calls runs of homozygosity on one chromosome for every dog at once, following PLINK's --homozyg scan:
+
+    1. A window of `window_snp` SNPs slides one SNP at a time; it is homozygous if it has at most
+       `window_het` heterozygous and `window_missing` missing calls.
+    2. A SNP is a segment candidate if at least `window_threshold` of the windows covering it are homozygous.
+    3. Consecutive candidates form a segment, split wherever two SNPs are more than `homozyg_gap` kb apart.
+    4. Segments are kept if they have at least `homozyg_snp` SNPs and `homozyg_kb` kb, at most
+       `homozyg_het` heterozygous calls and at most `homozyg_density` kb per SNP on average.
+
+    Returns:
+        dict[str, np.ndarray]: Per segment, the dog row, first and last SNP index, and het/missing counts.
+    """
+    dogs, snps = het.shape
+    empty = {key: np.zeros(0, dtype=np.int64) for key in ("row", "start", "end", "het", "missing")}
+    if snps < window_snp:
+        return empty
+
+    het_total = _running_total(het)
+    missing_total = _running_total(missing)
+
+    # Homozygous windows, by first SNP
+    window_hets = het_total[:, window_snp:] - het_total[:, :-window_snp]
+    window_missings = missing_total[:, window_snp:] - missing_total[:, :-window_snp]
+    homozygous_windows = (window_hets <= window_het) & (window_missings <= window_missing)
+    windows = homozygous_windows.shape[1]
+
+    # Share of the windows covering each SNP that are homozygous
+    snp_index = np.arange(snps)
+    first_window = np.maximum(snp_index - window_snp + 1, 0)
+    last_window = np.minimum(snp_index, windows - 1) + 1
+    homozygous_total = _running_total(homozygous_windows)
+    hits = homozygous_total[:, last_window] - homozygous_total[:, first_window]
+    candidates = hits >= window_threshold * (last_window - first_window) - 1e-9
+
+    # Segment boundaries: candidate runs, split on gaps between SNPs
+    gap = np.diff(positions) > homozyg_gap * 1000
+    breaks_before = np.concatenate([[True], gap])
+    breaks_after = np.concatenate([gap, [True]])
+    previous = np.concatenate([np.zeros((dogs, 1), dtype=bool), candidates[:, :-1]], axis=1)
+    following = np.concatenate([candidates[:, 1:], np.zeros((dogs, 1), dtype=bool)], axis=1)
+    starts = candidates & (~previous | breaks_before)
+    ends = candidates & (~following | breaks_after)
+
+    # Row-major order pairs each start with its end
+    rows, start = np.nonzero(starts)
+    _, end = np.nonzero(ends)
+    if len(rows) == 0:
+        return empty
+
+    nsnp = end - start + 1
+    kb = (positions[end] - positions[start]) / 1000
+    hets = het_total[rows, end + 1] - het_total[rows, start]
+    missings = missing_total[rows, end + 1] - missing_total[rows, start]
+    keep = ((nsnp >= homozyg_snp) & (kb >= homozyg_kb) & (kb / nsnp <= homozyg_density)
+            & (hets <= homozyg_het))
+    return {"row": rows[keep], "start": start[keep], "end": end[keep], "het": hets[keep],
+            "missing": missings[keep]}
+
+def call_roh_batch(chromosomes: np.ndarray, positions: np.ndarray, locus_ids: np.ndarray, first: np.ndarray,
+                   second: np.ndarray, samples: pl.DataFrame, window_snp: int = 50, window_het: int = 1,
+                   window_missing: int = 5, window_threshold: float = 0.05, homozyg_gap: int = 1000,
+                   homozyg_het: int = 1000, homozyg_density: int = 50, homozyg_snp: int = 100,
+                   homozyg_kb: int = 1000, autosomes_only: bool = True) -> list[pl.DataFrame]:
+    """
+    In-process, vectorized alternative to PLINK --homozyg for genotypes already in memory.
+
+    Takes the same parameters as plink_roh (see there) and returns frames with the layout of PLINK's
+    .hom and .hom.indiv reports.
+
+    Args:
+        chromosomes (np.ndarray): PLINK --dog chromosome code of each SNP.
+        positions (np.ndarray): Base-pair position of each SNP.
+        locus_ids (np.ndarray): Identifier of each SNP.
+        first (np.ndarray): (dogs x SNPs) first allele codes (0 = missing), or a 1-D array for one dog.
+        second (np.ndarray): (dogs x SNPs) second allele codes, shaped like `first`.
+        samples (pl.DataFrame): One row per dog with FID, IID and PHE columns (e.g. from read_tfam).
+        autosomes_only (bool): Only scan chromosomes 1-38, as PLINK does (default: True).
+    """
+    first = np.atleast_2d(first)
+    second = np.atleast_2d(second)
+    chromosomes = np.asarray(chromosomes)
+    positions = np.asarray(positions, dtype=np.int64)
+    locus_ids = np.asarray(locus_ids)
+    if first.shape != second.shape or first.shape[1] != len(positions) or first.shape[0] != samples.height:
+        raise ValueError("Genotype matrices, loci and samples have mismatching shapes")
+
+    het, missing = _het_missing(first, second)
+    params = dict(
+        window_snp=window_snp, window_het=window_het, window_missing=window_missing,
+        window_threshold=window_threshold, homozyg_gap=homozyg_gap, homozyg_het=homozyg_het,
+        homozyg_density=homozyg_density, homozyg_snp=homozyg_snp, homozyg_kb=homozyg_kb
+    )
+
+    parts = []
+    for chromosome in np.unique(chromosomes):
+        if chromosome <= 0 or (autosomes_only and chromosome > DOG_AUTOSOMES):
+            continue
+        # Order the chromosome's SNPs by position
+        index = np.flatnonzero(chromosomes == chromosome)
+        index = index[np.argsort(positions[index], kind="stable")]
+        segments = _chromosome_segments(het[:, index], missing[:, index], positions[index], **params)
+        if len(segments["row"]) == 0:
+            continue
+
+        start, end = index[segments["start"]], index[segments["end"]]
+        nsnp = segments["end"] - segments["start"] + 1
+        called = nsnp - segments["missing"]
+        kb = (positions[end] - positions[start]) / 1000
+        parts.append(pl.DataFrame({
+            "row": segments["row"],
+            "CHR": np.full(len(start), chromosome),
+            "SNP1": locus_ids[start],
+            "SNP2": locus_ids[end],
+            "POS1": positions[start],
+            "POS2": positions[end],
+            "KB": kb,
+            "NSNP": nsnp,
+            "DENSITY": kb / nsnp,
+            "PHOM": (called - segments["het"]) / np.maximum(called, 1),
+            "PHET": segments["het"] / np.maximum(called, 1)
+        }))
+
+    samples = samples.select(["FID", "IID", "PHE"]).with_row_index("row")
+    segment_columns = ["row", "CHR", "SNP1", "SNP2", "POS1", "POS2", "KB", "NSNP", "DENSITY", "PHOM", "PHET"]
+    segments = pl.concat(parts) if parts else pl.DataFrame(schema=dict.fromkeys(segment_columns, pl.Float64))
+    segments = segments.with_columns(pl.col("row").cast(pl.UInt32))
+
+    hom = (
+        samples.join(segments, on="row", how="inner")
+        .sort(["row", "CHR", "POS1"])
+        .select(list(HOM_SCHEMA))
+        .cast(HOM_SCHEMA)
+    )
+    hom_indiv = (
+        samples.join(
+            segments.group_by("row").agg(pl.len().alias("NSEG"), pl.col("KB").sum()),
+            on="row", how="left"
+        )
+        .sort("row")
+        .with_columns(pl.col("NSEG").fill_null(0), pl.col("KB").fill_null(0.0))
+        .with_columns(pl.when(pl.col("NSEG") > 0).then(pl.col("KB") / pl.col("NSEG")).otherwise(0.0).alias("KBAVG"))
+        .select(list(HOM_INDIV_SCHEMA))
+        .cast(HOM_INDIV_SCHEMA)
+    )
+    return [hom, hom_indiv]
+
+def native_roh(input_file: Path, window_snp: int = 50, window_het: int = 1, window_missing: int = 5,
+               window_threshold: float = 0.05, homozyg_gap: int = 1000, homozyg_het: int = 1000,
+               homozyg_density: int = 50, homozyg_snp: int = 100, homozyg_kb: int = 1000,
+               samples: Optional[pl.DataFrame] = None) -> list[pl.DataFrame]:
+    """
+    Drop-in replacement for plink_roh on a single-sample TPED/TFAM pair, run in-process.
+
+    Args:
+        input_file (Path): Path to the TPED/TFAM files, without extension.
+        samples (pl.DataFrame): FID/IID/PHE of the dog (default: read from the .tfam file).
+
+    Returns:
+        list[pl.DataFrame]: The .hom and .hom.indiv frames, as plink_roh returns them.
+    """
+    if samples is None:
+        samples = read_tfam(Path(f"{input_file}.tfam"))
+    calls = tped_calls(read_tped(Path(f"{input_file}.tped")))
+    return call_roh_batch(
+        calls["chromosome"], calls["position"], calls["locus_id"], calls["first"], calls["second"], samples,
+        window_snp=window_snp, window_het=window_het, window_missing=window_missing,
+        window_threshold=window_threshold, homozyg_gap=homozyg_gap, homozyg_het=homozyg_het,
+        homozyg_density=homozyg_density, homozyg_snp=homozyg_snp, homozyg_kb=homozyg_kb
+    )
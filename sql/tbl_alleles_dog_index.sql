@@ -0,0 +1,5 @@
+-- Reading a dog's genotypes back (db_connection.read_stored_genotypes) is one query on lngDogID;
+-- the included columns let it be answered from the index alone
+CREATE INDEX IF NOT EXISTS "ix_tbl_alleles_lngDogID"
+    ON "public"."tbl_alleles" ("lngDogID", "lngSourceID")
+    INCLUDE ("lngLocusID", "bytFirstAllele", "bytSecondAllele");
@@ -0,0 +1,52 @@
+-- Locus dictionary: tbl_loci holds each locus once, keyed by lngLocusID, and tbl_alleles
+-- references loci by that key instead of repeating the locus identifier (see locus_dictionary.py)
+
+-- Loci used to be inserted again with every TPED; keep the first row of each identifier
+DELETE FROM "public"."tbl_loci" a
+USING "public"."tbl_loci" b
+WHERE a."strLocusIdentifier" = b."strLocusIdentifier" AND a.ctid > b.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS "ux_tbl_loci_strLocusIdentifier"
+    ON "public"."tbl_loci" ("strLocusIdentifier");
+
+-- New loci get their key from a sequence, continuing after the existing keys
+CREATE SEQUENCE IF NOT EXISTS "public"."tbl_loci_lngLocusID_seq" AS bigint;
+SELECT setval('"public"."tbl_loci_lngLocusID_seq"',
+              COALESCE((SELECT max("lngLocusID") FROM "public"."tbl_loci"), 0) + 1, false);
+ALTER TABLE "public"."tbl_loci"
+    ALTER COLUMN "lngLocusID" SET DEFAULT nextval('"public"."tbl_loci_lngLocusID_seq"');
+
+ALTER TABLE "public"."tbl_alleles" ADD COLUMN IF NOT EXISTS "lngLocusID" bigint;
+
+-- Loci used to be numbered by their row in each TPED, so the keys of different panels collide.
+-- While they aren't unique, every locus is renumbered from the sequence and tbl_alleles is keyed again below
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM "public"."tbl_loci" GROUP BY "lngLocusID" HAVING count(*) > 1
+    ) OR EXISTS (
+        SELECT 1 FROM "public"."tbl_loci" WHERE "lngLocusID" IS NULL
+    ) THEN
+        IF EXISTS (
+            SELECT 1 FROM "public"."tbl_alleles" WHERE "strLocusID" IS NULL AND "lngLocusID" IS NOT NULL
+        ) THEN
+            RAISE EXCEPTION 'tbl_alleles has rows keyed only by lngLocusID, which renumbering tbl_loci would orphan';
+        END IF;
+        UPDATE "public"."tbl_loci" SET "lngLocusID" = nextval('"public"."tbl_loci_lngLocusID_seq"');
+        UPDATE "public"."tbl_alleles" SET "lngLocusID" = NULL WHERE "lngLocusID" IS NOT NULL;
+    END IF;
+END $$;
+
+ALTER TABLE "public"."tbl_loci" ALTER COLUMN "lngLocusID" SET NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS "ux_tbl_loci_lngLocusID" ON "public"."tbl_loci" ("lngLocusID");
+
+-- Integer locus keys on tbl_alleles, filled in for the rows loaded before
+UPDATE "public"."tbl_alleles" a
+SET "lngLocusID" = l."lngLocusID"
+FROM "public"."tbl_loci" l
+WHERE a."lngLocusID" IS NULL AND a."strLocusID" = l."strLocusIdentifier";
+ALTER TABLE "public"."tbl_alleles" ALTER COLUMN "strLocusID" DROP NOT NULL;
+CREATE INDEX IF NOT EXISTS "ix_tbl_alleles_lngLocusID" ON "public"."tbl_alleles" ("lngLocusID");
+
+-- Once nothing reads strLocusID any more it can be dropped to shrink the table:
+-- ALTER TABLE "public"."tbl_alleles" DROP COLUMN "strLocusID";
@@ -0,0 +1,23 @@
+-- One 2-bit packed genotype row per dog and source, encoded against the locus panel in
+-- tbl_genotype_panel (see genotype_packing.py)
+CREATE TABLE IF NOT EXISTS "public"."tbl_packed_genotypes" (
+    "lngDogID" bigint NOT NULL,
+    "lngSourceID" bigint NOT NULL,
+    "lngCallCount" bigint NOT NULL,
+    "lngPanelVersion" bigint NOT NULL DEFAULT 0,
+    "bytGenotypes" bytea NOT NULL,
+    PRIMARY KEY ("lngDogID", "lngSourceID")
+);
+ALTER TABLE "public"."tbl_packed_genotypes" ADD COLUMN IF NOT EXISTS "lngPanelVersion" bigint NOT NULL DEFAULT 0;
+
+-- The panel: locus order of the packed rows and the ref/alt alleles their codes refer to. Loci are only
+-- appended and unknown alleles only filled in, under an advisory lock (db_connection._panel_for); each
+-- change gets the next lngVersion, which packed rows record
+CREATE TABLE IF NOT EXISTS "public"."tbl_genotype_panel" (
+    "lngPanelIndex" bigint PRIMARY KEY,
+    "strLocusIdentifier" text NOT NULL UNIQUE,
+    "bytRef" smallint NOT NULL,
+    "bytAlt" smallint NOT NULL,
+    "lngVersion" bigint NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "ix_tbl_genotype_panel_lngVersion" ON "public"."tbl_genotype_panel" ("lngVersion");
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+
+import polars as pl
+
+import db_connection
+from genotypes import TFAM_COLUMNS, write_tped
+
+# Loads of the same key are serialised on one of a fixed set of locks, so the locks don't grow with the dogs seen
+_KEY_LOCK_STRIPES = 64
+
+_TFAM_SCHEMA = {"FID": pl.String, "IID": pl.String, "PAT": pl.String, "MAT": pl.String, "SEX": pl.Int8,
+                "PHE": pl.Int32}
+
+class GenotypeCache:
+    """
+    In-memory cache of the genotypes of recently analysed dogs, read back from the database.
+
+    Entries are single-sample TPED frames keyed by (dog ID, source). The least recently used ones are
+    evicted once the frames grow beyond `max_bytes`, and entries older than `ttl` seconds are read again,
+    so genotypes re-ingested by another process are picked up.
+
+    Args:
+        max_bytes (int): Size budget of the cached frames in bytes.
+        ttl (float): Lifetime of an entry in seconds (0 = no expiry).
+    """
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(_KEY_LOCK_STRIPES)]
+        # Bumped by invalidate(), so a load that was already running isn't cached after it
+        self._generation = 0
+        # (dog, source) -> (genotypes, size in bytes, load time), least recently used first
+        self._entries: OrderedDict[tuple[int, Optional[int]], tuple[pl.DataFrame, int, float]] = OrderedDict()
+        self._bytes = 0
+
+    @classmethod
+    def from_env(cls) -> "GenotypeCache":
+        """
+        Build a cache from GENOTYPE_CACHE_MAX_BYTES (default: 512 MiB) and GENOTYPE_CACHE_TTL_SECONDS (default: 1 hour)
+        """
+        return cls(
+            max_bytes=int(os.getenv("GENOTYPE_CACHE_MAX_BYTES", str(512 * 1024 ** 2))),
+            ttl=float(os.getenv("GENOTYPE_CACHE_TTL_SECONDS", "3600"))
+        )
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
+
+    def get(self, dog: int, source: Optional[int],
+            load: Callable[[int, Optional[int]], Optional[pl.DataFrame]]) -> Optional[pl.DataFrame]:
+        """
+        Returns a dog's genotypes, calling load(dog, source) on a miss; dogs that aren't stored aren't cached.
+        """
+        key = (dog, source)
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and (not self.ttl or time.time() - entry[2] <= self.ttl):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+                generation = self._generation
+
+            genotypes = load(dog, source)
+            if genotypes is None:
+                return None
+            size = int(genotypes.estimated_size())
+            with self._lock:
+                if generation != self._generation:
+                    return genotypes
+                self._drop(key)
+                self._entries[key] = (genotypes, size, time.time())
+                self._bytes += size
+                self._evict(keep=key)
+            return genotypes
+
+    def invalidate(self, dog: Optional[int] = None) -> int:
+        """
+        Drops the cached genotypes of one dog (all sources), or all of them; returns the number of entries dropped.
+        """
+        with self._lock:
+            self._generation += 1
+            keys = [key for key in self._entries if dog is None or key[0] == dog]
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def _key_lock(self, key: tuple[int, Optional[int]]) -> threading.Lock:
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def _drop(self, key: tuple[int, Optional[int]]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self, keep: tuple[int, Optional[int]]) -> None:
+        """
+        Removes the least recently used entries until the cache fits its size budget. Must hold the lock.
+        """
+        for key in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._drop(key)
+            self.evictions += 1
+
+_genotype_cache: Optional[GenotypeCache] = None
+
+def get_genotype_cache() -> GenotypeCache:
+    """
+    Returns the process-wide cache of stored genotypes, configured from the environment.
+    """
+    global _genotype_cache
+    if _genotype_cache is None:
+        _genotype_cache = GenotypeCache.from_env()
+    return _genotype_cache
+
+def load_genotypes(dog_id: int, source: Optional[int] = None) -> pl.DataFrame:
+    """
+    Returns a dog's stored genotypes as a single-sample TPED frame, from the cache or the database
+    (see db_connection.read_stored_genotypes).
+
+    Raises:
+        KeyError: If no genotypes are stored for the dog.
+    """
+    genotypes = get_genotype_cache().get(dog_id, source, db_connection.read_stored_genotypes)
+    if genotypes is None:
+        raise KeyError(f"No stored genotypes for dog {dog_id}" + (f" from source {source}" if source else ""))
+    return genotypes
+
+def stored_samples(dog_ids: list[int]) -> pl.DataFrame:
+    """
+    TFAM rows of stored dogs: FID = IID = dog ID, unknown parents, sex and phenotype.
+    """
+    return pl.DataFrame(
+        [[str(dog_id), str(dog_id), "0", "0", 0, -9] for dog_id in dog_ids], schema=_TFAM_SCHEMA, orient="row"
+    ).select(TFAM_COLUMNS)
+
+def write_stored_tfile(dog_id: int, prefix: Path, source: Optional[int] = None) -> Path:
+    """
+    Writes a stored dog's genotypes as a TPED/TFAM pair for PLINK and returns the .tped path.
+
+    The files of the same genotypes are identical, so their PLINK binary conversion is reused from the bed cache.
+    """
+    return write_tped(load_genotypes(dog_id, source), stored_samples([dog_id]), prefix)
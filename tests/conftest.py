@@ -0,0 +1,22 @@
+import importlib
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+from fastapi.testclient import TestClient
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """The API module, imported and run from a scratch working directory."""
+    # main creates its upload and cache directories relative to the working directory when imported
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(tmp_path_factory.mktemp("api"))
+        yield importlib.import_module("main")
+
+@pytest.fixture
+def client(api):
+    """The API module and a client of its app."""
+    with TestClient(api.app) as client:
+        yield api, client
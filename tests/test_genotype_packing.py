@@ -0,0 +1,80 @@
+"""
+Round trips of genotype_packing without a database: calls encoded against a locus panel, packed four to a
+byte, unpacked and decoded back to the same genotypes.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+from genotype_packing import (HET, HOM_ALT, HOM_REF, MISSING, align_to_panel, build_panel, decode_calls,
+                              encode_calls, extend_panel, pack_codes, unpack_codes)
+
+A, C, G, T = 1, 2, 3, 4
+
+# Seven loci (not a multiple of four): hom ref, het, het in the other allele order, hom alt, fully missing,
+# half missing, and a locus where only one allele is known yet
+LOCI = np.array([f"snp{i}" for i in range(7)], dtype=object)
+FIRST = np.array([A, C, T, G, 0, A, G], dtype=np.uint8)
+SECOND = np.array([A, T, C, G, 0, 0, G], dtype=np.uint8)
+
+def _round_trip(panel, locus_ids, first, second, n_calls=None):
+    first, second = align_to_panel(panel, locus_ids, first, second)
+    packed = pack_codes(encode_calls(first, second, panel.ref, panel.alt)).tobytes()
+    codes = unpack_codes(packed, n_calls or len(panel))
+    return packed, codes
+
+def _genotypes(first, second):
+    # Unordered allele pairs: decoding writes the reference allele first
+    return [tuple(sorted(pair)) for pair in zip(first.tolist(), second.tolist())]
+
+def test_round_trip_keeps_genotypes():
+    panel = build_panel(LOCI, FIRST, SECOND)
+    packed, codes = _round_trip(panel, LOCI, FIRST, SECOND)
+    assert len(packed) == 2
+    assert codes.tolist() == [HOM_REF, HET, HET, HOM_REF, MISSING, MISSING, HOM_REF]
+
+    first, second = decode_calls(codes, panel.ref, panel.alt)
+    expected = _genotypes(FIRST, SECOND)
+    # Half-missing calls can't be encoded and come back fully missing
+    expected[5] = (0, 0)
+    assert _genotypes(first, second) == expected
+
+def test_allele_order_and_strand():
+    panel = build_panel(LOCI, FIRST, SECOND)
+    # The same het in both orders encodes the same; an allele the panel doesn't have (here the other strand's
+    # complement) is missing rather than a wrong genotype
+    first = np.array([A, T, C, G, 0, A, G], dtype=np.uint8)
+    second = np.array([A, C, T, C, 0, A, G], dtype=np.uint8)
+    _, codes = _round_trip(panel, LOCI, first, second)
+    assert codes[:4].tolist() == [HOM_REF, HET, HET, MISSING]
+
+def test_panel_version_bump():
+    panel = build_panel(LOCI, FIRST, SECOND)
+    packed, _ = _round_trip(panel, LOCI, FIRST, SECOND)
+
+    # A second dog brings an alternate allele for snp6 and three new loci, in another order
+    locus_ids = np.array(["snp9", "snp6", "snp7", "snp0", "snp8"], dtype=object)
+    first = np.array([C, G, A, A, T], dtype=np.uint8)
+    second = np.array([C, A, G, C, T], dtype=np.uint8)
+    extended = extend_panel(panel, locus_ids, first, second)
+    assert len(extended) == 10
+    assert extended.locus_ids[:7].tolist() == LOCI.tolist()
+    assert (extended.ref[:7] == panel.ref).all()
+
+    # Calls packed against the old panel keep their meaning; the new loci are missing for them
+    old_codes = unpack_codes(packed, len(extended))
+    old_first, old_second = decode_calls(old_codes, extended.ref, extended.alt)
+    assert _genotypes(old_first, old_second)[:7] == _genotypes(*decode_calls(unpack_codes(packed, 7), panel.ref,
+                                                                            panel.alt))
+    assert old_codes[7:].tolist() == [MISSING] * 3
+
+    # The second dog round-trips against the extended panel
+    _, codes = _round_trip(extended, locus_ids, first, second)
+    new_first, new_second = decode_calls(codes, extended.ref, extended.alt)
+    decoded = dict(zip(extended.locus_ids.tolist(), _genotypes(new_first, new_second)))
+    assert [decoded[locus_id] for locus_id in locus_ids] == _genotypes(first, second)
+    assert codes[[6, 0]].tolist() == [HET, HET]
+    assert codes[1:6].tolist() == [MISSING] * 5
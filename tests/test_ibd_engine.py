@@ -0,0 +1,123 @@
+"""
+The in-process IBD estimates (ibd_engine.genome_pairs) on a simulated family under fixtures/ibd.
+
+family.tped/.tfam holds a sire, a dam, two of their offspring (full siblings) and eight unrelated founders,
+typed on 3000 unlinked autosomal SNPs with about 1% missing calls. It was simulated with this module
+(`python tests/test_ibd_engine.py` writes it again, identically), so the IBD each pair truly shares is
+known: parent-offspring pairs Z = (0, 1, 0), full siblings (0.25, 0.5, 0.25) and unrelated dogs (1, 0, 0).
+
+test_pedigree_relationships checks the estimates against that ground truth. test_matches_plink compares
+them with PLINK 1.9's own report of the same fileset once it is recorded next to it, with:
+
+    plink --dog --tfile tests/fixtures/ibd/family --genome full --out tests/fixtures/ibd/family
+
+and is skipped until then.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+import polars as pl
+import pytest
+
+from genotypes import read_tfam, scan_tped
+from ibd_engine import dosages, genome_pairs
+from plink_reports import read_genome
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "ibd"
+FAMILY = FIXTURES / "family"
+
+# Expected (Z0, Z1, Z2) by relationship, and the tolerance of the Z estimates: with allele frequencies from
+# 12 dogs, the method-of-moments Z0 and Z1 of unrelated pairs trade off by up to ~0.2 (PI_HAT stays close)
+EXPECTED = {"parent-offspring": (0.0, 1.0, 0.0), "full-sibling": (0.25, 0.5, 0.25), "unrelated": (1.0, 0.0, 0.0)}
+Z_TOLERANCE = {"parent-offspring": 0.05, "full-sibling": 0.12, "unrelated": 0.25}
+PI_HAT_TOLERANCE = 0.1
+
+# PLINK prints Z0-Z2 and PI_HAT with 4 decimals
+PLINK_TOLERANCE = 1e-3
+
+def _relationship(dog1: dict, dog2: dict) -> str:
+    if dog1["IID"] in (dog2["PAT"], dog2["MAT"]) or dog2["IID"] in (dog1["PAT"], dog1["MAT"]):
+        return "parent-offspring"
+    if dog1["PAT"] != "0" and (dog1["PAT"], dog1["MAT"]) == (dog2["PAT"], dog2["MAT"]):
+        return "full-sibling"
+    return "unrelated"
+
+def _native_genome() -> tuple[pl.DataFrame, pl.DataFrame]:
+    samples = read_tfam(FAMILY.with_suffix(".tfam"))
+    tped = scan_tped(FAMILY.with_suffix(".tped")).collect()
+    first = np.stack([tped[f"firstAllele_{i}"].to_numpy() for i in range(samples.height)])
+    second = np.stack([tped[f"secondAllele_{i}"].to_numpy() for i in range(samples.height)])
+    return samples, genome_pairs(dosages(first, second), samples)
+
+def test_pedigree_relationships():
+    samples, genome = _native_genome()
+    dogs = {dog["IID"]: dog for dog in samples.iter_rows(named=True)}
+    seen = set()
+    for pair in genome.iter_rows(named=True):
+        relationship = _relationship(dogs[pair["IID1"]], dogs[pair["IID2"]])
+        seen.add(relationship)
+        z0, z1, z2 = EXPECTED[relationship]
+        dogs_compared = (pair["IID1"], pair["IID2"], relationship)
+        estimates = (pair["Z0"], pair["Z1"], pair["Z2"])
+        assert estimates == pytest.approx((z0, z1, z2), abs=Z_TOLERANCE[relationship]), dogs_compared
+        assert pair["PI_HAT"] == pytest.approx(z1 / 2 + z2, abs=PI_HAT_TOLERANCE), dogs_compared
+    assert seen == set(EXPECTED)
+
+def test_matches_plink():
+    report = FAMILY.with_suffix(".genome")
+    if not report.exists():
+        pytest.skip(f"No PLINK --genome report recorded at {report}")
+    _, native = _native_genome()
+    plink = read_genome(report)
+    ids = ["IID1", "IID2"]
+    columns = ["Z0", "Z1", "Z2", "PI_HAT"]
+    joined = plink.select(pl.col(ids).cast(pl.String), *columns).join(
+        native.select(pl.col(ids).cast(pl.String), *columns), on=ids, suffix="_native"
+    )
+    assert joined.height == plink.height == native.height
+    for column in columns:
+        assert joined[f"{column}_native"].to_list() == pytest.approx(joined[column].to_list(), abs=PLINK_TOLERANCE)
+
+def _simulate(seed: int = 2024, n_loci: int = 3000, n_founders: int = 8, missing_rate: float = 0.01) -> None:
+    """
+    Writes family.tped/.tfam: a sire and dam, two full-sibling offspring, then `n_founders` unrelated dogs.
+    """
+    rng = np.random.default_rng(seed)
+    frequency = rng.uniform(0.1, 0.9, n_loci)
+    bases = np.array(["A", "C", "G", "T"])
+    alleles = np.stack([rng.permutation(4)[:2] for _ in range(n_loci)])
+
+    def founder() -> np.ndarray:
+        # (2 x loci) haplotypes, 1 = the locus' first allele
+        return (rng.random((2, n_loci)) < frequency).astype(np.int8)
+
+    def child(sire: np.ndarray, dam: np.ndarray) -> np.ndarray:
+        pick = rng.integers(0, 2, (2, n_loci))
+        return np.stack([sire[pick[0], np.arange(n_loci)], dam[pick[1], np.arange(n_loci)]])
+
+    sire, dam = founder(), founder()
+    dogs = [("sire", "0", "0", 1, sire), ("dam", "0", "0", 2, dam),
+            ("pup1", "sire", "dam", 1, child(sire, dam)), ("pup2", "sire", "dam", 2, child(sire, dam))]
+    dogs += [(f"founder{i}", "0", "0", 1 + i % 2, founder()) for i in range(n_founders)]
+
+    columns = []
+    for *_, haplotypes in dogs:
+        calls = bases[np.where(haplotypes == 1, alleles[:, 0], alleles[:, 1])]
+        calls[:, rng.random(n_loci) < missing_rate] = "0"
+        columns += [calls[0], calls[1]]
+    chromosome = 1 + np.arange(n_loci) * 38 // n_loci
+    position = 1_000_000 + 100_000 * (np.arange(n_loci) - np.searchsorted(chromosome, chromosome))
+    with open(FAMILY.with_suffix(".tped"), "w") as f:
+        for i in range(n_loci):
+            f.write("\t".join([str(chromosome[i]), f"snp{i}", "0", str(position[i]),
+                               *(column[i] for column in columns)]) + "\n")
+    with open(FAMILY.with_suffix(".tfam"), "w") as f:
+        for iid, pat, mat, sex, _ in dogs:
+            f.write(f"family {iid} {pat} {mat} {sex} -9\n")
+
+if __name__ == "__main__":
+    FIXTURES.mkdir(parents=True, exist_ok=True)
+    _simulate()
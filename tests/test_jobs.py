@@ -0,0 +1,64 @@
+"""
+JobQueue: cancelled jobs report "cancelled", and run() calls count towards and are refused by max_queued.
+"""
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+from jobs import JobQueue, QueueFullError
+
+async def _until(condition) -> None:
+    for _ in range(5000):
+        if condition():
+            return
+        await asyncio.sleep(0.001)
+    raise AssertionError("timed out")
+
+def test_cancelled_jobs_report_cancelled():
+    async def main():
+        queue = JobQueue(max_concurrent=1, max_queued=10)
+        release = threading.Event()
+        running = queue.submit("roh", release.wait, 5)
+        queued = queue.submit("roh", release.wait, 5)
+        await _until(lambda: running.status == "running")
+
+        for task in list(queue._tasks):
+            task.cancel()
+        await _until(lambda: running.finished and queued.finished)
+        release.set()
+
+        for job in (running, queued):
+            assert job.status == "cancelled"
+            assert job.error == "Job was cancelled"
+            assert job.finished_at is not None
+        assert queue.pending() == 0
+
+    asyncio.run(main())
+
+def test_run_is_refused_once_the_queue_is_full():
+    async def main():
+        queue = JobQueue(max_concurrent=1, max_queued=2)
+        release = threading.Event()
+        job = queue.submit("roh", release.wait, 5)
+        call = asyncio.create_task(queue.run(release.wait, 5))
+        await _until(lambda: queue.pending() == 2)
+
+        with pytest.raises(QueueFullError):
+            await queue.run(release.wait, 5)
+        # The run() in flight counts against submissions too
+        with pytest.raises(QueueFullError):
+            queue.submit("roh", release.wait, 5)
+
+        release.set()
+        assert await call is True
+        await _until(lambda: job.finished)
+        assert job.status == "completed"
+        assert queue.pending() == 0
+        assert await queue.run(lambda: "done") == "done"
+
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""
+plink_parentage_screen's single --genome run, with the merge and PLINK replaced by fakes: the fake --genome
+reports the pairs of its two --genome-lists in merged fileset order, as PLINK does.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import polars as pl
+
+import plink_integration
+
+# Merged fileset order, which isn't the upload order
+MERGED = [("famC", "cand1"), ("famO", "off"), ("famO", "cand0"), ("famX", "cand2")]
+UPLOADS = {"off": "famO", "cand0": "famO", "cand1": "famC", "cand2": "famX"}
+
+def _write_tfam(path: Path, iid: str) -> Path:
+    path.with_suffix(".tfam").write_text(f"{UPLOADS[iid]} {iid} 0 0 1 -9\n")
+    return path.with_suffix(".tped")
+
+def _fake_run_plink(commands: list):
+    def run(command, stage):
+        command = [str(part) for part in command]
+        commands.append(command)
+        if "--genome" in command:
+            lists = command[command.index("--genome-lists") + 1:][:2]
+            first, second = [{tuple(line.split()) for line in Path(path).read_text().splitlines()} for path in lists]
+            lines = ["FID1 IID1 FID2 IID2 RT EZ Z0 Z1 Z2 PI_HAT PHE DST PPC RATIO IBS0 IBS1 IBS2 HOMHOM HETHET"]
+            for i, dog1 in enumerate(MERGED):
+                for j, dog2 in enumerate(MERGED[i + 1:], i + 1):
+                    if (dog1 in first and dog2 in second) or (dog1 in second and dog2 in first):
+                        rt = "OT" if dog1[0] == dog2[0] else "UN"
+                        lines.append(f"{' '.join(dog1)} {' '.join(dog2)} {rt} NA 0.5 0.5 0 0.{i}{j} -1 0.8 1 2 "
+                                     f"0 3 4 0 1")
+            Path(f"{command[command.index('--out') + 1]}.genome").write_text("\n".join(lines) + "\n")
+        return subprocess.CompletedProcess(command, 0, "", "")
+    return run
+
+def test_screen_runs_one_genome_over_offspring_candidate_pairs(tmp_path, monkeypatch):
+    commands = []
+    monkeypatch.setattr(plink_integration, "_plink_merge_tped_files", lambda *args: None)
+    monkeypatch.setattr(plink_integration, "_run_plink", _fake_run_plink(commands))
+
+    offspring = _write_tfam(tmp_path / "off", "off")
+    candidates = [_write_tfam(tmp_path / iid, iid) for iid in ["cand0", "cand1", "cand2"]]
+    result = plink_integration.plink_parentage_screen(offspring, candidates, tmp_path / "screen")
+
+    genome_runs = [command for command in commands if "--genome" in command]
+    assert len(genome_runs) == 1
+    assert genome_runs[0][genome_runs[0].index("--genome") + 1] == "full"
+    assert genome_runs[0][genome_runs[0].index("--read-freq") + 1] == f"{tmp_path / 'screen'}.frq"
+
+    # One row per candidate in upload order, with the offspring first
+    assert result.select("FID1", "IID1", "FID2", "IID2").cast(pl.String).rows() == [
+        ("famO", "off", "famO", "cand0"), ("famO", "off", "famC", "cand1"), ("famO", "off", "famX", "cand2")
+    ]
+    assert result["PI_HAT"].to_list() == [0.12, 0.01, 0.13]
+    assert result["RT"].cast(pl.String).to_list() == ["OT", "UN", "UN"]
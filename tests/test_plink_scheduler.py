@@ -0,0 +1,167 @@
+"""
+PlinkScheduler admission with a fake PLINK command (metrics.run_command replaced), so every run starts and
+finishes when the test says: priority order, the thread and memory budgets, and runs that fail, time out
+or are given up while waiting.
+"""
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+import plink_scheduler
+from plink_scheduler import BATCH, INTERACTIVE, PlinkScheduler
+
+class FakePlink:
+    """
+    Stands in for run_command: each run records its start, checks the budgets, and waits for its release.
+    """
+
+    def __init__(self, scheduler: PlinkScheduler) -> None:
+        self.scheduler = scheduler
+        self.started: list[str] = []
+        self.releases: dict[str, threading.Event] = {}
+        self.threads = 0
+        self.memory_mb = 0
+        self.peak = (0, 0)
+        self._lock = threading.Lock()
+
+    def __call__(self, command, stage, timeout=None):
+        name = command[1]
+        threads = int(command[command.index("--threads") + 1])
+        memory_mb = int(command[command.index("--memory") + 1])
+        with self._lock:
+            self.started.append(name)
+            self.threads += threads
+            self.memory_mb += memory_mb
+            self.peak = (max(self.peak[0], self.threads), max(self.peak[1], self.memory_mb))
+            assert self.threads <= self.scheduler.cpus
+            assert self.memory_mb <= self.scheduler.memory_mb
+        try:
+            self.releases.setdefault(name, threading.Event()).wait(timeout=10)
+            if name.startswith("fail"):
+                raise subprocess.CalledProcessError(1, command)
+            if name.startswith("timeout"):
+                raise subprocess.TimeoutExpired(command, timeout or 0)
+            return subprocess.CompletedProcess(command, 0, "", "")
+        finally:
+            with self._lock:
+                self.threads -= threads
+                self.memory_mb -= memory_mb
+
+    def release(self, name: str) -> None:
+        self.releases.setdefault(name, threading.Event()).set()
+
+def _until(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+def _join(threads: list[threading.Thread]) -> None:
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive(), f"{thread.name} is stuck"
+
+def _start(scheduler: PlinkScheduler, name: str, stage: str = "plink_freq", errors=None, **kwargs):
+    def run():
+        try:
+            scheduler.run(["plink", name], stage, **kwargs)
+        except Exception as e:
+            if errors is not None:
+                errors.append(e)
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+@pytest.fixture
+def fake(monkeypatch):
+    def make(**kwargs) -> tuple[PlinkScheduler, FakePlink]:
+        scheduler = PlinkScheduler(**kwargs)
+        fake = FakePlink(scheduler)
+        monkeypatch.setattr(plink_scheduler, "run_command", fake)
+        return scheduler, fake
+    return make
+
+def test_higher_priority_is_admitted_first(fake):
+    scheduler, plink = fake(cpus=1, memory_mb=4096)
+    threads = [_start(scheduler, "first", priority=BATCH)]
+    _until(lambda: plink.started == ["first"])
+    # Queued behind the first run: two batch runs, then an interactive one
+    for name, priority in (("batch1", BATCH), ("batch2", BATCH), ("interactive", INTERACTIVE)):
+        threads.append(_start(scheduler, name, priority=priority))
+        _until(lambda: scheduler.stats()["queued"] == len(threads) - 1)
+
+    for name in ("first", "interactive", "batch1", "batch2"):
+        _until(lambda: plink.started[-1] == name)
+        plink.release(name)
+    _join(threads)
+    assert plink.started == ["first", "interactive", "batch1", "batch2"]
+
+def test_budgets_are_never_exceeded(fake):
+    scheduler, plink = fake(cpus=4, memory_mb=5000, threads_per_job=3, memory_per_job_mb=2000)
+    runs = [(f"run{i}", "plink_genome" if i % 2 else "plink_freq") for i in range(12)]
+    threads = [_start(scheduler, name, stage) for name, stage in runs]
+    # Release the runs one at a time, as they start
+    for released in range(len(runs)):
+        _until(lambda: len(plink.started) > released)
+        plink.release(plink.started[released])
+    _join(threads)
+
+    assert sorted(plink.started) == sorted(name for name, _ in runs)
+    assert plink.peak[0] <= 4 and plink.peak[1] <= 5000
+    stats = scheduler.stats()
+    assert (stats["running"], stats["queued"], stats["threads_in_use"], stats["memory_in_use_mb"]) == (0, 0, 0, 0)
+
+def test_failed_and_timed_out_runs_free_their_share(fake):
+    scheduler, plink = fake(cpus=1, memory_mb=4096)
+    errors = []
+    for name in ("fail", "timeout"):
+        thread = _start(scheduler, name, errors=errors)
+        _until(lambda: plink.started[-1:] == [name])
+        # Another run waits for the failing one's share
+        waiting = _start(scheduler, f"after_{name}")
+        _until(lambda: scheduler.stats()["queued"] == 1)
+        plink.release(name)
+        _until(lambda: plink.started[-1] == f"after_{name}")
+        plink.release(f"after_{name}")
+        _join([thread, waiting])
+
+    assert sorted(type(error).__name__ for error in errors) == ["CalledProcessError", "TimeoutExpired"]
+    assert scheduler.timeouts == 1
+    assert scheduler.stats()["threads_in_use"] == 0
+
+class _Interrupted(Exception):
+    pass
+
+def test_run_given_up_while_waiting_leaves_the_line(fake):
+    scheduler, plink = fake(cpus=1, memory_mb=4096)
+    give_up = threading.Event()
+    wait = scheduler._cond.wait
+
+    def interruptible_wait(timeout=None):
+        # The "cancelled" run is interrupted while it waits for its turn
+        if threading.current_thread().name == "cancelled" and give_up.is_set():
+            raise _Interrupted()
+        return wait(0.01)
+
+    scheduler._cond.wait = interruptible_wait
+    errors = []
+    threads = [_start(scheduler, "first")]
+    _until(lambda: plink.started == ["first"])
+    threads.append(_start(scheduler, "cancelled", errors=errors, priority=INTERACTIVE))
+    threads.append(_start(scheduler, "behind", priority=BATCH))
+    _until(lambda: scheduler.stats()["queued"] == 2)
+
+    give_up.set()
+    _until(lambda: scheduler.stats()["queued"] == 1)
+    plink.release("first")
+    plink.release("behind")
+    _join(threads)
+    assert [type(error) for error in errors] == [_Interrupted]
+    assert plink.started == ["first", "behind"]
+    assert scheduler.stats()["queued"] == 0
@@ -0,0 +1,41 @@
+"""
+ResultCache entries that can't be read (corrupt Parquet or meta.json) are dropped and count as misses.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import polars as pl
+
+from result_cache import ResultCache
+
+def _cache(tmp_path: Path) -> tuple[ResultCache, str]:
+    cache = ResultCache(tmp_path, max_bytes=1024 ** 2, ttl=0)
+    key = cache.key("roh", ["digest"], {"homozyg_kb": 1000})
+    cache.put(key, "roh", ["digest"], {"homozyg_kb": 1000}, {"roh": pl.DataFrame({"KB": [1500.0]})})
+    return cache, key
+
+def test_hit(tmp_path):
+    cache, key = _cache(tmp_path)
+    cached = cache.get(key)
+    assert cached.frames["roh"]["KB"].to_list() == [1500.0]
+    assert (cache.hits, cache.misses) == (1, 0)
+
+def test_corrupt_frame_is_a_miss(tmp_path):
+    cache, key = _cache(tmp_path)
+    (tmp_path / key / "roh.parquet").write_bytes(b"PAR1 truncated")
+    assert cache.get(key) is None
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert not (tmp_path / key).exists()
+
+def test_corrupt_meta_is_dropped(tmp_path):
+    cache, key = _cache(tmp_path)
+    (tmp_path / key / "meta.json").write_text("{")
+    assert cache.stats()["entries"] == 0
+    assert not (tmp_path / key).exists()
+
+    cache, key = _cache(tmp_path)
+    (tmp_path / key / "meta.json").write_text("{}")
+    assert cache.invalidate(digest="digest") == 1
+    assert cache.get(key) is None
@@ -0,0 +1,58 @@
+"""
+The in-process ROH engine (roh_engine.native_roh) against expected .hom and .hom.indiv reports checked in
+under fixtures/roh.
+
+The expected reports are synthetic: they were written by hand from PLINK 1.9's documented --homozyg rules,
+not produced by a PLINK run, so these tests pin the engine's behaviour on known inputs rather than show
+parity with PLINK (benchmarks/roh_parity.py compares the two on real data).
+
+The inputs are single-dog TPED/TFAM pairs on 20 kb spaced SNPs whose runs of homozygosity are flanked
+by alternating heterozygous calls, so segment ends don't depend on how the window hit rate is rounded.
+They cover a run with missing calls, a whole-chromosome run, a run with one heterozygous call, runs
+dropped by --homozyg-kb, and an X chromosome run that isn't scanned.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest
+
+from benchmarks.roh_parity import parity
+from plink_reports import read_hom, read_hom_indiv
+from roh_engine import native_roh
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "roh"
+
+# Report name -> (input TPED/TFAM pair, native_roh parameters)
+CASES = {
+    "dog_a": ("dog_a", {}),
+    "dog_b": ("dog_b", {}),
+    "dog_b.kb4000": ("dog_b", {"homozyg_kb": 4000})
+}
+
+# Same defaults as benchmarks/roh_parity.py
+KB_TOLERANCE = 0.05
+OVERLAP_TOLERANCE = 0.05
+
+def _reports(case: str) -> tuple[list, list]:
+    tfile, params = CASES[case]
+    expected = [read_hom(FIXTURES / f"{case}.expected.hom"), read_hom_indiv(FIXTURES / f"{case}.expected.hom.indiv")]
+    return expected, native_roh(FIXTURES / tfile, **params)
+
+@pytest.mark.parametrize("case", CASES)
+def test_roh_within_tolerances(case):
+    expected, native = _reports(case)
+    result = parity(expected, native)
+    assert result["nseg_mismatches"] == 0
+    assert result["worst_kb"] <= KB_TOLERANCE
+    assert result["overlap"] >= 1 - OVERLAP_TOLERANCE
+
+@pytest.mark.parametrize("case", CASES)
+def test_roh_segments_match(case):
+    (expected_hom, expected_indiv), (native_hom, native_indiv) = _reports(case)
+    columns = ["IID", "CHR", "SNP1", "SNP2", "POS1", "POS2", "NSNP"]
+    assert native_hom.select(columns).rows() == expected_hom.select(columns).rows()
+    assert native_hom["KB"].to_list() == pytest.approx(expected_hom["KB"].to_list(), abs=1e-3)
+    assert native_hom["PHET"].to_list() == pytest.approx(expected_hom["PHET"].to_list(), abs=1e-3)
+    assert native_indiv["NSEG"].to_list() == expected_indiv["NSEG"].to_list()
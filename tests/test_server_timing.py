@@ -0,0 +1,35 @@
+"""
+The Server-Timing header of analysis results: small bodies are serialized before the header is built, so
+it includes their serialize_* stages; streamed bodies have their full timings logged once sent.
+"""
+import logging
+
+import polars as pl
+
+from jobs import Job
+import responses
+
+def _completed_job(main) -> str:
+    job = Job(id="timed", kind="roh", status="completed")
+    job.result = {"status": "success", "roh": pl.DataFrame({"CHR": [1, 2], "KB": [1500.0, 2400.0]})}
+    main.job_queue._jobs[job.id] = job
+    return job.id
+
+def test_json_result_reports_serialize_json(client):
+    main, client = client
+    response = client.get(f"/jobs/{_completed_job(main)}", headers={"Accept": "application/json"})
+    assert response.status_code == 200
+    assert response.json()["result"]["roh"] == [{"CHR": 1, "KB": 1500.0}, {"CHR": 2, "KB": 2400.0}]
+    stages = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+    assert "serialize_json" in stages
+    assert stages[-1] == "total"
+
+def test_streamed_result_logs_its_timings(client, monkeypatch, caplog):
+    main, client = client
+    monkeypatch.setattr(responses, "BUFFER_BYTES", 0)
+    with caplog.at_level(logging.INFO, logger="main"):
+        response = client.get(f"/jobs/{_completed_job(main)}", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 3
+    assert "serialize_ndjson" not in response.headers["Server-Timing"]
+    assert any("serialize_ndjson" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,60 @@
+"""
+GenotypeCache: its per-key load locks don't grow with the dogs seen, and invalidated entries are read again.
+"""
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import polars as pl
+
+from stored_genotypes import GenotypeCache
+
+def _frame(dog: int) -> pl.DataFrame:
+    return pl.DataFrame({"snp": ["snp0", "snp1"], "dog": [dog, dog]})
+
+def test_key_locks_are_bounded():
+    cache = GenotypeCache(max_bytes=1024, ttl=0)
+    locks = len(cache._key_locks)
+    for dog in range(1000):
+        cache.get(dog, None, lambda dog, source: _frame(dog))
+    cache.invalidate()
+    assert len(cache._key_locks) == locks
+    assert cache.stats()["entries"] == 0
+
+def test_invalidated_dog_is_read_again():
+    cache = GenotypeCache(max_bytes=1024 ** 2, ttl=0)
+    loads = []
+
+    def load(dog, source):
+        loads.append((dog, source))
+        return _frame(dog)
+
+    for source in (None, 1):
+        cache.get(7, source, load)
+    cache.get(8, None, load)
+    assert cache.get(7, None, load) is not None and len(loads) == 3
+
+    assert cache.invalidate(7) == 2
+    cache.get(7, None, load)
+    cache.get(8, None, load)
+    assert loads == [(7, None), (7, 1), (8, None), (7, None)]
+
+def test_load_running_during_invalidate_is_not_cached():
+    cache = GenotypeCache(max_bytes=1024 ** 2, ttl=0)
+    loading, invalidated = threading.Event(), threading.Event()
+
+    def stale_load(dog, source):
+        loading.set()
+        invalidated.wait(timeout=5)
+        return _frame(dog)
+
+    thread = threading.Thread(target=cache.get, args=(7, None, stale_load), daemon=True)
+    thread.start()
+    assert loading.wait(timeout=5)
+    cache.invalidate(7)
+    invalidated.set()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,49 @@
+"""
+/snp_upload's cohort append: the dog's cohort row is reported, and a failed append doesn't fail the upload;
+and the upload drops the dog's cached stored genotypes.
+"""
+import io
+import zipfile
+from pathlib import Path
+
+import polars as pl
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures" / "roh"
+
+def _archive() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for suffix in (".tped", ".tfam"):
+            archive.write(FIXTURES / f"dog_a{suffix}", f"dog_a{suffix}")
+    return buffer.getvalue()
+
+def _upload(client, dog_id: int):
+    return client.post("/snp_upload", params={"dog_id": dog_id},
+                       files={"file": ("dog_a.zip", _archive(), "application/zip")})
+
+def test_upload_reports_cohort_row(client):
+    main, client = client
+    response = _upload(client, 7)
+    assert response.status_code == 200
+    assert response.json()["cohort_row"] == 0
+
+def test_cohort_failure_does_not_fail_upload(client, monkeypatch):
+    main, client = client
+
+    def fail(*args):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(main.get_cohort(), "add", fail)
+    response = _upload(client, 7)
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "success"
+    assert response.json()["cohort_row"] is None
+
+def test_upload_invalidates_cached_genotypes(client):
+    main, client = client
+    cache = main.get_genotype_cache()
+    cache.get(7, None, lambda dog, source: pl.DataFrame({"snp": ["snp0"]}))
+    cache.get(8, None, lambda dog, source: pl.DataFrame({"snp": ["snp0"]}))
+    assert _upload(client, 7).status_code == 200
+    assert [key[0] for key in cache._entries] == [8]
+    cache.invalidate()
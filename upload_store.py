@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import BinaryIO, NamedTuple, Optional
+
+from zip_file_handler import CHUNK_SIZE, ZipMember, unzip_file
+
+# Name of the file listing the extracted members; written last, so its presence marks a complete extraction
+MANIFEST_NAME = ".manifest.json"
+
+# Uploads used more recently than this are never evicted: queued jobs may still read their extracted files
+MIN_RETENTION_SECONDS = 24 * 3600
+
+class StoredUpload(NamedTuple):
+    """An archive held in the upload store and its extracted copy."""
+    digest: str
+    archive_path: Path
+    extracted_path: Path
+    contents: dict[str, ZipMember]
+    reused: bool
+
+class UploadStore:
+    """
+    Content-addressed store for uploaded zip archives.
+
+    Each archive is kept once, as `archives/{sha256}.zip`, next to a single extracted copy in `{sha256}/`.
+    Uploading the same bytes again resolves to the existing copy, so the copy, the unzip and anything
+    derived from the extracted files (e.g. PLINK binary filesets) are reused.
+
+    Uploads not used for `ttl` seconds are removed, then the least recently used ones until the store fits
+    in `max_bytes`; uploads used within MIN_RETENTION_SECONDS are always kept.
+
+    Args:
+        root (Path): Folder holding the store.
+        max_member_size (int): Maximum uncompressed size of an archive member in bytes (default: no limit).
+        max_compression_ratio (float): Maximum compression ratio of an archive member (default: no limit).
+        max_members (int): Maximum number of members of an archive (default: no limit).
+        max_bytes (int): Size budget of the archives and their extracted copies in bytes (0 = no limit).
+        ttl (float): Seconds an unused upload is kept (0 = no expiry).
+    """
+
+    def __init__(self, root: Path, max_member_size: Optional[int] = None,
+                 max_compression_ratio: Optional[float] = None, max_bytes: int = 0, ttl: float = 0,
+                 max_members: Optional[int] = None) -> None:
+        self.root = Path(root)
+        self.max_member_size = max_member_size
+        self.max_compression_ratio = max_compression_ratio
+        self.max_members = max_members
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evictions = 0
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        (self.root / "archives").mkdir(parents=True, exist_ok=True)
+
+    def _lock(self, digest: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(digest, threading.Lock())
+
+    def archive_path(self, digest: str) -> Path:
+        return self.root / "archives" / f"{digest}.zip"
+
+    def extracted_path(self, digest: str) -> Path:
+        return self.root / digest
+
+    def put(self, source: BinaryIO) -> StoredUpload:
+        """
+        Stores an uploaded archive, hashing it while it is streamed to disk.
+
+        Args:
+            source (BinaryIO): The uploaded file, read in chunks from its current position.
+
+        Returns:
+            StoredUpload: The digest, archive path and extracted copy of the upload.
+        """
+        temp_path = self.root / "archives" / f".upload-{uuid.uuid4().hex}"
+        sha256 = hashlib.sha256()
+        try:
+            with temp_path.open("wb") as buffer:
+                while chunk := source.read(CHUNK_SIZE):
+                    sha256.update(chunk)
+                    buffer.write(chunk)
+            digest = sha256.hexdigest()
+
+            with self._lock(digest):
+                archive_path = self.archive_path(digest)
+                archive_reused = archive_path.exists()
+                if archive_reused:
+                    # Marks the upload as recently used for eviction
+                    os.utime(archive_path)
+                else:
+                    os.replace(temp_path, archive_path)
+                try:
+                    contents, extraction_reused = self._extract(digest)
+                except Exception:
+                    # Don't keep archives that can't be extracted, e.g. over the size limits
+                    if not archive_reused:
+                        archive_path.unlink(missing_ok=True)
+                    raise
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+        if self.max_bytes or self.ttl:
+            self.evict(keep=digest)
+        return StoredUpload(
+            digest=digest,
+            archive_path=archive_path,
+            extracted_path=self.extracted_path(digest),
+            contents=contents,
+            reused=archive_reused and extraction_reused
+        )
+
+    def get(self, digest: str) -> Optional[StoredUpload]:
+        """
+        Returns a stored upload by digest, or None if it isn't in the store.
+        """
+        contents = self._read_manifest(digest)
+        if contents is None:
+            return None
+        return StoredUpload(digest, self.archive_path(digest), self.extracted_path(digest), contents, True)
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Removes expired uploads, then the least recently used ones until the store fits its size budget.
+        Returns the number of uploads removed.
+        """
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for digest, size, last_used in entries:
+            if now - last_used < MIN_RETENTION_SECONDS:
+                break
+            expired = self.ttl and now - last_used > self.ttl
+            if not (expired or (self.max_bytes and total > self.max_bytes)):
+                break
+            if digest == keep:
+                continue
+            with self._lock(digest):
+                # The manifest goes first, so a half-removed upload is extracted again rather than reused
+                (self.extracted_path(digest) / MANIFEST_NAME).unlink(missing_ok=True)
+                shutil.rmtree(self.extracted_path(digest), ignore_errors=True)
+                self.archive_path(digest).unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        self.evictions += removed
+        return removed
+
+    def _entries(self) -> list[tuple[str, int, float]]:
+        """
+        Lists the stored uploads as (digest, size in bytes of the archive and its extracted copy, last use time).
+        """
+        entries = []
+        for archive in (self.root / "archives").glob("*.zip"):
+            digest = archive.stem
+            try:
+                size = archive.stat().st_size + sum(
+                    file.stat().st_size for file in self.extracted_path(digest).rglob("*") if file.is_file()
+                )
+                entries.append((digest, size, archive.stat().st_mtime))
+            except FileNotFoundError:
+                # Evicted concurrently
+                continue
+        return entries
+
+    def _extract(self, digest: str) -> tuple[dict[str, ZipMember], bool]:
+        """
+        Extracts an archive into its digest folder, unless a complete copy is already there.
+
+        Must be called with the digest lock held.
+        """
+        contents = self._read_manifest(digest)
+        if contents is not None:
+            return contents, True
+
+        extracted_path = self.extracted_path(digest)
+        # A folder without a manifest is a leftover of an interrupted extraction
+        shutil.rmtree(extracted_path, ignore_errors=True)
+        temp_path = self.root / f".extract-{uuid.uuid4().hex}"
+        try:
+            _, contents = unzip_file(
+                self.archive_path(digest),
+                temp_path,
+                max_member_size=self.max_member_size,
+                max_compression_ratio=self.max_compression_ratio,
+                max_members=self.max_members
+            )
+            manifest = {name: [member.file_size, member.compress_size, member.crc]
+                        for name, member in contents.items()}
+            (temp_path / MANIFEST_NAME).write_text(json.dumps(manifest))
+            os.replace(temp_path, extracted_path)
+        except Exception:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+
+        return self._read_manifest(digest) or {}, False
+
+    def _read_manifest(self, digest: str) -> Optional[dict[str, ZipMember]]:
+        extracted_path = self.extracted_path(digest)
+        manifest_path = extracted_path / MANIFEST_NAME
+        if not manifest_path.exists():
+            return None
+        manifest = json.loads(manifest_path.read_text())
+        return {
+            name: ZipMember(extracted_path / name, file_size, compress_size, crc)
+            for name, (file_size, compress_size, crc) in manifest.items()
+        }
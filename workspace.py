@@ -0,0 +1,219 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, NamedTuple, Optional
+
+from metrics import registry
+
+registry.describe("snp_workspace_scratch_active", "gauge", "Scratch workspaces currently open.")
+registry.describe("snp_workspace_artifact_bytes", "gauge", "Bytes of promoted analysis artifacts kept on disk.")
+registry.describe("snp_workspace_evictions_total", "counter",
+                  "Promoted artifact folders removed by the retention policy.")
+
+# Scratch folders older than this are leftovers of a crashed process and are removed
+SCRATCH_STALE_SECONDS = 24 * 3600
+
+class Workspace(NamedTuple):
+    """An isolated scratch folder for one analysis run, and where its artifacts are promoted to."""
+    path: Path
+    kind: str
+    name: str
+    manager: "WorkspaceManager"
+
+    def prefix(self, stem: str) -> Path:
+        """Returns a PLINK --out prefix inside the workspace."""
+        return self.path / stem
+
+    def promote(self, *patterns: str) -> Optional[Path]:
+        """
+        Moves the files matching glob patterns (relative to the workspace) to the artifact store, and
+        returns the artifact folder (None if nothing matched). Everything else is dropped with the workspace.
+        """
+        return self.manager.promote(self, patterns)
+
+class WorkspaceManager:
+    """
+    Gives every analysis run its own scratch folder and keeps only the artifacts worth keeping.
+
+    PLINK intermediates (binary filesets, merged filesets, merge lists, --keep files, shard reports) are
+    written under `scratch_root`, e.g. a tmpfs mount such as /dev/shm, and removed when the run ends.
+    Final reports are promoted to `{artifacts_root}/{kind}/{name}/{run}/` on disk, where runs older than
+    `max_age` seconds are removed, then the oldest ones until the artifacts fit in `max_bytes`.
+
+    Args:
+        scratch_root (Path): Folder holding the scratch workspaces.
+        artifacts_root (Path): Folder holding the promoted artifacts.
+        max_bytes (int): Size budget of the promoted artifacts in bytes (0 = no limit).
+        max_age (float): Seconds promoted artifacts are kept (0 = no limit).
+        fallback_root (Path): Scratch folder used when `scratch_root` has less than `min_free_bytes` free
+            (default: no fallback), so a full tmpfs doesn't fail PLINK runs.
+        min_free_bytes (int): Free space `scratch_root` needs for new workspaces to be opened on it.
+    """
+
+    def __init__(self, scratch_root: Path, artifacts_root: Path, max_bytes: int = 0, max_age: float = 0,
+                 fallback_root: Optional[Path] = None, min_free_bytes: int = 0) -> None:
+        self.scratch_root = Path(scratch_root)
+        self.artifacts_root = Path(artifacts_root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fallback_root = Path(fallback_root) if fallback_root else None
+        self.min_free_bytes = min_free_bytes
+        self.evictions = 0
+        self._active = 0
+        self._lock = threading.Lock()
+        for root in (self.scratch_root, self.artifacts_root, self.fallback_root):
+            if root is not None:
+                root.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "WorkspaceManager":
+        """
+        Build a manager from WORKSPACE_SCRATCH_DIR (default: workspace/scratch, e.g. /dev/shm/snp for tmpfs),
+        WORKSPACE_ARTIFACTS_DIR (default: workspace/artifacts), WORKSPACE_MAX_BYTES (default: 5 GiB),
+        WORKSPACE_RETENTION_SECONDS (default: 7 days) and WORKSPACE_SCRATCH_MIN_FREE_BYTES (default: 1 GiB,
+        below which scratch falls back to workspace/scratch when WORKSPACE_SCRATCH_DIR is elsewhere)
+        """
+        default_scratch = Path("workspace/scratch")
+        scratch_root = Path(os.getenv("WORKSPACE_SCRATCH_DIR") or default_scratch)
+        return cls(
+            scratch_root=scratch_root,
+            artifacts_root=Path(os.getenv("WORKSPACE_ARTIFACTS_DIR", "workspace/artifacts")),
+            max_bytes=int(os.getenv("WORKSPACE_MAX_BYTES", str(5 * 1024 ** 3))),
+            max_age=float(os.getenv("WORKSPACE_RETENTION_SECONDS", str(7 * 24 * 3600))),
+            fallback_root=default_scratch if scratch_root != default_scratch else None,
+            min_free_bytes=int(os.getenv("WORKSPACE_SCRATCH_MIN_FREE_BYTES", str(1024 ** 3)))
+        )
+
+    def stats(self) -> dict[str, Any]:
+        artifacts = self._artifacts()
+        return {
+            "scratch_active": self._active,
+            "scratch_root": str(self.scratch_root),
+            "artifacts": len(artifacts),
+            "artifact_bytes": sum(size for _, size, _ in artifacts),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions
+        }
+
+    @contextmanager
+    def open(self, kind: str, name: object) -> Iterator[Workspace]:
+        """
+        Creates a scratch workspace for one run and removes it, with whatever wasn't promoted, on exit.
+
+        Args:
+            kind (str): The analysis, e.g. "roh" or "parentage".
+            name (object): What the analysis is about, e.g. the dog ID.
+        """
+        path = self._scratch_root() / f"{kind}-{name}-{uuid.uuid4().hex}"
+        path.mkdir(parents=True)
+        with self._lock:
+            self._active += 1
+            registry.set("snp_workspace_scratch_active", self._active)
+        try:
+            yield Workspace(path, kind, str(name), self)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._active -= 1
+                registry.set("snp_workspace_scratch_active", self._active)
+
+    def promote(self, workspace: Workspace, patterns: tuple[str, ...]) -> Optional[Path]:
+        """
+        Moves the files of a workspace matching glob patterns to a new artifact folder, then applies the
+        retention policy. See Workspace.promote.
+        """
+        files = sorted({file for pattern in patterns for file in workspace.path.glob(pattern) if file.is_file()})
+        if not files:
+            return None
+
+        run = f"{time.strftime('%Y%m%dT%H%M%S')}-{workspace.path.name.rsplit('-', 1)[-1][:8]}"
+        destination = self.artifacts_root / workspace.kind / workspace.name / run
+        # Moved under a hidden name first, so eviction never sees a half-promoted run
+        temp = destination.parent / f".promote-{run}"
+        temp.mkdir(parents=True)
+        try:
+            for file in files:
+                shutil.move(file, temp / file.name)
+            os.replace(temp, destination)
+        except Exception:
+            shutil.rmtree(temp, ignore_errors=True)
+            raise
+
+        self.evict(keep=destination)
+        return destination
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        """
+        Removes expired artifact folders, then the oldest ones until the artifacts fit the size budget, and
+        stale scratch folders. Returns the number of artifact folders removed.
+        """
+        now = time.time()
+        removed = 0
+        with self._lock:
+            artifacts = sorted(self._artifacts(), key=lambda artifact: artifact[2])
+            total = sum(size for _, size, _ in artifacts)
+            for path, size, mtime in artifacts:
+                expired = self.max_age and now - mtime > self.max_age
+                over_budget = self.max_bytes and total > self.max_bytes
+                if not (expired or over_budget):
+                    break
+                if path == keep:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                removed += 1
+            self.evictions += removed
+            registry.set("snp_workspace_artifact_bytes", total)
+        if removed:
+            registry.inc("snp_workspace_evictions_total", removed)
+
+        for root in (self.scratch_root, self.fallback_root):
+            for path in root.iterdir() if root is not None and root.exists() else []:
+                try:
+                    if now - path.stat().st_mtime > SCRATCH_STALE_SECONDS:
+                        shutil.rmtree(path, ignore_errors=True)
+                except FileNotFoundError:
+                    continue
+        return removed
+
+    def _scratch_root(self) -> Path:
+        if self.fallback_root is not None and self.min_free_bytes:
+            try:
+                if shutil.disk_usage(self.scratch_root).free < self.min_free_bytes:
+                    return self.fallback_root
+            except OSError:
+                return self.fallback_root
+        return self.scratch_root
+
+    def _artifacts(self) -> list[tuple[Path, int, float]]:
+        """
+        Lists the promoted artifact folders as (path, size in bytes, promotion time).
+        """
+        artifacts = []
+        for run in self.artifacts_root.glob("*/*/*"):
+            if run.name.startswith(".") or not run.is_dir():
+                continue
+            try:
+                size = sum(file.stat().st_size for file in run.iterdir())
+                artifacts.append((run, size, run.stat().st_mtime))
+            except FileNotFoundError:
+                # Evicted concurrently
+                continue
+        return artifacts
+
+_workspaces: Optional[WorkspaceManager] = None
+_workspaces_lock = threading.Lock()
+
+def get_workspaces() -> WorkspaceManager:
+    """
+    Returns the process-wide workspace manager, configured from the environment.
+    """
+    global _workspaces
+    with _workspaces_lock:
+        if _workspaces is None:
+            _workspaces = WorkspaceManager.from_env()
+    return _workspaces
@@ -1,32 +1,159 @@
 import zipfile
 import os
 from pathlib import Path
+from typing import BinaryIO, Iterator, NamedTuple, Optional
 
-def unzip_file(file_path: Path, output_folder: Path = Path("uploads")) -> tuple[Path, dict[str, bytes]]:
+from metrics import span
+
+# Size of the blocks read from an archive member at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Optional limits on every archive unzipped or streamed, to refuse zip bombs: number of members, and
+# uncompressed size and compression ratio of a member (0 = no limit)
+UNZIP_MAX_MEMBERS = int(os.getenv("UNZIP_MAX_MEMBERS", "0")) or None
+UNZIP_MAX_MEMBER_BYTES = int(os.getenv("UNZIP_MAX_MEMBER_BYTES", "0")) or None
+UNZIP_MAX_COMPRESSION_RATIO = float(os.getenv("UNZIP_MAX_COMPRESSION_RATIO", "0")) or None
+
+class ZipLimitError(ValueError):
+    """Raised when an archive exceeds the configured member-count, size or compression-ratio limits."""
+
+class ZipMember(NamedTuple):
+    """Metadata of an extracted archive member."""
+    path: Path
+    file_size: int
+    compress_size: int
+    crc: int
+
+def _check_member_count(zip_ref: zipfile.ZipFile, max_members: Optional[int]) -> None:
+    """
+    Rejects an archive with more members than the limit, before anything is decompressed.
+    """
+    if max_members is not None:
+        count = sum(1 for info in zip_ref.infolist() if not info.is_dir())
+        if count > max_members:
+            raise ZipLimitError(f"The archive has {count} members, above the limit of {max_members}")
+
+def _check_member_limits(info: zipfile.ZipInfo, max_member_size: Optional[int],
+                         max_compression_ratio: Optional[float]) -> None:
+    """
+    Rejects a member whose declared sizes exceed the limits, before anything is decompressed.
+    """
+    if max_member_size is not None and info.file_size > max_member_size:
+        raise ZipLimitError(f"{info.filename} is {info.file_size} bytes, above the limit of {max_member_size} bytes")
+    if max_compression_ratio is not None and info.file_size > 0:
+        ratio = info.file_size / max(info.compress_size, 1)
+        if ratio > max_compression_ratio:
+            raise ZipLimitError(f"{info.filename} has a compression ratio of {ratio:.0f}, above the limit of "
+                                f"{max_compression_ratio:.0f}")
+
+def _iter_member(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo, max_member_size: Optional[int],
+                 chunk_size: int) -> Iterator[bytes]:
+    """
+    Yields the decompressed bytes of a member chunk by chunk.
+
+    The running size is checked as well, as the sizes declared in the archive can't be trusted.
+    """
+    read = 0
+    with zip_ref.open(info) as member:
+        while chunk := member.read(chunk_size):
+            read += len(chunk)
+            if max_member_size is not None and read > max_member_size:
+                raise ZipLimitError(f"{info.filename} is above the limit of {max_member_size} bytes")
+            yield chunk
+
+def _safe_destination(output_folder: Path, file_name: str) -> Path:
+    """
+    Resolves the extraction path of a member, refusing names that would escape the output folder.
+    """
+    destination = (Path(output_folder) / file_name).resolve()
+    if not destination.is_relative_to(Path(output_folder).resolve()):
+        raise ZipLimitError(f"{file_name} would be extracted outside of {output_folder}")
+    return destination
+
+def unzip_file(file_path: Path, output_folder: Path = Path("uploads"), max_member_size: Optional[int] = None,
+               max_compression_ratio: Optional[float] = None, chunk_size: int = CHUNK_SIZE,
+               max_members: Optional[int] = None) -> tuple[Path, dict[str, ZipMember]]:
     """Unzips a zip file to the specified output folder.
 
+    Members are streamed to disk in chunks, so memory use doesn't depend on the archive size.
+
     Args:
         file_path (str): The path to the zip file.
         output_folder (str): The folder where the contents will be extracted.
+        max_member_size (int): Maximum uncompressed size of a member in bytes (default: no limit).
+        max_compression_ratio (float): Maximum uncompressed/compressed size ratio of a member (default: no limit).
+        chunk_size (int): Number of bytes read from a member at a time.
+        max_members (int): Maximum number of members in the archive (default: no limit).
 
     Returns:
-        tuple[str, dict[str, bytes]]: A tuple containing the path to the extracted folder and a dictionary
-            of file names and their contents.
+        tuple[Path, dict[str, ZipMember]]: A tuple containing the path to the extracted folder and a dictionary
+            of file names and their metadata.
     """
 
-    zip_name = os.path.basename(file_path)
     os.makedirs(output_folder, exist_ok=True)  # Ensure the subfolder exists
     contents = {}
 
-    with zipfile.ZipFile(file_path, 'r') as zip_ref:
-        for file_name in zip_ref.namelist():
-            with zip_ref.open(file_name) as file:
-                file_content = file.read()
-                contents[file_name] = file_content
+    with span("unzip"), zipfile.ZipFile(file_path, 'r') as zip_ref:
+        _check_member_count(zip_ref, max_members)
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            _check_member_limits(info, max_member_size, max_compression_ratio)
+            destination = _safe_destination(output_folder, info.filename)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+
+            # Save the file to the target folder
+            with open(destination, 'wb') as output_file:
+                for chunk in _iter_member(zip_ref, info, max_member_size, chunk_size):
+                    output_file.write(chunk)
 
-                # Save the file to the target folder
-                with open(os.path.join(output_folder, file_name), 'wb') as output_file:
-                    output_file.write(file_content)
+            contents[info.filename] = ZipMember(
+                path=destination,
+                file_size=info.file_size,
+                compress_size=info.compress_size,
+                crc=info.CRC
+            )
 
     print("Unzipping completed. Contents:", contents.keys())
-    return output_folder, contents
\ No newline at end of file
+    return output_folder, contents
+
+def _find_member(zip_ref: zipfile.ZipFile, suffix: str) -> zipfile.ZipInfo:
+    info = next((info for info in zip_ref.infolist() if info.filename.endswith(suffix)), None)
+    if info is None:
+        raise FileNotFoundError(f"No {suffix} file found in the zip archive.")
+    return info
+
+def iter_member_lines(file_path: Path | BinaryIO, suffix: str = ".tped", chunk_size: int = CHUNK_SIZE,
+                      max_member_size: Optional[int] = None,
+                      max_compression_ratio: Optional[float] = None,
+                      max_members: Optional[int] = None) -> Iterator[bytes]:
+    """Streams the first member ending in `suffix` straight out of the archive, without extracting it.
+
+    Args:
+        file_path (Path | BinaryIO): The path to the zip file, or an open binary file.
+        suffix (str): Extension of the member to stream (default: ".tped").
+        chunk_size (int): Approximate number of bytes per yielded block.
+        max_member_size (int): Maximum uncompressed size of the member in bytes (default: no limit).
+        max_compression_ratio (float): Maximum uncompressed/compressed size ratio (default: no limit).
+        max_members (int): Maximum number of members in the archive (default: no limit).
+
+    Yields:
+        bytes: Blocks of the member that always end on a line boundary.
+    """
+
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        _check_member_count(zip_ref, max_members)
+        info = _find_member(zip_ref, suffix)
+        _check_member_limits(info, max_member_size, max_compression_ratio)
+
+        remainder = b""
+        for chunk in _iter_member(zip_ref, info, max_member_size, chunk_size):
+            block = remainder + chunk
+            cut = block.rfind(b"\n") + 1
+            if cut:
+                remainder = block[cut:]
+                yield block[:cut]
+            else:
+                remainder = block
+        if remainder:
+            yield remainder